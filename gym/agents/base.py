@@ -1,9 +1,43 @@
+import numpy as np
+
+from gym import error
+
+
+def stack_obs(obs_batch):
+    """Returns a batch of observations (a sequence of observations, or a dict of
+    arrays with a leading slot axis as returned by vectorized goal envs) as a dict of
+    arrays for dict observations, or as an array otherwise."""
+    if isinstance(obs_batch, dict):
+        return {k: np.asarray(v) for k, v in obs_batch.items()}
+    if len(obs_batch) > 0 and isinstance(obs_batch[0], dict):
+        return {k: np.array([o[k] for o in obs_batch]) for k in obs_batch[0].keys()}
+    return np.asarray(obs_batch)
+
+
+def unstack_obs(obs_batch) -> list:
+    """Inverse of stack_obs: returns a list with the observation of each slot."""
+    if isinstance(obs_batch, dict):
+        n = len(next(iter(obs_batch.values())))
+        return [{k: v[i] for k, v in obs_batch.items()} for i in range(n)]
+    return list(obs_batch)
+
 
 class BaseAgent(object):
+    """Base class of the agents.
+
+    `predict` returns the action for a single observation. `predict_batch` returns the
+    actions for a batch of observations, one for each env slot (e.g. of a vectorized env),
+    keeping a separate episode state for each slot; `reset_slots` resets the state of some
+    of them. The default implementation swaps the episode state returned by
+    `_initial_episode_state` in and out of the agent around a `predict` call per slot.
+    Scripted agents can override both methods to keep the state of all slots in arrays
+    and compute their phase transitions with vectorized masks.
+    """
 
     def __init__(self, env, **kwargs):
         super(BaseAgent).__init__()
         self._env = env
+        self._slot_states = None
 
     def reset(self, **kwargs):
         pass
@@ -11,6 +45,60 @@ class BaseAgent(object):
     def predict(self, obs, **kwargs):
         raise NotImplementedError()
 
+    # Batched prediction
+    # ----------------------------
+
+    def _initial_episode_state(self) -> dict:
+        """Returns the attributes holding the per-episode state, with their values at
+        the beginning of an episode."""
+        return dict()
+
+    def _bind_env(self, env):
+        """Makes the agent act in `env`, used by predict_batch to switch between env slots."""
+        self._env = env
+
+    def reset_slots(self, slots=None):
+        """Resets the episode state of the given env slots (all of them if None)."""
+        if self._slot_states is None:
+            return
+        if slots is None:
+            slots = range(len(self._slot_states))
+        for i in slots:
+            self._slot_states[i] = self._initial_episode_state()
+
+    def predict_batch(self, obs_batch, envs=None, **kwargs) -> np.ndarray:
+        """Returns an array with the action of each env slot.
+
+        Args:
+            obs_batch: sequence of observations, or dict of arrays with a leading slot axis.
+            envs (Sequence[gym.Env]): env of each slot, needed by agents reading the env state.
+        """
+        observations = unstack_obs(obs_batch)
+        n_slots = len(observations)
+        if envs is not None and len(envs) != n_slots:
+            raise error.Error('Expected {} envs, got {}'.format(n_slots, len(envs)))
+        if self._slot_states is None or len(self._slot_states) != n_slots:
+            self._slot_states = [self._initial_episode_state() for _ in range(n_slots)]
+
+        state_keys = self._initial_episode_state().keys()
+        own_state = {k: getattr(self, k) for k in state_keys}
+        own_env = self._env
+
+        actions = []
+        try:
+            for i, obs in enumerate(observations):
+                for k, v in self._slot_states[i].items():
+                    setattr(self, k, v)
+                if envs is not None:
+                    self._bind_env(envs[i])
+                actions.append(np.asarray(self.predict(obs, **kwargs)))
+                self._slot_states[i] = {k: getattr(self, k) for k in state_keys}
+        finally:
+            for k, v in own_state.items():
+                setattr(self, k, v)
+            self._bind_env(own_env)
+        return np.array(actions)
+
 
 class RandomAgent(BaseAgent):
 
@@ -1,7 +1,7 @@
 import numpy as np
 
 import gym
-from gym.agents.base import BaseAgent
+from gym.agents.base import BaseAgent, stack_obs
 from gym.utils import transformations as tf
 
 
@@ -12,6 +12,73 @@ class FetchPickAndPlaceAgent(BaseAgent):
         self._phase = -1
         self._phase_steps = 0
         self._goal = None
+        self._phases = None
+        self._goals = None
+
+    def _initial_episode_state(self):
+        return dict(_phase=-1, _phase_steps=0, _goal=None)
+
+    def reset_slots(self, slots=None):
+        super(FetchPickAndPlaceAgent, self).reset_slots(slots)
+        if self._phases is not None:
+            if slots is None:
+                slots = slice(None)
+            self._phases[slots] = -1
+            self._goals[slots] = np.nan
+
+    def predict_batch(self, obs_batch, envs=None, **kwargs):
+        """Vectorized version of predict, in which the button and rotating platform tasks
+        fall back to a predict call per slot. Without `envs`, all slots share the table of the agent's env."""
+
+        raw_env = self._env.unwrapped
+        if raw_env.has_button or raw_env.has_rotating_platform:
+            return super(FetchPickAndPlaceAgent, self).predict_batch(obs_batch, envs=envs, **kwargs)
+
+        obs = stack_obs(obs_batch)
+        goal = obs['desired_goal']
+        n_slots = len(goal)
+        if self._phases is None or len(self._phases) != n_slots:
+            self._phases = np.full(n_slots, -1)
+            self._goals = np.full(goal.shape, np.nan)
+
+        new_goal = np.any(goal != self._goals, axis=1)
+        self._goals[new_goal] = goal[new_goal]
+        self._phases[new_goal] = -1
+
+        grasp_center_pos = obs['observation'][:, :3]
+        object_pos = obs['observation'][:, 3:6]
+        object_rel_pos = obs['observation'][:, 6:9]
+
+        object_oriented_goal = object_rel_pos.copy()
+        object_oriented_goal[:, 2] += 0.03 # first make the gripper go slightly above the object
+
+        if envs is None:
+            table_pos = raw_env.get_table_surface_pose()[None, :3]
+        else:
+            table_pos = np.array([env.unwrapped.get_table_surface_pose()[:3] for env in envs])
+        phases = self._phases
+        phases[phases < 2] = 2
+
+        # phase transitions, in order, as a slot can go through several of them in the same step
+        lift = np.abs(table_pos[:, 2] - grasp_center_pos[:, 2]) < 0.07
+        phases[(phases == 2) & ~lift] = 3
+        phases[(phases == 3) & (np.linalg.norm(object_oriented_goal, axis=1) < 0.005)] = 4
+        phases[(phases == 4) & (np.linalg.norm(object_rel_pos, axis=1) < 0.005)] = 5
+        phases[(phases == 5) & (np.linalg.norm(goal - object_pos, axis=1) < 0.01)] = 6
+
+        actions = np.zeros((n_slots, 4))
+        actions[phases == 2] = [0, 0, 0.4, 0.05]
+        m = phases == 3
+        actions[m, :3] = object_oriented_goal[m] * 6
+        actions[m, 3] = 0.05
+        m = phases == 4
+        actions[m, :3] = object_rel_pos[m] * 6
+        actions[m, 3] = -0.2
+        m = phases == 5
+        actions[m, :3] = (goal - object_pos)[m] * 6
+        actions[m, 3] = -0.2
+        actions[phases == 6, 3] = -0.2
+        return actions
 
     def predict(self, obs, **kwargs):
 
@@ -38,7 +105,7 @@ class FetchPickAndPlaceAgent(BaseAgent):
             u = np.zeros(4)
             if np.linalg.norm(object_pos[:2] - table_tf[:2]) > 0.38:
                 button_pos = raw_env.sim.data.get_geom_xpos('button_geom')
-                tf.render_pose(np.r_[button_pos, 1., 0., 0., 0.], raw_env.viewer)
+                raw_env.markers.pose(np.r_[button_pos, 1., 0., 0., 0.])
                 err = button_pos - grasp_center_pos
                 u[3] = -1.
                 u[:3] = err * 5.0
@@ -58,16 +125,16 @@ class FetchPickAndPlaceAgent(BaseAgent):
             if np.linalg.norm(object_pos[:2] - table_tf[:2]) > 0.22: # FIXME
                 far_end_pose = np.r_[
                     raw_env.sim.data.get_site_xpos('rotating_platform:far_end'),
-                    tf.rotations.mat2quat(raw_env.sim.data.get_site_xmat('rotating_platform:far_end')),
+                    tf.rotations.mat2quat_fast(raw_env.sim.data.get_site_xmat('rotating_platform:far_end')),
                 ]
 
                 close_end_pose = tf.apply_tf(np.r_[-0.5, -0.09, 0., 1., 0., 0., 0.], far_end_pose)
-                tf.render_pose(close_end_pose, raw_env.viewer, label="close_end")
+                raw_env.markers.pose(close_end_pose, label="close_end")
 
                 # push_target = np.r_[0.2, 0.2, 0., 1., 0., 0., 0.]
                 # push_target = tf.apply_tf(table_tf, push_target)
                 push_target = tf.apply_tf(np.r_[0., 0.1, 0., 1., 0., 0., 0.], close_end_pose)
-                tf.render_pose(push_target, raw_env.viewer)
+                raw_env.markers.pose(push_target)
 
                 if self._phase == -1:
                     close_end_pose[2] += 0.05
@@ -179,7 +246,7 @@ class FetchPushAgent(BaseAgent):
             u = np.zeros(4)
             if np.linalg.norm(object_pos[:2] - table_tf[:2]) > 0.38:
                 button_pos = raw_env.sim.data.get_geom_xpos('button_geom')
-                tf.render_pose(np.r_[button_pos, 1., 0., 0., 0.], raw_env.viewer)
+                raw_env.markers.pose(np.r_[button_pos, 1., 0., 0., 0.])
                 err = button_pos - grp_pos
                 u[3] = -1.
                 u[:3] = err * 5.0
@@ -1,9 +1,28 @@
 import numpy as np
 
-from gym.agents.base import BaseAgent
+import gym
+from gym.agents.base import BaseAgent, stack_obs
 import gym.utils.transformations as tf
 
 
+def _hand_ctrl(fingers, thumb, fixed=None):
+    ctrl = np.full(18, fingers)
+    for i, v in (fixed or dict()).items():
+        ctrl[i] = v
+    ctrl[13:] = thumb
+    return ctrl
+
+
+# hand controls of each strategy, while reaching and grasping the object
+_OPEN_CTRL_0 = _hand_ctrl(-1.0, (-1., -0.5, 1., -1., 0), {0: 1.0, 3: 1.0, 6: -1.0, 9: -1.0})
+_GRASP_CTRL_0 = _hand_ctrl(1.0, (0.1, 0.5, 1., -1., 0), {0: 1.0, 3: 1.0, 6: -1.0, 9: -1.0})
+_OPEN_CTRL_12 = _hand_ctrl(-1.0, (-1., 1., 1., -1., -1.))
+_GRASP_CTRL_1 = _hand_ctrl(-1.0, (-0.5, 1., 1., -1., -1.), {4: 0.6, 5: 0.5})
+_GRASP_CTRL_2 = _hand_ctrl(-1.0, (-0.1, 1., 1., -1., -1.), {6: -0.7, 7: 0.6, 8: 0.5})
+_OPEN_CTRL_3 = _hand_ctrl(-1.0, (0.2, -0.2, 1., -1., 1.))
+_GRASP_CTRL_3 = _hand_ctrl(1.0, (0.1, 0.5, 1., -1., 0))
+
+
 class HandPickAndPlaceAgent(BaseAgent):
 
     def __init__(self, env, **kwargs):
@@ -17,6 +36,11 @@ class HandPickAndPlaceAgent(BaseAgent):
         self._grasp_steps = 0
         self._strategy = 0
         self._phase = 0
+        self._goals = None
+        self._hand_ctrls = None
+        self._prev_ds = None
+        self._grasps_steps = None
+        self._phases = None
         if env.unwrapped.object_id == 'sphere':
             self._strategy = 1
         if env.unwrapped.object_id == 'small_box':
@@ -24,6 +48,12 @@ class HandPickAndPlaceAgent(BaseAgent):
         if env.unwrapped.object_id == 'teapot':
             self._strategy = 3
 
+    def reset_slots(self, slots=None):
+        if self._phases is not None:
+            if slots is None:
+                slots = slice(None)
+            self._goals[slots] = np.nan
+
     def _reset(self, obs=None):
         if obs is not None:
             self._goal = obs['desired_goal'].copy()
@@ -34,6 +64,136 @@ class HandPickAndPlaceAgent(BaseAgent):
         self._grasp_steps = 0
         self._phase = 0
 
+    def predict_batch(self, obs_batch, envs=None, **kwargs):
+        """Vectorized version of predict, for envs with the same object (and so strategy).
+        `envs` are required to read the hand and object poses of each slot."""
+
+        obs = stack_obs(obs_batch)
+        goal = obs['desired_goal']
+        n_slots = len(goal)
+        if envs is None:
+            if n_slots > 1:
+                raise gym.error.Error('HandPickAndPlaceAgent.predict_batch requires the envs of all slots')
+            envs = [self._env]
+        raw_envs = [env.unwrapped for env in envs]
+        if self._phases is None or len(self._phases) != n_slots:
+            self._goals = np.full(goal.shape, np.nan)
+            self._hand_ctrls = np.zeros((n_slots, 18))
+            self._prev_ds = np.zeros((n_slots, 3))
+            self._grasps_steps = np.zeros(n_slots, dtype=int)
+            self._phases = np.zeros(n_slots, dtype=int)
+
+        hand_ctrls, prev_ds, grasps_steps, phases = self._hand_ctrls, self._prev_ds, self._grasps_steps, self._phases
+        new_goal = np.any(goal != self._goals, axis=1)
+        self._goals[new_goal] = goal[new_goal]
+        hand_ctrls[new_goal] = 0.0
+        prev_ds[new_goal] = 0.0
+        grasps_steps[new_goal] = 0
+        phases[new_goal] = 0
+
+        strategy = self._strategy
+        obj_pos = obs['achieved_goal'][:, :3]
+        goal_d = goal[:, :3] - obs['achieved_goal'][:, :3]
+        d = obj_pos - np.array([raw_env._get_grasp_center_pose(no_rot=True)[:3] for raw_env in raw_envs])
+        # slots whose object fell get no action and keep their state
+        m = obj_pos[:, 2] >= 0.38
+
+        wrist_noise = np.zeros(n_slots)
+        arm_pos_noise = np.zeros(n_slots)
+        fingers_noise = np.zeros(n_slots)
+
+        if strategy == 0:
+            wrist_ctrl = -1.0
+            on_palm = np.zeros(n_slots, dtype=bool)
+            for i in np.flatnonzero(m & (np.linalg.norm(d, axis=1) < 0.05)):
+                contacts = raw_envs[i].get_object_contact_points()
+                on_palm[i] = any('palm' in x['body1'] or 'palm' in x['body2'] for x in contacts)
+
+            d += np.r_[0., -0.030, 0.0]
+            still = np.linalg.norm(d - prev_ds, axis=1) < np.where(grasps_steps > 10, 0.005, 0.002)
+            prev_ds[m] = d[m]
+
+            arm_pos_ctrl = d * 1.0
+            grasp = m & (on_palm | still)
+            hand_ctrls[m & ~grasp] = _OPEN_CTRL_0
+            hand_ctrls[grasp] = _GRASP_CTRL_0
+            arm_pos_ctrl[grasp] = 0.0
+            grasps_steps[grasp] += 1
+            lift = grasp & (grasps_steps > 10)
+            arm_pos_ctrl[lift] = goal_d[lift] * 0.5
+            grasps_steps[m & ~grasp] = 0
+
+        elif strategy in [1, 2]:
+            wrist_ctrl = 0.0
+            d += np.r_[0., -0.035, 0.025]
+            reached = m & (np.linalg.norm(d, axis=1) < np.where(grasps_steps > 10, 0.04, 0.02))
+
+            arm_pos_ctrl = d * 1.0
+            hand_ctrls[m & ~reached] = _OPEN_CTRL_12
+            hand_ctrls[reached] = _GRASP_CTRL_1 if strategy == 1 else _GRASP_CTRL_2
+            arm_pos_ctrl[reached] = 0.0
+            grasps_steps[reached] += 1
+            lift = reached & (grasps_steps > 10)
+            arm_pos_ctrl[lift] = goal_d[lift] * 0.5
+            grasps_steps[m & ~reached] = 0
+
+        elif strategy == 3:
+            wrist_ctrl = -0.5
+            obj_poses = np.array([raw_env._get_object_pose() for raw_env in raw_envs])
+            thdistal_pos = np.array([raw_env.sim.data.get_body_xpos('robot0:thdistal') for raw_env in raw_envs])
+            grasp_poses = tf.apply_tf(np.r_[0.015, -0.10, 0.075, 1., 0., 0., 0.], obj_poses)
+            pregrasp_poses = tf.apply_tf(np.r_[-0.08, 0., 0., 1., 0., 0., 0.], grasp_poses)
+
+            for i in np.flatnonzero(m):
+                markers = raw_envs[i].markers
+                if markers.enabled:
+                    markers.pose(obj_poses[i], size=0.4)
+                    markers.pose(grasp_poses[i], size=0.2)
+                    markers.pose(pregrasp_poses[i], size=0.2)
+
+            d = np.zeros((n_slots, 3))
+            d_thresh = np.full(n_slots, 0.008)
+            wrist_noise[:] = 0.1
+            arm_pos_noise[:] = 0.01
+            fingers_noise[:] = 0.2
+            hand_ctrls[m] = _OPEN_CTRL_3
+
+            p = m & (phases == 0)
+            d[p] = pregrasp_poses[p, :3] - thdistal_pos[p]
+            d[p, 2] = 0.0
+            arm_pos_noise[p] = 0.05
+            d_thresh[p] = 0.02
+            p = m & (phases == 1)
+            d[p] = pregrasp_poses[p, :3] - thdistal_pos[p]
+            d_thresh[p] = 0.01
+            p = m & (phases == 2)
+            d[p] = grasp_poses[p, :3] - thdistal_pos[p]
+            fingers_noise[p] = 0.05
+            p = m & (phases == 3)
+            fingers_noise[p] = 0.05
+            hand_ctrls[p] = _GRASP_CTRL_3
+            grasps_steps[p] += 1
+            lift = p & (grasps_steps > 5)
+            d[lift] = goal_d[lift]
+
+            next_phase = m & (phases < 3) & (np.linalg.norm(d, axis=1) < d_thresh)
+            phases[next_phase] += 1
+            grasps_steps[next_phase] = 0
+
+            arm_pos_ctrl = d * 2.0
+
+        else:
+            raise NotImplementedError
+
+        # the same random numbers as a predict call per slot, in order
+        noise = np.random.randn(np.count_nonzero(m), 22)
+        action = np.zeros((n_slots,) + self._env.action_space.shape)
+        action[m, 1] = wrist_ctrl + noise[:, 0] * wrist_noise[m]
+        action[m, -7:-4] = arm_pos_ctrl[m] + noise[:, 1:4] * arm_pos_noise[m, None]
+        action[m, 2:-7] = hand_ctrls[m] + noise[:, 4:] * fingers_noise[m, None]
+        action[m] = np.clip(action[m], self._env.action_space.low, self._env.action_space.high)
+        return action
+
     def predict(self, obs, **kwargs):
 
         if self._goal is None or np.any(self._goal != obs['desired_goal']):
@@ -133,11 +293,10 @@ class HandPickAndPlaceAgent(BaseAgent):
             grasp_pose = tf.apply_tf(np.r_[0.015, -0.10, 0.075, 1., 0., 0., 0.], obj_pose)
             pregrasp_pose = tf.apply_tf(np.r_[-0.08, 0., 0., 1., 0., 0., 0.], grasp_pose)
 
-            viewer = self._env.unwrapped.viewer
-            if viewer is not None:
-                tf.render_pose(obj_pose, viewer, size=0.4)
-                tf.render_pose(grasp_pose, viewer, size=0.2)
-                tf.render_pose(pregrasp_pose, viewer, size=0.2)
+            markers = self._env.unwrapped.markers
+            markers.pose(obj_pose, size=0.4)
+            markers.pose(grasp_pose, size=0.2)
+            markers.pose(pregrasp_pose, size=0.2)
 
             k = 2.0
             d_thresh = 0.008
@@ -0,0 +1,254 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from gym import spaces
+
+pytest.importorskip('mujoco_py')
+
+from gym.agents.fetch import FetchPickAndPlaceAgent
+from gym.agents.shadow_hand import HandPickAndPlaceAgent
+from gym.agents.yumi import YumiConstrainedAgent, YumiLiftAgent
+from gym.envs.robotics import HandPickAndPlaceEnv, rotations
+from gym.envs.yumi.yumi_constrained import YumiConstrainedEnv
+from gym.envs.yumi.yumi_env import YumiLiftEnv
+from gym.utils import transformations as tf
+
+
+N_SLOTS = 64
+N_STEPS = 200
+
+
+class PickAndPlaceStub(object):
+    """Kinematic pick and place: the gripper moves by the action, and carries the object
+    while it is closed around it."""
+
+    def __init__(self, seed):
+        self.np_random = np.random.RandomState(seed)
+        self.closed = False
+        self.reset()
+
+    def reset(self):
+        center = np.r_[1.3, 0.75, 0.42]
+        self.grip = center + self.np_random.uniform(-0.1, 0.1, 3) * [1, 1, 0]
+        self.obj = center + self.np_random.uniform(-0.15, 0.15, 3) * [1, 1, 0]
+        self.goal = self.obj + self.np_random.uniform(-0.2, 0.2, 3) * [1, 1, 0] + [0, 0, 0.1]
+        self.closed = False
+
+    def move(self, delta, closed):
+        self.grip = self.grip + np.clip(delta, -1, 1) * 0.03
+        self.closed = closed and np.linalg.norm(self.obj - self.grip) < 0.02
+        if self.closed:
+            self.obj = self.grip.copy()
+
+
+class FetchStub(PickAndPlaceStub):
+    has_button = False
+    has_rotating_platform = False
+
+    def __init__(self, seed):
+        super(FetchStub, self).__init__(seed)
+        # tables at different heights, so that the gripper starts above or below the lift threshold
+        self.table_pos = np.r_[1.3, 0.75, 0.3 + 0.05 * (seed % 4)]
+
+    @property
+    def unwrapped(self):
+        return self
+
+    def get_table_surface_pose(self):
+        return np.r_[self.table_pos, 1., 0., 0., 0.]
+
+    def obs(self):
+        return dict(observation=np.r_[self.grip, self.obj, self.obj - self.grip],
+                    achieved_goal=self.obj.copy(), desired_goal=self.goal.copy())
+
+    def step(self, u):
+        self.move(u[:3], u[3] < 0)
+
+
+class YumiSimStub(PickAndPlaceStub):
+    has_button = False
+    has_rotating_platform = False
+
+    def get_object_contact_points(self):
+        return [None] * 3 if self.closed else []
+
+
+class YumiStub(YumiConstrainedEnv):
+
+    def __init__(self, seed):
+        self.sim_env = YumiSimStub(seed)
+        self.action_space = spaces.Box(-1., 1., shape=(4,), dtype='float32')
+
+    def obs(self):
+        s = self.sim_env
+        observation = np.zeros(27)
+        observation[:3] = s.grip
+        observation[18:21] = s.obj
+        observation[24:27] = s.obj - s.grip
+        return dict(observation=observation, achieved_goal=s.obj.copy(), desired_goal=s.goal.copy())
+
+    def step(self, u):
+        self.sim_env.move(u[1:4], u[0] < -0.5)
+
+    def reset(self):
+        self.sim_env.reset()
+
+    def close(self):
+        pass
+
+
+_MARKERS_STUB = SimpleNamespace(enabled=False, pose=lambda *args, **kwargs: None)
+
+
+class HandStub(HandPickAndPlaceEnv):
+    """Kinematic hand: the grasp center moves by the arm action, and carries the object
+    while the fingers are closed around it."""
+
+    def __init__(self, seed, object_id):
+        self.np_random = np.random.RandomState(seed)
+        self.object_id = object_id
+        self.action_space = spaces.Box(-1., 1., shape=(27,), dtype='float32')
+        self.markers = _MARKERS_STUB
+        self.sim = SimpleNamespace(data=SimpleNamespace(get_body_xpos=lambda name: self.grip + [0.02, 0., 0.]))
+        self.reset()
+
+    def reset(self):
+        center = np.r_[1.0, 0.9, 0.42]
+        self.grip = center + self.np_random.uniform(-0.1, 0.1, 3) * [1, 1, 0] + [0, 0, 0.05]
+        self.obj = center + self.np_random.uniform(-0.1, 0.1, 3) * [1, 1, 0]
+        if self.np_random.uniform() < 0.1:
+            self.obj[2] = 0.3 # dropped
+        self.goal = np.r_[self.obj + self.np_random.uniform(-0.1, 0.1, 3) * [1, 1, 0] + [0, 0, 0.1], 1., 0., 0., 0.]
+        self.closed = False
+
+    def _get_grasp_center_pose(self, no_rot=False):
+        return np.r_[self.grip, 1., 0., 0., 0.]
+
+    def _get_object_pose(self):
+        return np.r_[self.obj, 1., 0., 0., 0.]
+
+    def get_object_contact_points(self):
+        return [dict(body1='robot0:palm', body2='object')] if self.closed else []
+
+    def obs(self):
+        return dict(observation=np.r_[self.grip, self.obj], achieved_goal=self._get_object_pose(),
+                    desired_goal=self.goal.copy())
+
+    def step(self, u):
+        self.grip = self.grip + u[-7:-4] * 0.05
+        self.closed = np.mean(u[2:-7]) > 0 and np.linalg.norm(self.obj - self.grip) < 0.06
+        if self.closed:
+            self.obj = self.grip - [0., 0.03, 0.]
+
+
+class YumiLiftStub(YumiLiftEnv):
+    """Kinematic two-arm lift: the grippers move to the pose given by the IK, and lift the
+    object while both are close to it."""
+    dt = 0.1
+
+    def __init__(self, seed):
+        self.np_random = np.random.RandomState(seed)
+        self.action_space = spaces.Box(-1., 1., shape=(16,), dtype='float32')
+        self.markers = _MARKERS_STUB
+        model = SimpleNamespace(geom_name2id=lambda name: 0, geom_size=np.array([[0.03 + 0.01 * (seed % 3), 0., 0.]]),
+                                site_name2id=('gripper_l_center', 'gripper_r_center').index)
+        self.sim = SimpleNamespace(model=model, data=SimpleNamespace())
+        self.reset()
+
+    def reset(self):
+        self.obj = np.r_[0.4 + self.np_random.uniform(-0.05, 0.05), 0., 0.05, 1., 0., 0., 0.]
+        self.grp_poses = np.stack([tf.apply_tf(np.r_[0., y, 0.2, 1., 0., 0., 0.], self.obj) for y in (0.2, -0.2)])
+        self.goal = np.r_[self.np_random.uniform(0.1, 0.3)]
+        self.q = np.zeros((2, 7))
+        self._update_sim_data(0.0)
+
+    def _update_sim_data(self, time):
+        data = self.sim.data
+        data.time = time
+        data.qpos = self.q.ravel()
+        data.site_xpos = self.grp_poses[:, :3].copy()
+        data.site_xmat = rotations.quat2mat(self.grp_poses[:, 3:]).reshape(-1, 9)
+
+    def mocap_ik(self, pose_delta, arm):
+        i = 0 if arm == 'l' else 1
+        return self.q[i] + pose_delta
+
+    def obs(self):
+        observation = np.zeros(51)
+        observation[:7] = self.q[0]
+        observation[16:23] = self.q[1]
+        observation[44:51] = self.obj
+        # the object rotation is sometimes missing
+        if self.np_random.uniform() < 0.1:
+            observation[47:51] = 0.0
+        return dict(observation=observation, achieved_goal=self.obj[2:3].copy(), desired_goal=self.goal.copy())
+
+    def step(self, u):
+        dq = np.stack([u[:7], u[8:15]]) * 0.2
+        self.q = self.q + dq
+        self.grp_poses += dq
+        self.grp_poses[:, 3:] /= np.linalg.norm(self.grp_poses[:, 3:], axis=1, keepdims=True)
+        if np.all(np.linalg.norm(self.grp_poses[:, :3] - self.obj[:3], axis=1) < 0.1):
+            self.obj[2] += 0.002
+        self._update_sim_data(self.sim.data.time + self.dt)
+
+
+def _check_predict_batch(agent_cls, envs, pass_envs, state_attr='_phases'):
+    agent = agent_cls(envs[0])
+    agents = [agent_cls(env) for env in envs]
+    phases = set()
+    for t in range(N_STEPS):
+        # episodes of different lengths, and agent resets without a new goal
+        for i, env in enumerate(envs):
+            if (t + i) % 70 == 69:
+                env.reset()
+        resets = [i for i in range(len(envs)) if (t + 2 * i) % 90 == 45]
+        agent.reset_slots(resets)
+        for i in resets:
+            agents[i] = agent_cls(envs[i])
+
+        observations = [env.obs() for env in envs]
+        # agents adding noise draw the same random numbers as a predict call per slot, in order
+        np.random.seed(t)
+        actions = agent.predict_batch(observations, envs=envs if pass_envs else None)
+        np.random.seed(t)
+        for i, (a, obs) in enumerate(zip(agents, observations)):
+            assert np.allclose(actions[i], a.predict(obs)), (t, i)
+        phases.update(getattr(agent, state_attr).tolist())
+        for env, u in zip(envs, actions):
+            env.step(u)
+    return phases
+
+
+def test_fetch_pick_and_place_predict_batch():
+    phases = _check_predict_batch(FetchPickAndPlaceAgent, [FetchStub(i) for i in range(N_SLOTS)], pass_envs=True)
+    assert phases == {2, 3, 4, 5, 6}
+
+    # without envs, all slots use the table of the agent's env
+    phases = _check_predict_batch(FetchPickAndPlaceAgent, [FetchStub(4 * i + 2) for i in range(N_SLOTS)], pass_envs=False)
+    assert phases == {2, 3, 4, 5, 6}
+
+
+@pytest.mark.parametrize('object_id', ['box', 'sphere', 'small_box'])
+def test_hand_pick_and_place_predict_batch(object_id):
+    envs = [HandStub(i, object_id) for i in range(N_SLOTS)]
+    grasps_steps = _check_predict_batch(HandPickAndPlaceAgent, envs, pass_envs=True, state_attr='_grasps_steps')
+    assert max(grasps_steps) > 10
+
+
+def test_hand_pick_and_place_teapot_predict_batch():
+    envs = [HandStub(i, 'teapot') for i in range(N_SLOTS)]
+    phases = _check_predict_batch(HandPickAndPlaceAgent, envs, pass_envs=True)
+    assert phases == {0, 1, 2, 3}
+
+
+def test_yumi_lift_predict_batch():
+    phases = _check_predict_batch(YumiLiftAgent, [YumiLiftStub(i) for i in range(N_SLOTS)], pass_envs=True)
+    assert phases == {0, 1, 2, 3}
+
+
+def test_yumi_constrained_predict_batch():
+    phases = _check_predict_batch(YumiConstrainedAgent, [YumiStub(i) for i in range(N_SLOTS)], pass_envs=True)
+    assert phases >= {2, 3, 4}
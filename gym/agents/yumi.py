@@ -5,8 +5,10 @@ import numpy as np
 import gym
 from gym.envs.yumi.yumi_env import YumiEnv
 from gym.envs.robotics import rotations
-from gym.agents.base import BaseAgent
+from gym.envs.robotics.utils import SitePoseReader
+from gym.agents.base import BaseAgent, stack_obs
 import gym.utils.transformations as tf
+from gym.utils.teacher_cache import TeacherRollout, TeacherTrajectoryCache
 
 
 def _solve_qp_ik_vel(vel, jac, joint_pos, joint_lims=None, duration=None, margin=0.2):
@@ -87,13 +89,17 @@ def _solve_qp_ik_pos(current_pose, target_pose, jac, joint_pos, joint_lims=None,
 class YumiSynchronizedAgent(BaseAgent):
 
     def __init__(self, env, *, yumi_agent: BaseAgent, teacher_env, teacher_agent: BaseAgent,
-                 teacher_obj_name='object0', t_table_tf=None, **kwargs):
+                 teacher_obj_name='object0', t_table_tf=None, teacher_cache: TeacherTrajectoryCache=None,
+                 teacher_env_kwargs=None, teacher_seed=None, teacher_n_steps=None, **kwargs):
         super(YumiSynchronizedAgent, self).__init__(env, **kwargs)
         self._goal = None
         self.yumi_agent = yumi_agent
         self.teacher_env = teacher_env
         self.teacher_agent = teacher_agent
         self.teacher_obj_name = teacher_obj_name
+        # replays the teacher rollouts from teacher_cache if given
+        self._teacher = TeacherRollout(teacher_agent, teacher_env, cache=teacher_cache, env_kwargs=teacher_env_kwargs,
+                                       seed=teacher_seed, n_steps=teacher_n_steps)
         self.yumi_env_version = 2
         self.s_table_tf = env.unwrapped.get_table_surface_pose()
         if t_table_tf is None:
@@ -123,6 +129,7 @@ class YumiSynchronizedAgent(BaseAgent):
             self.teacher_env.unwrapped.sim.forward()
 
         self.teacher_agent.reset()
+        self._teacher.start()
 
     def reset(self, **kwargs):
         self._goal = None
@@ -139,9 +146,7 @@ class YumiSynchronizedAgent(BaseAgent):
             self._goal = goal.copy()
             self._align_goal()
 
-        t_obs = self.teacher_env.unwrapped._get_obs()
-        t_u = self.teacher_agent.predict(t_obs)
-        t_obs, _, done, _ = self.teacher_env.step(t_u)
+        t_obs = self._teacher.step()
 
         s_u = self.yumi_agent.predict(obs)
         return s_u
@@ -150,7 +155,8 @@ class YumiSynchronizedAgent(BaseAgent):
 class YumiImitatorAgent(BaseAgent):
 
     def __init__(self, env, *, teacher_env, teacher_agent: BaseAgent, a_scaler, b_scaler, model,
-                 teacher_obj_name='object0', t_table_tf=None, **kwargs):
+                 teacher_obj_name='object0', t_table_tf=None, teacher_cache: TeacherTrajectoryCache=None,
+                 teacher_env_kwargs=None, teacher_seed=None, teacher_n_steps=None, **kwargs):
         super(YumiImitatorAgent, self).__init__(env, **kwargs)
         self._goal = None
         self._prev_s_u = None
@@ -158,6 +164,9 @@ class YumiImitatorAgent(BaseAgent):
         self.teacher_env = teacher_env
         self.teacher_agent = teacher_agent
         self.teacher_obj_name = teacher_obj_name
+        # replays the teacher rollouts from teacher_cache if given
+        self._teacher = TeacherRollout(teacher_agent, teacher_env, cache=teacher_cache, env_kwargs=teacher_env_kwargs,
+                                       seed=teacher_seed, n_steps=teacher_n_steps)
         self.a_scaler = copy.deepcopy(a_scaler)
         self.b_scaler = copy.deepcopy(b_scaler)
         self.yumi_env_version = 2
@@ -209,6 +218,7 @@ class YumiImitatorAgent(BaseAgent):
             self.teacher_env.unwrapped.sim.forward()
 
         self.teacher_agent.reset()
+        self._teacher.start()
 
     def reset(self, **kwargs):
         self._goal = None
@@ -224,9 +234,7 @@ class YumiImitatorAgent(BaseAgent):
             self._goal = goal.copy()
             self._align_goal()
 
-        t_obs = self.teacher_env.unwrapped._get_obs()
-        t_u = self.teacher_agent.predict(t_obs)
-        t_obs, _, done, _ = self.teacher_env.step(t_u)
+        t_obs = self._teacher.step()
 
         b_obs = self.b_scaler.transform(self._flatten_obs(t_obs)[None], copy=True)[0]
         recon_t_obs = self.model.cross_decode_b_to_a(b_obs)
@@ -248,6 +256,9 @@ class YumiConstrainedAgent(BaseAgent):
         self._goal = None
         self._phase = 0
         self._phase_steps = 0
+        self._phases = None
+        self._phases_steps = None
+        self._goals = None
 
     def reset(self, new_goal=None):
         self._goal = None
@@ -256,6 +267,81 @@ class YumiConstrainedAgent(BaseAgent):
         if new_goal is not None:
             self._goal = new_goal.copy()
 
+    def _initial_episode_state(self):
+        return dict(_goal=None, _phase=0, _phase_steps=0)
+
+    def _bind_env(self, env):
+        self._env = env
+        self._raw_env = env.unwrapped
+
+    def reset_slots(self, slots=None):
+        super(YumiConstrainedAgent, self).reset_slots(slots)
+        if self._phases is not None:
+            if slots is None:
+                slots = slice(None)
+            self._phases[slots] = 0
+            self._phases_steps[slots] = 0
+            self._goals[slots] = np.nan
+
+    def predict_batch(self, obs_batch, envs=None, **kwargs):
+        """Vectorized version of predict, in which the button and rotating platform tasks
+        fall back to a predict call per slot. `envs` are required to count the object
+        contact points of each slot."""
+
+        sim_env = self._raw_env.sim_env
+        if sim_env.has_button or sim_env.has_rotating_platform:
+            return super(YumiConstrainedAgent, self).predict_batch(obs_batch, envs=envs, **kwargs)
+
+        obs = stack_obs(obs_batch)
+        goal = obs['desired_goal']
+        n_slots = len(goal)
+        if envs is None:
+            if n_slots > 1:
+                raise gym.error.Error('YumiConstrainedAgent.predict_batch requires the envs of all slots')
+            envs = [self._env]
+        if self._phases is None or len(self._phases) != n_slots:
+            self._phases = np.zeros(n_slots, dtype=int)
+            self._phases_steps = np.zeros(n_slots, dtype=int)
+            self._goals = np.full(goal.shape, np.nan)
+
+        phases, steps = self._phases, self._phases_steps
+        new_goal = np.any(goal != self._goals, axis=1)
+        self._goals[new_goal] = goal[new_goal]
+        phases[new_goal] = 0
+        steps[new_goal] = 0
+
+        object_pos = obs['observation'][:, 18:21]
+        object_rel_pos = obs['observation'][:, 24:27]
+        n_contacts = np.array([len(env.unwrapped.sim_env.get_object_contact_points()) for env in envs])
+
+        u = np.zeros((n_slots,) + self._env.action_space.shape)
+        m = phases < 2
+        phases[m] = 2
+        steps[m] = 0
+
+        # phase transitions are applied in order, as a slot can go through several of them in the same step
+        m = phases == 2
+        reach = m & (np.linalg.norm(object_rel_pos, axis=1) > 0.01)
+        u[reach, 0] = 0.0
+        u[reach, 1:4] = object_rel_pos[reach] * 5.0
+        phases[m & ~reach] = 3
+        steps[m & ~reach] = 0
+
+        m = phases == 3
+        close = m & (n_contacts < 3)
+        u[close, 0] = -steps[close] / 10.0
+        steps[close] += 1
+        phases[m & ~close] = 4
+        steps[m & ~close] = 0
+
+        m = phases == 4
+        carry = m & (n_contacts > 2)
+        u[carry, 0] = -1.0
+        u[carry, 1:4] = (goal - object_pos)[carry] * 2.0
+        phases[m & ~carry] = 0
+        steps[m & ~carry] = 0
+        return u
+
     def predict(self, obs, **kwargs):
 
         u = np.zeros(self._env.action_space.shape)
@@ -278,7 +364,7 @@ class YumiConstrainedAgent(BaseAgent):
 
             if np.linalg.norm(object_pos) > 0.55:
                 button_pos = self._raw_env.sim.data.get_geom_xpos('button_geom')
-                tf.render_pose(np.r_[button_pos, 1., 0., 0., 0.], self._raw_env.viewer)
+                self._raw_env.markers.pose(np.r_[button_pos, 1., 0., 0., 0.])
                 err = button_pos - grasp_center_pos
                 u[0] = -1.
                 u[1:4] = err * 5.0
@@ -295,15 +381,15 @@ class YumiConstrainedAgent(BaseAgent):
             if np.linalg.norm(object_pos[:2]) > 0.12: # FIXME
                 far_end_pose = np.r_[
                     self._raw_env.sim.data.get_site_xpos('rotating_platform:far_end'),
-                    tf.rotations.mat2quat(self._raw_env.sim.data.get_site_xmat('rotating_platform:far_end')),
+                    tf.rotations.mat2quat_fast(self._raw_env.sim.data.get_site_xmat('rotating_platform:far_end')),
                 ]
 
                 close_end_pose = tf.apply_tf(np.r_[-0.5, -0.02, 0., 1., 0., 0., 0.], far_end_pose)
-                tf.render_pose(close_end_pose, self._raw_env.viewer)
+                self._raw_env.markers.pose(close_end_pose)
 
                 push_target = np.r_[0.2, 0.2, 0., 1., 0., 0., 0.]
                 # push_target = tf.apply_tf(np.r_[0., 0.1, 0., 1., 0., 0., 0.], close_end_pose)
-                tf.render_pose(push_target, self._raw_env.viewer)
+                self._raw_env.markers.pose(push_target)
                 err = close_end_pose[:3] - grasp_center_pos
 
                 if self._phase == 0:
@@ -365,6 +451,7 @@ class YumiLiftAgent(BaseAgent):
 
         self._raw_env = env.unwrapped # type: YumiLiftEnv
         self._sim = self._raw_env.sim
+        self._gripper_poses = SitePoseReader(('gripper_l_center', 'gripper_r_center'))
         self._dt = env.unwrapped.dt
         self._target_qs = dict()
         self._prev_err_l = np.zeros(7)
@@ -374,6 +461,11 @@ class YumiLiftAgent(BaseAgent):
         self._phase_steps = 0
         self._object_geom_name = 'object0_base'
         self._object_size = None
+        self._goals = None
+        self._phases = None
+        self._phases_steps = None
+        self._prev_errs = None
+        self._object_sizes = None
 
     def reset(self, new_goal=None):
         self._target_qs = dict()
@@ -391,9 +483,104 @@ class YumiLiftAgent(BaseAgent):
         prev_err[:] = err
         return -(1.0 * err + 0.05 * d_err) * k
 
-    def _get_object_size(self):
-        geom = self._raw_env.sim.model.geom_name2id(self._object_geom_name)
-        return self._raw_env.sim.model.geom_size[geom].copy()
+    def _get_object_size(self, raw_env=None):
+        if raw_env is None:
+            raw_env = self._raw_env
+        geom = raw_env.sim.model.geom_name2id(self._object_geom_name)
+        return raw_env.sim.model.geom_size[geom].copy()
+
+    def reset_slots(self, slots=None):
+        if self._phases is not None:
+            if slots is None:
+                slots = slice(None)
+            self._goals[slots] = np.nan
+
+    def predict_batch(self, obs_batch, envs=None, **kwargs):
+        """Vectorized version of predict. `envs` are required to read the gripper poses and
+        to solve the IK of each slot, which is still done per slot and arm."""
+
+        obs = stack_obs(obs_batch)
+        goal = obs['desired_goal']
+        n_slots = len(goal)
+        if envs is None:
+            if n_slots > 1:
+                raise gym.error.Error('YumiLiftAgent.predict_batch requires the envs of all slots')
+            envs = [self._env]
+        raw_envs = [env.unwrapped for env in envs]
+        if self._phases is None or len(self._phases) != n_slots:
+            self._goals = np.full(goal.shape, np.nan)
+            self._phases = np.zeros(n_slots, dtype=int)
+            self._phases_steps = np.zeros(n_slots, dtype=int)
+            self._prev_errs = np.zeros((n_slots, 2, 7))
+            self._object_sizes = np.zeros((n_slots, 3))
+
+        phases, steps, prev_errs = self._phases, self._phases_steps, self._prev_errs
+        new_goal = np.any(goal != self._goals, axis=1)
+        self._goals[new_goal] = goal[new_goal]
+        phases[new_goal] = 0
+        steps[new_goal] = 0
+        prev_errs[new_goal] = 0.0
+        for i in np.flatnonzero(new_goal):
+            self._object_sizes[i] = self._get_object_size(raw_envs[i])
+
+        obj_radius = self._object_sizes[:, 0]
+        obj_achieved_poses = obs['observation'][:, 44:51].copy()
+        obj_achieved_poses[np.all(obj_achieved_poses[:, 3:] == 0, axis=1), 3] = 1.0
+        grp_xrot = 0.9 + obs['achieved_goal'][:, 0] * 2.0
+
+        # the left and right gripper targets of each slot, in the object frame
+        transf = np.zeros((n_slots, 2, 7))
+        transf[:, 0, 1] = obj_radius
+        transf[:, 1, 1] = -obj_radius
+        transf[:, :, 3] = 1.0
+        m = phases == 3
+        transf[m, :, 1] *= 0.9
+        transf[m, :, 2] = 0.05
+        target_poses = tf.apply_tf(transf, obj_achieved_poses[:, None])
+
+        grp_target_rot = np.empty((n_slots, 2, 3))
+        grp_target_rot[:, 0, 0] = np.pi - grp_xrot
+        grp_target_rot[:, 1, 0] = -np.pi + grp_xrot
+        grp_target_rot[:, :, 1] = 0.01
+        grp_target_rot[:, 0, 2] = 0.01
+        grp_target_rot[:, 1, 2] = np.pi
+        target_poses[..., 3:] = rotations.euler2quat(grp_target_rot)
+
+        m = phases < 2
+        target_poses[m, :, 1] += 0.05 * np.sign(target_poses[m, :, 1])
+        target_poses[phases == 0, :, 2] += 0.1
+        target_poses[(phases == 1) | (phases == 2), :, 2] += 0.01
+
+        for raw_env, poses in zip(raw_envs, target_poses):
+            if raw_env.markers.enabled:
+                raw_env.markers.pose(poses[0])
+                raw_env.markers.pose(poses[1])
+
+        curr_grp_poses = np.array([self._gripper_poses(raw_env.sim) for raw_env in raw_envs])
+        err_poses = curr_grp_poses - target_poses
+        pos_errors = np.linalg.norm(err_poses[..., :3], axis=-1)
+        err_rot = tf.quat_angle_diff(curr_grp_poses[:, 1, 3:], target_poses[:, 1, 3:])
+        target_qs = np.array([[raw_env.mocap_ik(-err_pose[0], 'l'), raw_env.mocap_ik(-err_pose[1], 'r')]
+                              for raw_env, err_pose in zip(raw_envs, err_poses)])
+
+        err_qs = np.stack([obs['observation'][:, :7], obs['observation'][:, 16:23]], axis=1) - target_qs
+        d_err = (err_qs - prev_errs) / self._dt
+        prev_errs[:] = err_qs
+        u_arms = -(1.0 * err_qs + 0.05 * d_err) * 2.0
+
+        u = np.zeros((n_slots,) + self._env.action_space.shape)
+        u[:, :7] = u_arms[:, 0]
+        u[:, 8:15] = u_arms[:, 1]
+        u[:, 7] = -1.0
+        u[:, 15] = -1.0
+
+        steps += 1
+        reached = np.all(pos_errors < 0.03, axis=1) & (err_rot < 0.1)
+        m = ((phases < 2) & reached) | ((phases == 2) & (steps > 30))
+        phases[m] += 1
+        steps[m] = 0
+
+        return np.clip(u, self._env.action_space.low, self._env.action_space.high)
 
     def predict(self, obs, **kwargs):
 
@@ -411,10 +598,7 @@ class YumiLiftAgent(BaseAgent):
 
         grp_xrot = 0.9 + obj_achieved_alt * 2.0
 
-        curr_grp_poses = {a: np.r_[
-            self._raw_env.sim.data.get_site_xpos(f'gripper_{a}_center'),
-            rotations.mat2quat(self._raw_env.sim.data.get_site_xmat(f'gripper_{a}_center')),
-        ] for a in ('l', 'r')}
+        curr_grp_poses = dict(zip(('l', 'r'), self._gripper_poses(self._raw_env.sim).copy()))
 
         pos_errors = []
         for arm in ('l', 'r'):
@@ -467,8 +651,7 @@ class YumiLiftAgent(BaseAgent):
             elif self._phase == 3:
                 target_pose[2] += 0.00
 
-            if self._raw_env.viewer is not None:
-                tf.render_pose(target_pose.copy(), self._raw_env.viewer)
+            self._raw_env.markers.pose(target_pose)
 
             curr_pose = curr_grp_poses[arm].copy()
             err_pose = curr_pose - target_pose
@@ -511,6 +694,7 @@ class YumiBarAgent(BaseAgent):
 
         self._raw_env = env.unwrapped # type: YumiEnv
         self._sim = self._raw_env.sim
+        self._gripper_poses = SitePoseReader(('gripper_l_center', 'gripper_r_center'))
         self._dt = env.unwrapped.dt
         self._goal = None
         self._phase = 0
@@ -638,10 +822,7 @@ class YumiBarAgent(BaseAgent):
             # TFDebugger.reset()
         # TFDebugger.step(self._raw_env.viewer)
 
-        curr_grp_poses = {a: np.r_[
-            self._raw_env.sim.data.get_site_xpos(f'gripper_{a}_center'),
-            rotations.mat2quat(self._raw_env.sim.data.get_site_xmat(f'gripper_{a}_center')),
-        ] for a in ('l', 'r')}
+        curr_grp_poses = dict(zip(('l', 'r'), self._gripper_poses(self._raw_env.sim).copy()))
 
         pos_errors = []
         for arm in ('l', 'r'):
@@ -659,7 +840,7 @@ class YumiBarAgent(BaseAgent):
 
                 if self._phase == 3:
                     target_pose[:3] = self._raw_env.sim.data.get_site_xpos('target0:left').copy()
-                    q = rotations.mat2quat(self._raw_env.sim.data.get_site_xmat('target0:left'))
+                    q = rotations.mat2quat_fast(self._raw_env.sim.data.get_site_xmat('target0:left'))
                     target_pose[3:] = rotations.quat_mul(target_pose[3:], q)
 
                 prev_err = self._prev_err_l
@@ -679,7 +860,7 @@ class YumiBarAgent(BaseAgent):
 
                 if self._phase == 3:
                     target_pose[:3] = self._raw_env.sim.data.get_site_xpos('target0:right').copy()
-                    q = rotations.mat2quat(self._raw_env.sim.data.get_site_xmat('target0:right'))
+                    q = rotations.mat2quat_fast(self._raw_env.sim.data.get_site_xmat('target0:right'))
                     target_pose[3:] = rotations.quat_mul(q, target_pose[3:])
 
                 prev_err = self._prev_err_r
@@ -703,8 +884,7 @@ class YumiBarAgent(BaseAgent):
                 u[7] = 1.0
                 u[15] = 1.0
 
-            if self._raw_env.viewer is not None:
-                tf.render_pose(target_pose.copy(), self._raw_env.viewer)
+            self._raw_env.markers.pose(target_pose)
 
             curr_pose = curr_grp_poses[arm].copy()
             err_pose = curr_pose - target_pose
@@ -0,0 +1,217 @@
+"""Throughput benchmark of the registered environments.
+
+Each env is benchmarked in a fresh process, for its peak RSS to be its own and for envs with
+missing dependencies to only fail their own entry. For each env the suite measures the time
+of the first gym.make (including the import of the env module), the mean reset latency, the
+steps per second with random actions and, for the envs with a scripted agent in
+gym.utils.demos.DEFAULT_AGENTS, with the actions of the agent (including the time of the
+agent), and the peak RSS of the process.
+
+Results are written as JSON, and can be compared with the results of a previous run to find
+throughput regressions, e.g. after upgrading dependencies:
+
+    python -m gym.bench 'Yumi*' 'Hand*' 'gym.envs.classic_control:*' --out results.json --baseline baseline.json
+"""
+import fnmatch
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+from gym import error, logger
+from gym.utils import atomic_write
+
+
+# Metrics compared with the baseline, and whether larger values are better
+METRICS = {
+    'make_s': False,
+    'reset_ms': False,
+    'random_steps_per_s': True,
+    'scripted_steps_per_s': True,
+}
+
+
+def select_specs(patterns=None) -> list:
+    """Returns the ids of the registered envs matching any of the fnmatch patterns, matched
+    against the id and the entry point of the envs (e.g. 'gym.envs.classic_control:*'), or
+    of all the envs if None."""
+    from gym import envs
+    ids = []
+    for spec in sorted(envs.registry.all(), key=lambda s: s.id):
+        entry_point = spec._entry_point if isinstance(spec._entry_point, str) else ''
+        if patterns is None or any(fnmatch.fnmatchcase(spec.id, p) or fnmatch.fnmatchcase(entry_point, p)
+                                   for p in patterns):
+            ids.append(spec.id)
+    return ids
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2 ** 20 if sys.platform == 'darwin' else rss / 2 ** 10
+
+
+def _run_steps(env, n_steps, act, on_reset=None):
+    """Returns the steps per second of `n_steps` steps with the actions returned by act(obs),
+    calling on_reset() at the beginning of each episode."""
+    obs = env.reset()
+    if on_reset is not None:
+        on_reset()
+    tic = time.perf_counter()
+    for _ in range(n_steps):
+        obs, _, done, _ = env.step(act(obs))
+        if done:
+            obs = env.reset()
+            if on_reset is not None:
+                on_reset()
+    return n_steps / (time.perf_counter() - tic)
+
+
+def bench_env(env_id, n_steps=1000, n_resets=10, seed=0) -> dict:
+    """Benchmarks an env in the current process, see the module docstring."""
+    import gym
+    from gym.utils import demos
+
+    tic = time.perf_counter()
+    env = gym.make(env_id)
+    result = dict(make_s=time.perf_counter() - tic)
+
+    env.seed(seed)
+    env.action_space.seed(seed)
+    tic = time.perf_counter()
+    for _ in range(n_resets):
+        env.reset()
+    result['reset_ms'] = 1e3 * (time.perf_counter() - tic) / n_resets
+
+    result['random_steps_per_s'] = _run_steps(env, n_steps, lambda obs: env.action_space.sample())
+
+    if env_id in demos.DEFAULT_AGENTS:
+        agent = demos._resolve_agent_cls(None, env_id)(env)
+        result['scripted_steps_per_s'] = _run_steps(env, n_steps, lambda obs: np.asarray(agent.predict(obs)),
+                                                    on_reset=agent.reset)
+
+    env.close()
+    result['peak_rss_mb'] = _peak_rss_mb()
+    return result
+
+
+def _bench_env_safe(args):
+    env_id, kwargs = args
+    try:
+        return bench_env(env_id, **kwargs)
+    except Exception as e:
+        return dict(error='{}: {}'.format(type(e).__name__, e))
+
+
+def run_suite(env_ids, n_steps=1000, n_resets=10, seed=0) -> dict:
+    """Benchmarks the envs one after another, each in a new process, and returns the results
+    of each env with the details of the platform."""
+    kwargs = dict(n_steps=n_steps, n_resets=n_resets, seed=seed)
+    results = dict()
+    ctx = multiprocessing.get_context('spawn')
+    for env_id in env_ids:
+        with ctx.Pool(1) as pool:
+            results[env_id] = pool.apply(_bench_env_safe, ((env_id, kwargs),))
+        if 'error' in results[env_id]:
+            logger.warn('Benchmark of %s failed: %s', env_id, results[env_id]['error'])
+        else:
+            logger.info('%s: %s', env_id, results[env_id])
+
+    from gym import version
+    return dict(
+        gym_version=version.VERSION,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        numpy=np.__version__,
+        n_steps=n_steps,
+        envs=results,
+    )
+
+
+def compare(results, baseline, tolerance=0.1) -> list:
+    """Returns the regressions of `results` with respect to `baseline`, as (env_id, metric,
+    baseline value, value) for each metric of METRICS worse by more than `tolerance` (as a
+    fraction of the baseline value), and as (env_id, 'error', None, error) for each env which
+    ran in the baseline and now fails. Envs of the baseline missing from `results` are logged
+    as warnings, and metrics missing from either are ignored."""
+    regressions = []
+    for env_id, base in sorted(baseline['envs'].items()):
+        result = results['envs'].get(env_id)
+        if result is None:
+            logger.warn('%s is in the baseline but was not benchmarked', env_id)
+            continue
+        if 'error' in base:
+            continue
+        if 'error' in result:
+            regressions.append((env_id, 'error', None, result['error']))
+            continue
+        for metric, larger_is_better in METRICS.items():
+            if metric not in result or metric not in base:
+                continue
+            if larger_is_better:
+                worse = result[metric] < base[metric] * (1 - tolerance)
+            else:
+                worse = result[metric] > base[metric] * (1 + tolerance)
+            if worse:
+                regressions.append((env_id, metric, base[metric], result[metric]))
+    return regressions
+
+
+def save_results(results, path):
+    with atomic_write.atomic_write(path) as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load_results(path) -> dict:
+    with open(path) as f:
+        results = json.load(f)
+    if 'envs' not in results:
+        raise error.Error('{} is not a file of benchmark results'.format(path))
+    return results
+
+
+def _main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the throughput of the registered envs')
+    parser.add_argument('patterns', nargs='*', help='fnmatch patterns of env ids or entry points, all envs if empty')
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--resets', type=int, default=10)
+    parser.add_argument('--out', help='JSON file of the results')
+    parser.add_argument('--baseline', help='JSON file of results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+
+    logger.set_level(logger.INFO)
+    env_ids = select_specs(args.patterns or None)
+    if not env_ids:
+        parser.error('No registered env matches {}'.format(args.patterns))
+    results = run_suite(env_ids, n_steps=args.steps, n_resets=args.resets)
+    if args.out:
+        save_results(results, args.out)
+
+    for env_id, r in results['envs'].items():
+        if 'error' in r:
+            print(f'{env_id:40s} error: {r["error"]}')
+        else:
+            scripted = f'{r["scripted_steps_per_s"]:10.0f}/s' if 'scripted_steps_per_s' in r else f'{"-":>12s}'
+            print(f'{env_id:40s} make={r["make_s"]:7.3f}s reset={r["reset_ms"]:8.3f}ms '
+                  f'random={r["random_steps_per_s"]:10.0f}/s scripted={scripted} rss={r["peak_rss_mb"]:7.1f}MB')
+
+    if args.baseline:
+        regressions = compare(results, load_results(args.baseline), tolerance=args.tolerance)
+        for env_id, metric, base, value in regressions:
+            if metric == 'error':
+                print(f'REGRESSION {env_id}: ok in the baseline, now error: {value}')
+            else:
+                print(f'REGRESSION {env_id} {metric}: {base:.4g} -> {value:.4g}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    _main()
@@ -6,7 +6,7 @@ import numpy as np
 
 from gym import utils, error
 from gym.envs.robotics import rotations, hand_env
-from gym.envs.robotics.utils import robot_get_obs, reset_mocap_welds, reset_mocap2body_xpos
+from gym.envs.robotics.utils import robot_get_obs, reset_mocap_welds, reset_mocap2body_xpos, SitePoseReader
 
 try:
     import mujoco_py
@@ -79,6 +79,7 @@ class MovingHandEnv(hand_env.HandEnv, utils.EzPickle):
         self.reward_type = reward_type
         self.success_on_grasp_only = success_on_grasp_only
         self.object_id = object_id
+        self._site_poses = SitePoseReader(('robot0:palm_center', 'robot0:grasp_center'))
         self.forearm_bounds = (np.r_[0.65, 0.3, 0.42], np.r_[1.75, 1.2, 1.0])
         self.table_safe_bounds = (np.r_[1.10, 0.43], np.r_[1.49, 1.05])
         self._initial_arm_mocap_pose = np.r_[1.05, 0.75, 0.65, rotations.euler2quat(np.r_[0., 1.59, 1.57])]
@@ -222,10 +223,10 @@ class MovingHandEnv(hand_env.HandEnv, utils.EzPickle):
 
     def _get_site_pose(self, site_name, no_rot=False):
         if no_rot:
-            quat = np.zeros(4)
-        else:
-            # this is very inefficient, avoid computation when possible
-            quat = rotations.mat2quat(self.sim.data.get_site_xmat(site_name))
+            return np.r_[self.sim.data.get_site_xpos(site_name), np.zeros(4)]
+        if site_name in self._site_poses.site_names:
+            return self._site_poses.get_pose(self.sim, site_name)
+        quat = rotations.mat2quat_fast(self.sim.data.get_site_xmat(site_name))
         return np.r_[self.sim.data.get_site_xpos(site_name), quat]
 
     def _get_palm_pose(self, no_rot=False):
@@ -1,4 +1,3 @@
-import copy
 from enum import Enum
 
 import numpy as np
@@ -10,6 +9,7 @@ from gym.envs.robotics.hand.move import HandPickAndPlaceEnv, FINGERTIP_BODY_NAME
 from gym.envs.robotics.utils import reset_mocap2body_xpos
 from gym.utils import transformations as tf
 from gym.utils import kinematics as kin
+from gym.utils.phase_profiler import clock
 
 
 class HandSteppedTask(Enum):
@@ -24,7 +24,7 @@ def _smooth_step(x):
 
 class HandSteppedEnv(gym.GoalEnv):
 
-    def __init__(self, *, task: HandSteppedTask=None, render_substeps=False):
+    def __init__(self, *, task: HandSteppedTask=None, render_substeps=False, profiler=None, scheduler=None):
         super(HandSteppedEnv, self).__init__()
 
         self.metadata = {
@@ -34,6 +34,10 @@ class HandSteppedEnv(gym.GoalEnv):
         self._qp_solver = None
         self.task = task or HandSteppedTask.LIFT_ABOVE_TABLE
         self.render_substeps = render_substeps
+        # optional gym.utils.phase_profiler.PhaseProfiler recording the phases of each step
+        self.profiler = profiler
+        # optional gym.utils.substep_scheduler.SubstepScheduler stopping phases early
+        self.scheduler = scheduler
         self.sim_env = HandPickAndPlaceEnv(reward_type='dense', target_in_the_air_p=1.0,
                                            weld_fingers=False, object_id='box')
         self.goal = self._sample_goal()
@@ -60,6 +64,10 @@ class HandSteppedEnv(gym.GoalEnv):
     def viewer(self):
         return self.sim_env.viewer
 
+    @property
+    def markers(self):
+        return self.sim_env.markers
+
     @property
     def sim(self):
         return self.sim_env.sim
@@ -83,6 +91,19 @@ class HandSteppedEnv(gym.GoalEnv):
             return self.reset(), 0.0, True, dict()
 
     def _step(self, action: np.ndarray):
+
+        def failure():
+            obs = self._get_obs()
+            info = dict()
+            if self.task == HandSteppedTask.PICK_AND_PLACE:
+                info['is_success'] = self.sim_env._is_success(obs['achieved_goal'], self.goal)
+            return obs, 0.0, True, self._step_info(info)
+
+        if self.profiler is not None:
+            self.profiler.start_step()
+        if self.scheduler is not None:
+            self._saved_substeps = self.scheduler.saved_substeps
+
         action = np.clip(action, self.action_space.low, self.action_space.high)
         fingers_pos_wrt_obj = action[:(3*5)].reshape(-1, 3) * np.r_[0.03, 0.03, 0.03]
 
@@ -95,23 +116,21 @@ class HandSteppedEnv(gym.GoalEnv):
 
         arm_bounds = np.array(self.sim_env.forearm_bounds).T
         if self.render_substeps:
-            tf.render_box(self.viewer, bounds=arm_bounds)
+            self.markers.box(bounds=arm_bounds, key='arm_bounds')
 
         arm_pos_wrt_world *= np.abs(arm_bounds[:, 1] - arm_bounds[:, 0]) / 2.0
         arm_pos_wrt_world += arm_bounds.mean(axis=1)
 
         obj_pose = self.sim_env._get_object_pose()
-        obj_on_ground = obj_pose[2] < 0.37
+        obj_on_ground = self._is_object_on_ground()
 
-        fingers_pos_targets = np.array([
-            tf.apply_tf(np.r_[transf, 1., 0., 0., 0.], obj_pose) for transf in fingers_pos_wrt_obj
-        ])
+        fingers_pos_targets = tf.apply_tf(fingers_pos_wrt_obj, obj_pose)
 
         self.sim.model.eq_active[1:] = 0
         # self.sim.data.mocap_pos[1:] = fingers_pos_targets[:, :3]
 
         if self.render_substeps:
-            tf.render_pose(arm_pos_wrt_world.copy(), self.sim_env.viewer, label='arm_t')
+            self.markers.pose(arm_pos_wrt_world, key='arm_t', label='arm_t')
             # for i, f in enumerate(fingers_pos_targets):
             #     tf.render_pose(f, self.sim_env.viewer, label=f'f_{i}')
 
@@ -123,13 +142,18 @@ class HandSteppedEnv(gym.GoalEnv):
         if len(self.sim_env.get_object_contact_points(other_body='robot')) == 0:
             hand_action = np.r_[0., -.5, -np.ones(18)]
             hand_action[15:] = (-1., -0.5, 1., -1., 0)
-            self._move_arm(pregrasp_palm_target, hand_action=hand_action)
+            exit_reason, _ = self._move_arm(pregrasp_palm_target, hand_action=hand_action, phase='pregrasp')
+            if exit_reason == 'failure':
+                return failure()
 
         # move fingers
-        self._move_fingers(fingers_pos_targets, max_steps=30)
+        if self._move_fingers(fingers_pos_targets, max_steps=30, phase='fingers') == 'failure':
+            return failure()
 
         # move arm
-        stable_steps = self._move_arm(arm_pos_wrt_world, count_stable_steps=True)
+        exit_reason, stable_steps = self._move_arm(arm_pos_wrt_world, count_stable_steps=True, phase='lift')
+        if exit_reason == 'failure':
+            return failure()
 
         done = obj_on_ground
         obs = self._get_obs()
@@ -146,15 +170,20 @@ class HandSteppedEnv(gym.GoalEnv):
         else:
             raise NotImplementedError
 
-        return obs, reward, done, info
+        return obs, reward, done, self._step_info(info)
+
+    def _step_info(self, info):
+        if self.scheduler is not None:
+            info['saved_substeps'] = self.scheduler.saved_substeps - self._saved_substeps
+        if self.profiler is not None:
+            self.profiler.end_step(info)
+        return info
+
+    def _is_object_on_ground(self):
+        return self.sim_env._get_object_pose()[2] < 0.37
 
-    def render(self, mode='human', keep_markers=False):
-        markers = []
-        if keep_markers:
-            markers = copy.deepcopy(self.viewer._markers)
-        self.sim_env.render()
-        for m in markers:
-            self.viewer.add_marker(**m)
+    def render(self, mode='human', keep_markers=False, rgb_options=None):
+        return self.sim_env.render(mode=mode, rgb_options=rgb_options, keep_markers=keep_markers)
 
     def reset(self):
         self.sim.model.eq_active[1:] = 0
@@ -196,7 +225,16 @@ class HandSteppedEnv(gym.GoalEnv):
     # ----------------------------
 
     def _move_arm(self, grasp_center_target: np.ndarray, hand_action: np.ndarray=None,
-                  threshold=0.01, k=0.1, max_steps=100, count_stable_steps=False):
+                  threshold=0.01, k=0.1, max_steps=100, count_stable_steps=False, phase='move_arm'):
+        profiler = self.profiler
+        if profiler is not None:
+            tic = clock()
+        scheduler = self.scheduler
+        if scheduler is not None:
+            scheduler.start_phase()
+        exit_reason = 'max_steps'
+        n_substeps = 0
+
         if hand_action is not None:
             hand_action = hand_action.copy()
         stable_steps = 0
@@ -207,12 +245,22 @@ class HandSteppedEnv(gym.GoalEnv):
             grasp_center_pos = self.sim_env._get_grasp_center_pose(no_rot=True)[:3]
             d = grasp_center_target - grasp_center_pos
             if np.linalg.norm(d) < threshold and not count_stable_steps:
+                exit_reason = 'converged'
                 break
             # set hand action
             if hand_action is not None:
                 hand_env.HandEnv._set_action(self.sim_env, hand_action)
             self.sim.data.mocap_pos[0] += d * k
             self.sim.step()
+            n_substeps += 1
+
+            if scheduler is not None:
+                if self._is_object_on_ground():
+                    exit_reason = 'failure'
+                    break
+                if not count_stable_steps and scheduler.is_still(self.sim.data.qvel):
+                    exit_reason = 'still'
+                    break
 
             if count_stable_steps:
                 obj_pos = self.sim_env._get_object_pose()[:3]
@@ -222,22 +270,41 @@ class HandSteppedEnv(gym.GoalEnv):
                 if still and obj_above_table:
                     stable_steps += 1
                 elif i > 10:
+                    exit_reason = 'unstable'
                     break
                 prev_rel_pos = rel_pos
 
             if self.render_substeps:
                 self.render(keep_markers=True)
 
-        if count_stable_steps:
-            return stable_steps
+        if scheduler is not None:
+            scheduler.end_phase(n_substeps, max_steps, exit_reason)
+        if profiler is not None:
+            profiler.record(phase, substeps=n_substeps, wall_s=clock() - tic, exit_reason=exit_reason)
+
+        return exit_reason, stable_steps
+
+    def _move_fingers(self, targets: np.ndarray, threshold=0.01, k=0.1, max_steps=100, multiobjective_solver=False,
+                      phase='move_fingers'):
+        profiler = self.profiler
+        if profiler is not None:
+            tic = clock()
+            ik_s = 0.0
+        scheduler = self.scheduler
+        if scheduler is not None:
+            scheduler.start_phase()
+        exit_reason = 'max_steps'
+        n_substeps = 0
 
-    def _move_fingers(self, targets: np.ndarray, threshold=0.01, k=0.1, max_steps=100, multiobjective_solver=False):
         for _ in range(max_steps):
             fingers_pos_curr = self.get_fingertips_pos()
             err = np.linalg.norm(fingers_pos_curr[:, :3] - targets[:, :3])
             if err < threshold:
+                exit_reason = 'converged'
                 break
 
+            if profiler is not None:
+                ik_tic = clock()
             if multiobjective_solver:
                 vels = []
                 for t_pose, c_pos, body in zip(targets, fingers_pos_curr, FINGERTIP_BODY_NAMES):
@@ -254,11 +321,28 @@ class HandSteppedEnv(gym.GoalEnv):
                     sol, opt, ctrl_idx = self._solve_hand_ik_vel(body, cart_vel, no_wrist=True, check_joint_lims=False)
                     if opt:
                         self.sim.data.ctrl[ctrl_idx] += np.clip(sol, -.5, .5)
+            if profiler is not None:
+                ik_s += clock() - ik_tic
 
             self.sim.step()
+            n_substeps += 1
             if self.render_substeps:
                 self.render(keep_markers=True)
 
+            if scheduler is not None:
+                if self._is_object_on_ground():
+                    exit_reason = 'failure'
+                    break
+                if scheduler.is_still(self.sim.data.qvel):
+                    exit_reason = 'still'
+                    break
+
+        if scheduler is not None:
+            scheduler.end_phase(n_substeps, max_steps, exit_reason)
+        if profiler is not None:
+            profiler.record(phase, substeps=n_substeps, wall_s=clock() - tic, ik_s=ik_s, exit_reason=exit_reason)
+        return exit_reason
+
     # IK solvers
     # ----------------------------
 
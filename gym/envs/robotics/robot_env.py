@@ -5,7 +5,10 @@ import numpy as np
 import gym
 from gym import error, spaces
 from gym.utils import seeding
+from gym.utils.phase_profiler import clock
 from gym.envs.robotics.utils import load_xml_model_with_format
+# imported as a module, as gym.utils.transformations imports gym.envs.robotics
+from gym.utils import transformations
 
 try:
     import mujoco_py
@@ -30,7 +33,14 @@ class RobotEnv(gym.GoalEnv):
 
         self.sim = mujoco_py.MjSim(model, nsubsteps=n_substeps)
         self.viewer = None
+        self.markers = transformations.MarkerManager()
+        # render 'rgb_array' frames with an offscreen context instead of the on-screen viewer
+        self.headless = False
+        self._offscreen_context = None
+        self._pixels = None
         self._mocap_bodies_visible = True
+        # called with (stage, seconds) for each stage of step, e.g. by gym.wrappers.Profile
+        self.step_timer = None
 
         self.metadata = {
             'render.modes': ['human', 'rgb_array'],
@@ -54,6 +64,12 @@ class RobotEnv(gym.GoalEnv):
     def dt(self):
         return self.sim.model.opt.timestep * self.sim.nsubsteps
 
+    @property
+    def _defer_visuals(self):
+        """Whether updates of the simulation that observations do not read (e.g. moving target
+        markers) can be deferred to _render_callback, i.e. when headless and without an on-screen viewer."""
+        return self.headless and self.viewer is None
+
     @property
     def mocap_bodies_visible(self):
         return self._mocap_bodies_visible
@@ -84,12 +100,37 @@ class RobotEnv(gym.GoalEnv):
         return [seed]
 
     def step(self, action):
+        if self.step_timer is not None:
+            return self._timed_step(action)
         action = np.clip(action, self.action_space.low, self.action_space.high)
         self._set_action(action)
         self.sim.step()
         self._step_callback()
         obs = self._get_obs()
+        return self._step_result(obs)
 
+    def _timed_step(self, action):
+        timer = self.step_timer
+        t0 = clock()
+        action = np.clip(action, self.action_space.low, self.action_space.high)
+        self._set_action(action)
+        t1 = clock()
+        self.sim.step()
+        t2 = clock()
+        self._step_callback()
+        t3 = clock()
+        obs = self._get_obs()
+        t4 = clock()
+        result = self._step_result(obs)
+        t5 = clock()
+        timer('_set_action', t1 - t0)
+        timer('sim.step', t2 - t1)
+        timer('_step_callback', t3 - t2)
+        timer('_get_obs', t4 - t3)
+        timer('compute_reward', t5 - t4)
+        return result
+
+    def _step_result(self, obs):
         done = False
         info = {
             'is_success': self._is_success(obs['achieved_goal'], self.goal),
@@ -105,6 +146,8 @@ class RobotEnv(gym.GoalEnv):
         # Gimbel lock) or we may not achieve an initial condition (e.g. an object is within the hand).
         # In this case, we just keep randomizing until we eventually achieve a valid initial
         # configuration.
+        # markers of the previous episode, e.g. targets of its agent phases, are not drawn anymore
+        self.markers.clear()
         did_reset_sim = False
         while not did_reset_sim:
             did_reset_sim = self._reset_sim()
@@ -116,39 +159,97 @@ class RobotEnv(gym.GoalEnv):
         if self.viewer is not None:
             # self.viewer.finish()
             self.viewer = None
-
-    def render(self, mode='human', rgb_options=None):
+            self.markers.viewer = None
+        if self._offscreen_context is not None:
+            if self._offscreen_context in self.sim.render_contexts:
+                self.sim.render_contexts.remove(self._offscreen_context)
+            self._offscreen_context = None
+            self._pixels = None
+
+    def render(self, mode='human', rgb_options=None, keep_markers=False):
+        """Renders the env. Markers of `self.markers` without a key are drawn in this frame
+        only, unless `keep_markers` is True. In 'rgb_array' mode, `rgb_options` can contain:
+
+            camera_id (int or list of int): camera(s) to render, defaults to 3. A list
+                renders all the cameras and returns an array of shape (n_cameras, height, width, 3).
+            size (tuple): (width, height) of the images, defaults to (500, 500).
+            headless (bool): defaults to `self.headless`. Headless rendering uses an offscreen
+                context of the env and never creates the on-screen viewer, so it works without a
+                display.
+            reuse_buffer (bool): defaults to False. If True, headless rendering returns a buffer of
+                the env instead of a new array, which is overwritten by the next headless call.
+        """
         self._render_callback()
         if mode == 'rgb_array':
+            rgb_options = rgb_options or dict()
+            camera_id = rgb_options.get('camera_id', 3)
+            image_size = rgb_options.get('size', (500, 500))
+
+            if rgb_options.get('headless', self.headless):
+                return self._render_offscreen(camera_id, image_size,
+                                              reuse_buffer=rgb_options.get('reuse_buffer', False))
 
             # render for viewer
             viewer = self._get_viewer()
+            self.markers.flush(keep_transient=keep_markers)
             viewer.render()
 
             # get viewer camera properties
             viewer_cam_type = viewer.cam.type
             viewer_cam_id = viewer.cam.fixedcamid
 
-            rgb_options = rgb_options or dict()
-            camera_id = rgb_options.get('camera_id', 3)
-            image_size = rgb_options.get('size', (500, 500))
-
-            # render for rgb array
-            mujoco_py.MjRenderContext.render(viewer, *image_size, camera_id)
-            data = mujoco_py.MjRenderContext.read_pixels(viewer, *image_size, depth=False)
+            images = []
+            for cam_id in np.atleast_1d(camera_id):
+                # render for rgb array
+                mujoco_py.MjRenderContext.render(viewer, *image_size, int(cam_id))
+                data = mujoco_py.MjRenderContext.read_pixels(viewer, *image_size, depth=False)
+                # original image is upside-down, so flip it
+                images.append(data[::-1, :, :])
 
             # restore viewer camera properties
             viewer.cam.type = viewer_cam_type
             viewer.cam.fixedcamid = viewer_cam_id
 
-            # original image is upside-down, so flip it
-            return data[::-1, :, :]
+            return np.array(images) if np.ndim(camera_id) > 0 else images[0]
         elif mode == 'human':
-            self._get_viewer().render()
+            viewer = self._get_viewer()
+            self.markers.flush(keep_transient=keep_markers)
+            viewer.render()
+
+    def _render_offscreen(self, camera_id, image_size, reuse_buffer=False):
+        context = self._get_offscreen_context()
+        camera_ids = np.atleast_1d(camera_id)
+        width, height = image_size
+        shape = (len(camera_ids), height, width, 3)
+        if not reuse_buffer:
+            pixels = np.empty(shape, dtype=np.uint8)
+        else:
+            if self._pixels is None or self._pixels.shape != shape:
+                self._pixels = np.empty(shape, dtype=np.uint8)
+            pixels = self._pixels
+
+        for i, cam_id in enumerate(camera_ids):
+            context.render(width, height, int(cam_id))
+            data = context.read_pixels(width, height, depth=False)
+            # original image is upside-down, so flip it while copying it to the output
+            np.copyto(pixels[i], data[::-1])
+        return pixels if np.ndim(camera_id) > 0 else pixels[0]
+
+    def _get_offscreen_context(self):
+        if self._offscreen_context is None:
+            self._offscreen_context = mujoco_py.MjRenderContextOffscreen(self.sim, device_id=-1)
+            # set up the free camera of the context like the one of the viewer
+            viewer, self.viewer = self.viewer, self._offscreen_context
+            try:
+                self._viewer_setup()
+            finally:
+                self.viewer = viewer
+        return self._offscreen_context
 
     def _get_viewer(self):
         if self.viewer is None:
             self.viewer = mujoco_py.MjViewer(self.sim)
+            self.markers.viewer = self.viewer
             self._viewer_setup()
         return self.viewer
 
@@ -208,6 +208,56 @@ def mat2quat(mat):
     return q
 
 
+def mat2quat_fast(mat):
+    """ Convert Rotation Matrix to Quaternion in closed form (Shepperd's method).
+
+    Unlike mat2quat, which finds the closest rotation with an eigen-decomposition, this
+    assumes `mat` is a proper rotation matrix. It is fully vectorized over leading axes.
+    The returned quaternions have non-negative w, like the ones returned by mat2quat.
+    """
+    mat = np.asarray(mat, dtype=np.float64)
+    assert mat.shape[-2:] == (3, 3), "Invalid shape matrix {}".format(mat)
+    if mat.ndim == 2:
+        return _mat2quat_fast_single(mat)
+
+    m00, m01, m02 = mat[..., 0, 0], mat[..., 0, 1], mat[..., 0, 2]
+    m10, m11, m12 = mat[..., 1, 0], mat[..., 1, 1], mat[..., 1, 2]
+    m20, m21, m22 = mat[..., 2, 0], mat[..., 2, 1], mat[..., 2, 2]
+
+    # 4 * (w^2, x^2, y^2, z^2) - 1, the largest component is computed from its square
+    # and the other ones from the off-diagonal terms, which is numerically safest
+    diag = np.stack([m00 + m11 + m22, m00 - m11 - m22, m11 - m00 - m22, m22 - m00 - m11], axis=-1)
+    case = np.argmax(diag, axis=-1)
+    t = 1.0 + np.max(diag, axis=-1)
+
+    q = np.empty(mat.shape[:-2] + (4,))
+    q[..., 0] = np.choose(case, [t, m21 - m12, m02 - m20, m10 - m01])
+    q[..., 1] = np.choose(case, [m21 - m12, t, m01 + m10, m02 + m20])
+    q[..., 2] = np.choose(case, [m02 - m20, m01 + m10, t, m12 + m21])
+    q[..., 3] = np.choose(case, [m10 - m01, m02 + m20, m12 + m21, t])
+    # Prefer quaternion with positive w
+    # (q * -1 corresponds to same rotation as q)
+    q *= (np.where(q[..., 0] < 0, -0.5, 0.5) / np.sqrt(t))[..., None]
+    return q
+
+
+def _mat2quat_fast_single(mat):
+    (m00, m01, m02), (m10, m11, m12), (m20, m21, m22) = mat.tolist()
+    diag = (m00 + m11 + m22, m00 - m11 - m22, m11 - m00 - m22, m22 - m00 - m11)
+    case = max(range(4), key=diag.__getitem__)
+    t = 1.0 + diag[case]
+    if case == 0:
+        q = [t, m21 - m12, m02 - m20, m10 - m01]
+    elif case == 1:
+        q = [m21 - m12, t, m01 + m10, m02 + m20]
+    elif case == 2:
+        q = [m02 - m20, m01 + m10, t, m12 + m21]
+    else:
+        q = [m10 - m01, m02 + m20, m12 + m21, t]
+    scale = (-0.5 if q[0] < 0 else 0.5) / np.sqrt(t)
+    return np.array(q) * scale
+
+
 def quat2euler(quat):
     """ Convert Quaternion to Euler Angles.  See rotation.py for notes """
     return mat2euler(quat2mat(quat))
@@ -271,16 +321,18 @@ def quat_mul(q0, q1):
     x = w0 * x1 + x0 * w1 + y0 * z1 - z0 * y1
     y = w0 * y1 + y0 * w1 + z0 * x1 - x0 * z1
     z = w0 * z1 + z0 * w1 + x0 * y1 - y0 * x1
-    q = np.array([w, x, y, z])
-    if q.ndim == 2:
-        q = q.swapaxes(0, 1)
+    q = np.stack([w, x, y, z], axis=-1)
     assert q.shape == q0.shape
     return q
 
 def quat_rot_vec(q, v0):
-    q_v0 = np.array([0, v0[0], v0[1], v0[2]])
+    q = np.asarray(q, dtype=np.float64)
+    v0 = np.asarray(v0, dtype=np.float64)
+    q_v0 = np.zeros(np.broadcast(q[..., 0], v0[..., 0]).shape + (4,))
+    q_v0[..., 1:] = v0
+    q = np.broadcast_to(q, q_v0.shape)
     q_v = quat_mul(q, quat_mul(q_v0, quat_conjugate(q)))
-    v = q_v[1:]
+    v = q_v[..., 1:]
     return v
 
 def quat_identity():
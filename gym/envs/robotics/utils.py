@@ -4,6 +4,7 @@ import uuid
 import numpy as np
 
 from gym import error
+from gym.envs.robotics import rotations
 try:
     import mujoco_py
 except ImportError as e:
@@ -46,6 +47,49 @@ def load_xml_model_with_format(full_xml_path, xml_format: dict):
     return model
 
 
+class SitePoseReader(object):
+    """Reads the world poses (position and quaternion) of a fixed set of sites.
+
+    All site rotation matrices are converted in a single vectorized closed-form pass,
+    instead of an eigen-decomposition per site. If `cache` is True, the poses are
+    computed at most once per simulation step: they are reused while `sim.data.time`
+    and `sim.data.qpos` are unchanged, which assumes that kinematics are up to date
+    (i.e. `sim.forward()` or `sim.step()` was called after changing the state).
+    """
+
+    def __init__(self, site_names, cache=True):
+        self.site_names = tuple(site_names)
+        self.cache = cache
+        self._index = {name: i for i, name in enumerate(self.site_names)}
+        self._model = None
+        self._site_ids = None
+        self._key = None
+        self._poses = None
+
+    def __call__(self, sim) -> np.ndarray:
+        """Returns a (n_sites, 7) array of site poses. Do not modify it in place."""
+        if sim.model is not self._model:
+            self._model = sim.model
+            self._site_ids = np.array([sim.model.site_name2id(name) for name in self.site_names])
+            self._key = None
+
+        if self.cache:
+            key = (sim.data.time, sim.data.qpos.tobytes())
+            if key == self._key:
+                return self._poses
+
+        poses = np.empty((len(self._site_ids), 7))
+        poses[:, :3] = sim.data.site_xpos[self._site_ids]
+        poses[:, 3:] = rotations.mat2quat_fast(sim.data.site_xmat[self._site_ids].reshape(-1, 3, 3))
+        if self.cache:
+            self._key = key
+            self._poses = poses
+        return poses
+
+    def get_pose(self, sim, site_name) -> np.ndarray:
+        return self(sim)[self._index[site_name]].copy()
+
+
 def robot_get_obs(sim):
     """Returns all joint positions and velocities associated with
     a robot.
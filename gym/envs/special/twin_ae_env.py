@@ -1,14 +1,143 @@
+import queue
+import threading
+
 import numpy as np
 
 import gym
+from gym import error
 from gym.agents.base import BaseAgent
+from gym.utils.teacher_cache import TeacherTrajectoryCache, teacher_key_for
+
+
+class _TeacherWorker(object):
+    """Rolls out the teacher agent in its env on a background thread, streaming the
+    teacher observations through a bounded queue. Each step is done while holding `lock`,
+    so that the teacher env can be safely accessed (e.g. rendered) from other threads.
+
+    Once the worker has stopped, i.e. after `n_steps` observations, after an exception of
+    the rollout or after `close`, `get` raises that exception (an error.Error when the
+    rollout ended or the worker was closed) on every call instead of blocking."""
+
+    def __init__(self, *, agent: BaseAgent, env: gym.Env, obs, n_steps: int, lock: threading.Lock, queue_size: int):
+        self._agent = agent
+        self._env = env
+        self._lock = lock
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._exc = None
+        self._thread = threading.Thread(target=self._run, args=(obs, n_steps), daemon=True)
+        self._thread.start()
+
+    def _run(self, obs, n_steps):
+        try:
+            for _ in range(n_steps):
+                if self._stop.is_set():
+                    return
+                with self._lock:
+                    action = self._agent.predict(obs)
+                    obs, _, _, _ = self._env.step(action)
+                self._put((obs, None))
+            exc = error.Error('The teacher rollout ended after {} steps'.format(n_steps))
+        except Exception as e:
+            exc = e
+        self._put((None, exc))
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def get(self):
+        """Returns the next teacher observation, blocking until it is available."""
+        while self._exc is None:
+            if self._stop.is_set():
+                self._exc = error.Error('The teacher worker was closed')
+                break
+            try:
+                obs, exc = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if exc is None:
+                return obs
+            self._exc = exc
+        raise self._exc
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def flatten_goal_obs(obs):
+    if isinstance(obs, dict):
+        return np.r_[obs['observation'], obs['desired_goal']]
+    return np.asarray(obs)
+
+
+class AffineObsTransform(object):
+    """Observation transform `flatten(obs) * scale + offset`, which can also be applied to a batch
+    of observations with a single vectorized op (see `transform_batch`)."""
+
+    def __init__(self, scale, offset, flatten=flatten_goal_obs):
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.offset = np.asarray(offset, dtype=np.float64)
+        self.flatten = flatten
+
+    @classmethod
+    def from_scaler(cls, scaler, flatten=flatten_goal_obs):
+        """Equivalent of a fitted sklearn StandardScaler or MinMaxScaler."""
+        if hasattr(scaler, 'min_'):
+            return cls(scaler.scale_, scaler.min_, flatten=flatten)
+        # mean_ is also fitted with with_mean=False, so the flags decide what the scaler applies
+        mean = scaler.mean_ if scaler.with_mean else 0.0
+        scale = scaler.scale_ if scaler.with_std else 1.0
+        return cls(1.0 / scale, -mean / scale, flatten=flatten)
+
+    def __call__(self, obs):
+        return self.flatten(obs) * self.scale + self.offset
+
+    def transform_batch(self, observations):
+        x = np.array([self.flatten(o) for o in observations], dtype=np.float64)
+        x *= self.scale
+        x += self.offset
+        return x
+
+
+def _transform_batch(transform, observations):
+    if hasattr(transform, 'transform_batch'):
+        return transform.transform_batch(observations)
+    if callable(transform):
+        return np.array([transform(o) for o in observations])
+    return observations
 
 
 class TwinAutoencoderEnv(gym.Env):
+    """Student env rewarded for imitating a scripted teacher, with the imitation reward computed by a
+    twin autoencoder model on the pair of student and teacher observations.
+
+    If `async_teacher` is True, the teacher is rolled out ahead of the student in a background thread
+    after each reset, since its trajectory only depends on the synchronized goals. Student stepping then
+    overlaps with teacher simulation, and at most `teacher_queue_size` teacher observations are buffered.
+
+    If a `teacher_cache` is given, teacher rollouts are looked up (and recorded on misses) by the
+    synchronized goal, the initial state of the teacher and the seed, and replayed from the cache
+    without simulating the teacher. The teacher env is then not stepped, so rendering it shows the
+    initial state.
+    `teacher_env_kwargs` are used in the cache keys and default to the ones of the teacher env spec.
+
+    Several instances sharing the same model and obs transforms can be stepped together with
+    `TwinAutoencoderEnv.step_batch`, which computes all imitation rewards with a single model call.
+    Obs transforms with a `transform_batch` method (e.g. `AffineObsTransform`) are then applied to
+    all observations at once.
+    """
 
     def __init__(self, *, teacher_agent: BaseAgent, teacher_env: gym.Env, student_env: gym.Env, twin_ae_model,
                  student_is_a_env=True, student_obs_transform=None, teacher_obs_transform=None, sync_goals=None,
-                 task_rew_weight=1.0, imitation_rew_weight=1.0, reset_when_done=True, rew_weight_update_rule=None):
+                 task_rew_weight=1.0, imitation_rew_weight=1.0, reset_when_done=True, rew_weight_update_rule=None,
+                 async_teacher=False, teacher_queue_size=16, teacher_cache: TeacherTrajectoryCache=None,
+                 teacher_env_kwargs=None):
 
         self.metadata = {
             'render.modes': ['human', 'rgb_array'],
@@ -43,6 +172,16 @@ class TwinAutoencoderEnv(gym.Env):
         self._teacher_last_obs = None
         self._student_last_obs = None
 
+        self._async_teacher = async_teacher
+        self._teacher_queue_size = teacher_queue_size
+        self._teacher_worker = None
+        self._teacher_lock = threading.Lock()
+
+        self._teacher_cache = teacher_cache
+        self._teacher_env_kwargs = teacher_env_kwargs
+        self._teacher_traj = None
+        self._seed = None
+
         self.seed()
 
     def _compute_imitation_reward(self, student_obs, teacher_obs):
@@ -63,11 +202,38 @@ class TwinAutoencoderEnv(gym.Env):
         sim_loss = self.twin_ae_model.compute_obs_sim_loss(a_obs, b_obs)
         return sim_loss.mean()
 
+    def _compute_imitation_reward_batch(self, student_obs, teacher_obs):
+        """Same as _compute_imitation_reward for lists of observations, with a single model call."""
+
+        student_obs = _transform_batch(self._student_obs_transform, student_obs)
+        teacher_obs = _transform_batch(self._teacher_obs_transform, teacher_obs)
+
+        if self._student_is_a_env:
+            a_obs = student_obs
+            b_obs = teacher_obs
+        else:
+            b_obs = student_obs
+            a_obs = teacher_obs
+
+        # the loss of each observation is the mean of its losses, as in _compute_imitation_reward
+        sim_loss = np.asarray(self.twin_ae_model.compute_obs_sim_loss(a_obs, b_obs))
+        if sim_loss.ndim == 0 or sim_loss.shape[0] != len(a_obs):
+            raise error.Error('compute_obs_sim_loss returned a loss of shape {} for a batch of {} observations, '
+                              'expected one loss (or row of losses) per observation'.format(sim_loss.shape, len(a_obs)))
+        return sim_loss.reshape(len(a_obs), -1).mean(axis=1)
+
     def seed(self, seed=None):
+        self._seed = seed
         self.student_env.seed(seed=seed)
         self.teacher_env.seed(seed=seed)
 
+    def _stop_teacher_worker(self):
+        if self._teacher_worker is not None:
+            self._teacher_worker.close()
+            self._teacher_worker = None
+
     def reset(self):
+        self._stop_teacher_worker()
         self.teacher_agent.reset()
         t_obs = self.teacher_env.reset()
         s_obs = self.student_env.reset()
@@ -82,9 +248,23 @@ class TwinAutoencoderEnv(gym.Env):
         self._student_env_ep_steps = 0
         self._teacher_env_ep_steps = 0
 
+        self._teacher_traj = None
+        if self._teacher_cache is not None:
+            key = teacher_key_for(self.teacher_env, t_obs, seed=self._seed, env_kwargs=self._teacher_env_kwargs)
+            self._teacher_traj = self._teacher_cache.get_or_record(
+                key, agent=self.teacher_agent, env=self.teacher_env, obs=t_obs, n_steps=self._teacher_env_ep_len,
+            )
+        elif self._async_teacher:
+            self._teacher_worker = _TeacherWorker(
+                agent=self.teacher_agent, env=self.teacher_env, obs=t_obs, n_steps=self._teacher_env_ep_len,
+                lock=self._teacher_lock, queue_size=self._teacher_queue_size,
+            )
+
         return s_obs
 
-    def step(self, action):
+    def _step_student(self, action):
+        """Steps the student env and lets the teacher catch up. Returns the student step
+        results and the teacher observation to compare the student observation with."""
 
         self._steps_since_init += 1
         if callable(self.rew_weight_update_rule):
@@ -99,20 +279,29 @@ class TwinAutoencoderEnv(gym.Env):
         s_obs, s_rew, s_done, s_info = self.student_env.step(action)
         self._student_env_ep_steps += 1
         self._student_last_obs = s_obs
-
-        imitation_reward = -self._compute_imitation_reward(s_obs, self._teacher_last_obs)
-        task_reward = s_rew
-        tot_reward = imitation_reward * self.imitation_rew_weight + task_reward * self.task_rew_weight
+        t_obs = self._teacher_last_obs
 
         teacher_des_step = int(self._teacher_student_ep_len_ratio * self._student_env_ep_steps)
         teacher_des_step = min(self._teacher_env_ep_len, teacher_des_step)
         teacher_needed_steps = max(0, teacher_des_step - self._teacher_env_ep_steps)
 
         for _ in range(teacher_needed_steps):
-            teacher_act = self.teacher_agent.predict(self._teacher_last_obs)
-            t_obs, t_rew, t_done, t_info = self.teacher_env.step(teacher_act)
+            if self._teacher_traj is not None:
+                t_next_obs = self._teacher_traj[self._teacher_env_ep_steps + 1]
+            elif self._teacher_worker is not None:
+                t_next_obs = self._teacher_worker.get()
+            else:
+                teacher_act = self.teacher_agent.predict(self._teacher_last_obs)
+                t_next_obs, t_rew, t_done, t_info = self.teacher_env.step(teacher_act)
             self._teacher_env_ep_steps += 1
-            self._teacher_last_obs = t_obs
+            self._teacher_last_obs = t_next_obs
+
+        return s_obs, s_rew, s_done, s_info, t_obs
+
+    def _finish_step(self, s_obs, s_rew, s_done, s_info, imitation_loss):
+        imitation_reward = -imitation_loss
+        task_reward = s_rew
+        tot_reward = imitation_reward * self.imitation_rew_weight + task_reward * self.task_rew_weight
 
         done = s_done or self._student_env_ep_steps >= self._student_env_ep_len
         if done and self.reset_when_done:
@@ -120,11 +309,42 @@ class TwinAutoencoderEnv(gym.Env):
 
         return s_obs, tot_reward, done, s_info
 
+    def step(self, action):
+        s_obs, s_rew, s_done, s_info, t_obs = self._step_student(action)
+        imitation_loss = self._compute_imitation_reward(s_obs, t_obs)
+        return self._finish_step(s_obs, s_rew, s_done, s_info, imitation_loss)
+
+    @staticmethod
+    def step_batch(envs, actions):
+        """Steps several TwinAutoencoderEnvs sharing the same model and obs transforms, computing
+        their imitation rewards with a single model call.
+
+        Returns:
+            tuple: list of observations, array of rewards, array of dones and list of infos.
+        """
+        env0 = envs[0]
+        for env in envs[1:]:
+            if (env.twin_ae_model is not env0.twin_ae_model or env._student_is_a_env != env0._student_is_a_env or
+                    env._student_obs_transform is not env0._student_obs_transform or
+                    env._teacher_obs_transform is not env0._teacher_obs_transform):
+                raise error.Error('Envs stepped in a batch must share the same model and obs transforms')
+
+        steps = [env._step_student(a) for env, a in zip(envs, actions)]
+        losses = env0._compute_imitation_reward_batch([s[0] for s in steps], [s[4] for s in steps])
+        results = [env._finish_step(*s[:4], loss) for env, s, loss in zip(envs, steps, losses)]
+
+        obs, rews, dones, infos = zip(*results)
+        return list(obs), np.array(rews), np.array(dones), list(infos)
+
     def render(self, *args, **kwargs):
         s_res = self.student_env.render(**kwargs)
-        t_res = self.teacher_env.render(**kwargs)
+        with self._teacher_lock:
+            t_res = self.teacher_env.render(**kwargs)
         return s_res, t_res
 
+    def close(self):
+        self._stop_teacher_worker()
+
 
 def _test_env():
 
@@ -166,13 +386,8 @@ def _test_env():
     s_table_tf = student_env.unwrapped.get_table_surface_pose()
     t_table_tf = teacher_env.unwrapped.get_table_surface_pose()
 
-    def _student_obs_transformer(obs_dict):
-        o = np.r_[obs_dict['observation'], obs_dict['desired_goal']]
-        return dataset.a_scaler.transform(o[None], copy=True)[0]
-
-    def _teacher_obs_transformer(obs_dict):
-        o = np.r_[obs_dict['observation'], obs_dict['desired_goal']]
-        return dataset.b_scaler.transform(o[None], copy=True)[0]
+    _student_obs_transformer = AffineObsTransform.from_scaler(dataset.a_scaler)
+    _teacher_obs_transformer = AffineObsTransform.from_scaler(dataset.b_scaler)
 
     def _sync_goals(*, t_env, s_env, **kwargs_):
         tf_to_goal = tf.get_tf(np.r_[s_env.goal, 1., 0., 0., 0.], s_table_tf)
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from gym import error
+from gym.envs.toy_text import discrete
+from gym.envs.toy_text.frozen_lake import FrozenLakeEnv
+
+
+def _alias_probs(accept, alias):
+    n = len(accept)
+    probs = accept / n
+    for i in range(n):
+        probs[alias[i]] += (1 - accept[i]) / n
+    return probs
+
+
+def test_alias_table():
+    rng = np.random.RandomState(0)
+    for n in range(1, 8):
+        p = rng.rand(n) * (rng.rand(n) > 0.3)
+        p[0] += 1e-3
+        p /= p.sum()
+        accept, alias = discrete.alias_table(p)
+        np.testing.assert_allclose(_alias_probs(accept, alias), p)
+
+
+def test_compiled_transitions():
+    env = FrozenLakeEnv()
+    for s in range(env.nS):
+        for a in range(env.nA):
+            start, end = env.transition_offsets[s * env.nA + a], env.transition_offsets[s * env.nA + a + 1]
+            assert [(p, ns, r, d) for p, ns, r, d in env.P[s][a]] == list(zip(
+                env.transition_probs[start:end], env.transition_next_states[start:end],
+                env.transition_rewards[start:end], env.transition_dones[start:end]))
+
+    # the sampled next states follow the transition probabilities
+    env.seed(0)
+    counts = np.zeros(env.nS)
+    for _ in range(30000):
+        env.s = 4
+        s, _, _, info = env.step(2)
+        counts[s] += 1
+        assert isinstance(s, int) and info['prob'] == pytest.approx(1 / 3)
+    np.testing.assert_allclose(counts[[0, 5, 8]] / 30000, 1 / 3, atol=0.02)
+
+
+def test_missing_transitions():
+    P = {0: {0: [(1.0, 0, 0.0, False)], 1: []}}
+    with pytest.raises(error.Error):
+        discrete.DiscreteEnv(1, 2, P, [1.0])
+
+
+@pytest.mark.parametrize('action', [-1, 4, 100])
+def test_invalid_action(action):
+    env = FrozenLakeEnv()
+    env.reset()
+    with pytest.raises(KeyError):
+        env.step(action)
+    with pytest.raises(KeyError):
+        env.batch_step(np.zeros(3, dtype=np.int64), np.array([0, action, 1]))
+    # the env is unchanged
+    assert env.s == 0 and env.lastaction is None
+
+
+def test_batch_step():
+    env = FrozenLakeEnv()
+    env.seed(0)
+    n = 30000
+    next_states, rewards, dones, probs = env.batch_step(np.full(n, 4), np.full(n, 2))
+    np.testing.assert_allclose(np.bincount(next_states, minlength=env.nS)[[0, 5, 8]] / n, 1 / 3, atol=0.02)
+    assert np.array_equal(dones, next_states == 5)
+    np.testing.assert_allclose(probs, 1 / 3)
+
+    # state 14, right: the goal 15, done and reset to the start state 0, or the states 10 and 14
+    next_states, rewards, dones, _ = env.batch_step(np.full(n, 14), np.full(n, 2), reset_done=True)
+    assert set(np.unique(next_states)) <= {0, 10, 14}
+    assert rewards.sum() > 0 and np.all(next_states[dones] == 0)
+    assert env.batch_reset(10).tolist() == [0] * 10
+
+
+def test_vec_env():
+    vec_env = discrete.DiscreteVecEnv(FrozenLakeEnv(map_name='8x8'), 1000)
+    vec_env.seed(0)
+    with pytest.raises(error.ResetNeeded):
+        vec_env.step(np.zeros(1000, dtype=np.int64))
+    obs = vec_env.reset()
+    assert obs.shape == (1000,) and np.all(obs == 0)
+    for _ in range(200):
+        obs, rewards, dones, info = vec_env.step(np.random.RandomState(0).randint(4, size=1000))
+        assert obs.shape == rewards.shape == dones.shape == info['prob'].shape == (1000,)
+        assert np.all(obs[dones] == 0)
+    assert np.all(vec_env.states == obs)
@@ -0,0 +1,207 @@
+import threading
+
+import numpy as np
+import pytest
+
+import gym
+from gym import error, spaces
+from gym.agents.base import BaseAgent
+from gym.envs.registration import EnvSpec
+from gym.envs.special.twin_ae_env import AffineObsTransform, TwinAutoencoderEnv, _TeacherWorker
+
+
+class CountingEnv(object):
+    def __init__(self):
+        self.t = 0
+
+    def step(self, action):
+        self.t += 1
+        return np.full(2, self.t), 0.0, False, dict()
+
+
+class StubAgent(BaseAgent):
+    def __init__(self, env, fail_at=None, release=None):
+        super(StubAgent, self).__init__(env)
+        self.fail_at = fail_at
+        self.release = release
+
+    def predict(self, obs, **kwargs):
+        if self.release is not None:
+            self.release.wait()
+        if self.fail_at is not None and self._env.t + 1 == self.fail_at:
+            raise ValueError('teacher failure')
+        return np.zeros(2)
+
+
+def _worker(agent, env, n_steps, queue_size=2):
+    return _TeacherWorker(agent=agent, env=env, obs=np.zeros(2), n_steps=n_steps,
+                          lock=threading.Lock(), queue_size=queue_size)
+
+
+def test_teacher_worker_order():
+    env = CountingEnv()
+    worker = _worker(StubAgent(env), env, n_steps=5)
+    assert [worker.get()[0] for _ in range(5)] == [1, 2, 3, 4, 5]
+    # finished workers raise instead of blocking, on every call
+    for _ in range(2):
+        with pytest.raises(error.Error):
+            worker.get()
+    worker.close()
+
+
+def test_teacher_worker_error():
+    env = CountingEnv()
+    worker = _worker(StubAgent(env, fail_at=3), env, n_steps=5)
+    assert worker.get()[0] == 1
+    assert worker.get()[0] == 2
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            worker.get()
+    worker.close()
+
+
+def test_teacher_worker_close_while_blocked():
+    env = CountingEnv()
+    release = threading.Event()
+    worker = _worker(StubAgent(env, release=release), env, n_steps=5)
+
+    raised = []
+
+    def get():
+        try:
+            worker.get()
+        except error.Error as e:
+            raised.append(e)
+
+    getter = threading.Thread(target=get)
+    getter.start()
+    closer = threading.Thread(target=worker.close)
+    closer.start()
+    # get returns while the teacher is still stepping
+    getter.join(timeout=5)
+    assert not getter.is_alive() and len(raised) == 1
+
+    release.set()
+    closer.join(timeout=5)
+    assert not closer.is_alive()
+    with pytest.raises(error.Error):
+        worker.get()
+
+
+class LineEnv(gym.Env):
+    action_space = spaces.Box(-1, 1, shape=(2,), dtype=np.float64)
+    observation_space = spaces.Box(-np.inf, np.inf, shape=(4,), dtype=np.float64)
+
+    def __init__(self, ep_len, goal):
+        self.spec = EnvSpec('Line-v0', max_episode_steps=ep_len)
+        self.goal = np.asarray(goal, dtype=np.float64)
+        self.pos = np.zeros(2)
+
+    def _obs(self):
+        return dict(observation=self.pos.copy(), desired_goal=self.goal.copy())
+
+    def seed(self, seed=None):
+        return [seed]
+
+    def reset(self):
+        self.pos = np.zeros(2)
+        return self._obs()
+
+    def step(self, action):
+        self.pos = self.pos + action
+        return self._obs(), -np.linalg.norm(self.goal - self.pos), False, dict()
+
+
+class ConstantAgent(BaseAgent):
+    def predict(self, obs, **kwargs):
+        return np.r_[0.1, -0.05]
+
+
+class SquaredErrorModel(object):
+    def compute_obs_sim_loss(self, a_obs, b_obs):
+        return (np.asarray(a_obs) - np.asarray(b_obs)) ** 2
+
+
+def _twin_envs(n, model, transform):
+    envs = []
+    for i in range(n):
+        teacher_env = LineEnv(20, goal=[1.0, i])
+        envs.append(TwinAutoencoderEnv(
+            teacher_agent=ConstantAgent(teacher_env), teacher_env=teacher_env, student_env=LineEnv(10, goal=[i, 1.0]),
+            twin_ae_model=model, student_obs_transform=transform, teacher_obs_transform=transform,
+        ))
+    return envs
+
+
+def test_step_batch_matches_step():
+    model = SquaredErrorModel()
+    transform = AffineObsTransform(scale=[2.0, 1.0, 0.5, 1.0], offset=[0.0, 1.0, -1.0, 0.0])
+    batch_envs = _twin_envs(4, model, transform)
+    envs = _twin_envs(4, model, transform)
+    for env in batch_envs + envs:
+        env.reset()
+
+    rng = np.random.RandomState(0)
+    for _ in range(25):
+        actions = rng.uniform(-1, 1, size=(4, 2))
+        obs, rews, dones, _ = TwinAutoencoderEnv.step_batch(batch_envs, actions)
+        for i, (env, a) in enumerate(zip(envs, actions)):
+            o, r, d, _ = env.step(a)
+            assert np.allclose(o['observation'], obs[i]['observation'])
+            assert r == pytest.approx(rews[i]) and d == dones[i]
+
+
+def test_step_batch_loss_shape():
+    class MeanLossModel(object):
+        def compute_obs_sim_loss(self, a_obs, b_obs):
+            return np.mean((np.asarray(a_obs) - np.asarray(b_obs)) ** 2)
+
+    envs = _twin_envs(3, MeanLossModel(), AffineObsTransform(scale=1.0, offset=0.0))
+    for env in envs:
+        env.reset()
+    with pytest.raises(error.Error):
+        TwinAutoencoderEnv.step_batch(envs, np.zeros((3, 2)))
+
+
+class _Scaler(object):
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+def test_affine_obs_transform_from_scaler():
+    rng = np.random.RandomState(0)
+    x = rng.normal(size=(6, 4)) * [1.0, 10.0, 0.1, 2.0] + [0.0, 5.0, -1.0, 3.0]
+    observations = [dict(observation=o[:2], desired_goal=o[2:]) for o in x]
+
+    # StandardScaler: (x - mean_) / scale_, where mean_ is fitted even with with_mean=False
+    mean, std = x.mean(axis=0), x.std(axis=0)
+    for with_mean, with_std, expected in [(True, True, (x - mean) / std),
+                                          (False, True, x / std),
+                                          (True, False, x - mean),
+                                          (False, False, x)]:
+        scaler = _Scaler(with_mean=with_mean, with_std=with_std,
+                         mean_=mean if with_mean or with_std else None, scale_=std if with_std else None)
+        transform = AffineObsTransform.from_scaler(scaler)
+        assert np.allclose(transform.transform_batch(observations), expected)
+        assert np.allclose(transform(observations[2]), expected[2])
+
+    # MinMaxScaler to [-1, 1]: x * scale_ + min_
+    lo, hi = x.min(axis=0), x.max(axis=0)
+    scale = 2.0 / (hi - lo)
+    transform = AffineObsTransform.from_scaler(_Scaler(scale_=scale, min_=-1.0 - lo * scale))
+    y = transform.transform_batch(observations)
+    assert np.allclose(y.min(axis=0), -1.0) and np.allclose(y.max(axis=0), 1.0)
+
+
+@pytest.mark.parametrize('scaler_name,kwargs', [
+    ('StandardScaler', dict()),
+    ('StandardScaler', dict(with_mean=False)),
+    ('StandardScaler', dict(with_std=False)),
+    ('MinMaxScaler', dict()),
+])
+def test_affine_obs_transform_matches_sklearn(scaler_name, kwargs):
+    preprocessing = pytest.importorskip('sklearn.preprocessing')
+    x = np.random.RandomState(0).normal(size=(20, 4)) * 3.0 + 1.0
+    scaler = getattr(preprocessing, scaler_name)(**kwargs).fit(x)
+    transform = AffineObsTransform.from_scaler(scaler, flatten=np.asarray)
+    assert np.allclose(transform.transform_batch(x), scaler.transform(x))
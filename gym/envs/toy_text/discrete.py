@@ -1,6 +1,6 @@
 import numpy as np
 
-from gym import Env, spaces
+from gym import Env, error, spaces
 from gym.utils import seeding
 
 def categorical_sample(prob_n, np_random):
@@ -13,6 +13,29 @@ def categorical_sample(prob_n, np_random):
     return (csprob_n > np_random.rand()).argmax()
 
 
+def alias_table(prob_n):
+    """
+    Returns the tables of the alias method (Vose) for a categorical distribution:
+    an outcome i drawn uniformly is kept with probability accept[i], and replaced
+    by alias[i] otherwise
+    """
+    prob_n = np.asarray(prob_n, dtype=np.float64)
+    n = len(prob_n)
+    scaled = prob_n * (n / prob_n.sum())
+    accept = np.ones(n)
+    alias = np.arange(n)
+    small = [i for i in range(n) if scaled[i] < 1.0]
+    large = [i for i in range(n) if scaled[i] >= 1.0]
+    while small and large:
+        i, j = small.pop(), large.pop()
+        accept[i] = scaled[i]
+        alias[i] = j
+        scaled[j] -= 1.0 - scaled[i]
+        (small if scaled[j] < 1.0 else large).append(j)
+    # the remaining outcomes have a probability of 1 up to rounding errors
+    return accept, alias
+
+
 class DiscreteEnv(Env):
 
     """
@@ -26,7 +49,16 @@ class DiscreteEnv(Env):
       P[s][a] == [(probability, nextstate, reward, done), ...]
     (**) list or array of length nS
 
+    P is compiled into flat arrays when the env is constructed (call
+    `compile_transitions` after modifying it): the transitions of P[s][a] are
+    at indices transition_offsets[s * nA + a] to transition_offsets[s * nA + a + 1]
+    of transition_probs, transition_next_states, transition_rewards and
+    transition_dones (a CSR layout, that is dense for envs with the same number of
+    transitions for each state and action), and alias_accept and alias_indices are
+    the alias tables sampling them with a single random number per step.
 
+    `batch_reset` and `batch_step` reset and step many instances of the env at once
+    with vectorized sampling, see also DiscreteVecEnv.
     """
     def __init__(self, nS, nA, P, isd):
         self.P = P
@@ -38,22 +70,125 @@ class DiscreteEnv(Env):
         self.action_space = spaces.Discrete(self.nA)
         self.observation_space = spaces.Discrete(self.nS)
 
+        self.compile_transitions()
         self.seed()
         self.reset()
 
+    def compile_transitions(self):
+        counts = np.zeros(self.nS * self.nA, dtype=np.int64)
+        transitions = []
+        for s in range(self.nS):
+            for a in range(self.nA):
+                if len(self.P[s][a]) == 0:
+                    raise error.Error('No transition for state {} and action {}'.format(s, a))
+                counts[s * self.nA + a] = len(self.P[s][a])
+                transitions += self.P[s][a]
+
+        self.transition_offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.transition_probs = np.array([t[0] for t in transitions], dtype=np.float64)
+        self.transition_next_states = np.array([t[1] for t in transitions], dtype=np.int64)
+        self.transition_rewards = np.array([t[2] for t in transitions], dtype=np.float64)
+        self.transition_dones = np.array([t[3] for t in transitions], dtype=bool)
+        self.alias_accept = np.empty(len(transitions))
+        self.alias_indices = np.empty(len(transitions), dtype=np.int64)
+        for sa in range(self.nS * self.nA):
+            start, end = self.transition_offsets[sa], self.transition_offsets[sa + 1]
+            accept, alias = alias_table(self.transition_probs[start:end])
+            self.alias_accept[start:end] = accept
+            self.alias_indices[start:end] = start + alias
+
+        self.isd_accept, self.isd_alias = alias_table(self.isd)
+
+        # python lists index faster than arrays in step, and keep the types of P
+        self._transitions = transitions
+        self._offsets = self.transition_offsets.tolist()
+        self._accept = self.alias_accept.tolist()
+        self._alias = self.alias_indices.tolist()
+
     def seed(self, seed=None):
         self.np_random, seed = seeding.np_random(seed)
         return [seed]
 
+    @staticmethod
+    def _sample_alias(starts, counts, accept, alias, np_random):
+        u = np_random.rand(len(starts)) * counts
+        i = u.astype(np.int64)
+        k = starts + i
+        return np.where(u - i >= accept[k], alias[k], k)
+
+    def batch_reset(self, n) -> np.ndarray:
+        """Returns the initial states of n instances of the env."""
+        zeros = np.zeros(n, dtype=np.int64)
+        return self._sample_alias(zeros, len(self.isd_accept), self.isd_accept, self.isd_alias, self.np_random)
+
+    def batch_step(self, states, actions, reset_done=False):
+        """
+        Steps instances of the env in the given states with the given actions, without
+        changing the state of this env. Returns arrays with the next state, reward, done
+        and probability of the transition of each instance. With reset_done, the next
+        states of the done instances are initial states instead (as in DiscreteVecEnv).
+        """
+        actions = np.asarray(actions)
+        invalid = (actions < 0) | (actions >= self.nA)
+        if invalid.any():
+            raise KeyError(actions[invalid][0])
+        sa = np.asarray(states) * self.nA + actions
+        starts = self.transition_offsets[sa]
+        counts = self.transition_offsets[sa + 1] - starts
+        k = self._sample_alias(starts, counts, self.alias_accept, self.alias_indices, self.np_random)
+
+        next_states = self.transition_next_states[k]
+        dones = self.transition_dones[k]
+        if reset_done and dones.any():
+            next_states[dones] = self.batch_reset(np.count_nonzero(dones))
+        return next_states, self.transition_rewards[k], dones, self.transition_probs[k]
+
     def reset(self):
         self.s = categorical_sample(self.isd, self.np_random)
         self.lastaction=None
         return self.s
 
     def step(self, a):
-        transitions = self.P[self.s][a]
-        i = categorical_sample([t[0] for t in transitions], self.np_random)
-        p, s, r, d= transitions[i]
+        # as indexing P, out-of-range actions must not wrap into other states' transitions
+        if not 0 <= a < self.nA:
+            raise KeyError(a)
+        sa = self.s * self.nA + a
+        start = self._offsets[sa]
+        # the integer part of u picks a transition, the fractional part decides on its alias
+        u = self.np_random.rand() * (self._offsets[sa + 1] - start)
+        i = int(u)
+        k = start + i
+        if u - i >= self._accept[k]:
+            k = self._alias[k]
+        p, s, r, d = self._transitions[k]
         self.s = s
         self.lastaction=a
         return (s, r, d, {"prob" : p})
+
+
+class DiscreteVecEnv(object):
+    """
+    n instances of a DiscreteEnv stepped together with its batch_step, each instance
+    being reset as soon as it is done: the observation returned for a done instance is
+    the initial state of its next episode. Actions, observations, rewards and dones
+    are arrays with one entry per instance
+    """
+    def __init__(self, env, n):
+        self.env = env.unwrapped
+        self.n = n
+        self.action_space = self.env.action_space
+        self.observation_space = self.env.observation_space
+        self.states = None
+
+    def seed(self, seed=None):
+        return self.env.seed(seed)
+
+    def reset(self):
+        self.states = self.env.batch_reset(self.n)
+        return self.states.copy()
+
+    def step(self, actions):
+        if self.states is None:
+            raise error.ResetNeeded('Cannot call DiscreteVecEnv.step() before calling reset()')
+        self.states, rewards, dones, probs = self.env.batch_step(self.states, actions, reset_done=True)
+        return self.states.copy(), rewards, dones, {"prob" : probs}
@@ -1,11 +1,9 @@
-import copy
-
 import numpy as np
 import gym
 from gym import spaces
 from gym.envs.yumi.yumi_env import YumiEnv, YumiTask
 from gym.utils import transformations as tf
-from gym.envs.robotics.utils import reset_mocap2body_xpos
+from gym.envs.robotics.utils import reset_mocap2body_xpos, SitePoseReader
 
 
 def _goal_distance(goal_a, goal_b):
@@ -30,8 +28,9 @@ class YumiConstrainedEnv(gym.GoalEnv):
 
     def __init__(self, *, reward_type='dense', rotation_ctrl=False, fingers_ctrl=False, distance_threshold=0.05,
                  randomize_initial_object_pos=True, mocap_ctrl=False, render_poses=True,
-                 object_id='fetch_box', **kwargs):
+                 object_id='fetch_box', headless=False, **kwargs):
         super(YumiConstrainedEnv, self).__init__()
+        self._gripper_poses = SitePoseReader(('gripper_l_center', 'gripper_r_center'))
 
         self.metadata = {
             'render.modes': ['human'],
@@ -41,6 +40,8 @@ class YumiConstrainedEnv(gym.GoalEnv):
             arm='both', block_gripper=False, reward_type=reward_type, task=YumiTask.PICK_AND_PLACE_OBJECT,
             object_id=object_id, randomize_initial_object_pos=randomize_initial_object_pos, **kwargs,
         )
+        # skip the target marker updates and full forward passes after each substep when not rendering on-screen
+        self.sim_env.headless = headless
         self.mocap_ctrl = mocap_ctrl
         self.reward_type = reward_type
         self.distance_threshold = distance_threshold
@@ -73,6 +74,18 @@ class YumiConstrainedEnv(gym.GoalEnv):
     def viewer(self):
         return self.sim_env.viewer
 
+    @property
+    def markers(self):
+        return self.sim_env.markers
+
+    @property
+    def headless(self):
+        return self.sim_env.headless
+
+    @headless.setter
+    def headless(self, headless):
+        self.sim_env.headless = headless
+
     @property
     def sim(self):
         return self.sim_env.sim
@@ -105,10 +118,11 @@ class YumiConstrainedEnv(gym.GoalEnv):
 
     def get_gripper_pose(self, arm):
         assert arm in ('l', 'r')
-        return np.r_[
-            self.sim.data.get_site_xpos(f'gripper_{arm}_center'),
-            tf.rotations.mat2quat(self.sim.data.get_site_xmat(f'gripper_{arm}_center')),
-        ]
+        return self._gripper_poses.get_pose(self.sim, f'gripper_{arm}_center')
+
+    def get_gripper_poses(self):
+        """Returns the (2, 7) poses of the left and right grippers."""
+        return self._gripper_poses(self.sim).copy()
 
     def get_gripper_pos(self, arm):
         assert arm in ('l', 'r')
@@ -262,15 +276,11 @@ class YumiConstrainedEnv(gym.GoalEnv):
         return obs, reward, done, info
 
     def render(self, mode='human', keep_markers=False, rgb_options=None):
-        markers = []
-        if keep_markers:
-            markers = copy.deepcopy(self.viewer._markers)
-        res = self.sim_env.render(mode=mode, rgb_options=rgb_options)
-        for m in markers:
-            self.viewer.add_marker(**m)
-        return res
+        return self.sim_env.render(mode=mode, rgb_options=rgb_options, keep_markers=keep_markers)
 
     def reset(self):
+        # the sim env is not reset, which clears the markers of the previous episode
+        self.markers.clear()
         self._reset()
         self.sim_env.goal = self._sample_goal().copy()
         self.sim.step()
@@ -341,64 +351,54 @@ class YumiConstrainedEnv(gym.GoalEnv):
         prev_error[:] = error
         return -(1.0 * error + 0.05 * d_err) * k
 
+    def _arm_target_poses(self, target_pos, yaw_quats):
+        """Returns the (2, 7) target poses of the left and right grippers at the (2, 3) positions
+        `target_pos`, with the yaw rotations `yaw_quats` and a pitch depending on the object height."""
+        d_above_table = self.get_object_pos()[2] - self.sim_env._object_z_offset
+        grp_xrot = 0.9 + d_above_table * 2.0
+        pitch_tf = np.r_[0., 0., 0., tf.rotations.euler2quat(np.r_[np.pi - grp_xrot, 0., 0.])]
+        return tf.apply_tf(pitch_tf, np.c_[target_pos, yaw_quats])
+
+    def _render_arm_poses(self, target_pos, target_poses, curr_poses):
+        if self.render_poses and self.markers.enabled:
+            for arm_i, arm in enumerate(('l', 'r')):
+                self.markers.pose(target_pos[arm_i], key=f"{arm}_p", label=f"{arm}_p")
+                self.markers.pose(target_poses[arm_i], key=f"{arm}_t", label=f"{arm}_t")
+                self.markers.pose(curr_poses[arm_i], key=f"{arm}", label=f"{arm}")
+
     def _move_arms(self, *, left_target: np.ndarray, right_target: np.ndarray, left_yaw=0.0, right_yaw=0.0,
                    pos_threshold=0.02, rot_threshold=0.1, k=2.0, max_steps=100, count_stable_steps=False,
                    targets_relative_to=None, left_grp_config=-1.0, right_grp_config=-1.0):
 
-        targets = {'l': left_target, 'r': right_target}
-        yaws = {'l': left_yaw, 'r': right_yaw}
+        # both arms are controlled together, stacked as (left, right)
+        targets = np.array([left_target, right_target])
+        yaw_quats = tf.rotations.euler2quat(np.array([[0., 0., left_yaw], [0., 0., right_yaw]]))
+        arm_qpos_idx = np.r_[self.sim_env._arm_l_joint_idx, self.sim_env._arm_r_joint_idx]
+        arm_ctrl_idx = np.r_[0:7, 8:15]
         stable_steps = 0
         prev_rel_pos = np.zeros(3)
         u = np.zeros(self.sim_env.action_space.shape)
-        prev_err_l = np.zeros(7)
-        prev_err_r = np.zeros(7)
+        prev_err = np.zeros((2, 7))
         max_pos_err = -np.inf
 
         for i in range(max_steps):
 
-            grasp_center_pos = np.zeros(3)
-            max_rot_err = -np.inf
-            max_pos_err = -np.inf
-
-            d_above_table = self.get_object_pos()[2] - self.sim_env._object_z_offset
-            grp_xrot = 0.9 + d_above_table * 2.0
+            curr_poses = self.get_gripper_poses()
+            curr_q = self.sim.data.qpos[arm_qpos_idx].reshape(2, 7)
 
-            for arm_i, arm in enumerate(('l', 'r')):
-
-                curr_pose = self.get_gripper_pose(arm)
-                curr_q = self.get_arm_config(arm)
-
-                if arm == 'l':
-                    pitch = np.pi - grp_xrot
-                    u_masked = u[:7]
-                    prev_err = prev_err_l
-                else:
-                    pitch = np.pi - grp_xrot
-                    u_masked = u[8:15]
-                    prev_err = prev_err_r
-
-                if callable(targets_relative_to):
-                    reference = targets_relative_to()
-                    target_pos = tf.apply_tf(targets[arm], reference)[:3]
-                else:
-                    target_pos = targets[arm]
+            if callable(targets_relative_to):
+                target_pos = tf.apply_tf(targets, targets_relative_to())[:, :3]
+            else:
+                target_pos = targets
+            target_poses = self._arm_target_poses(target_pos, yaw_quats)
 
-                target_pose = np.r_[target_pos, tf.rotations.euler2quat(np.r_[0., 0., yaws[arm]])]
-                target_pose = tf.apply_tf(np.r_[0., 0., 0., tf.rotations.euler2quat(np.r_[pitch, 0., 0.])], target_pose)
+            grasp_center_pos = curr_poses[:, :3].mean(axis=0)
+            max_pos_err = np.abs(curr_poses[:, :3] - target_poses[:, :3]).max()
+            max_rot_err = tf.quat_angle_diff(curr_poses[:, 3:], target_poses[:, 3:]).max()
 
-                grasp_center_pos += curr_pose[:3]
-                max_pos_err = max(max_pos_err, np.abs(curr_pose[:3] - target_pose[:3]).max())
-                max_rot_err = max(max_rot_err, tf.quat_angle_diff(curr_pose[3:], target_pose[3:]))
-
-                target_q = self.sim_env.mocap_ik(target_pose - curr_pose, arm)
-                u_masked[:] = self._controller(curr_q - target_q, prev_err, k)
-
-                if self.viewer is not None and self.render_poses:
-                    tf.render_pose(target_pos.copy(), self.viewer, label=f"{arm}_p", unique_label=True)
-                    tf.render_pose(target_pose.copy(), self.viewer, label=f"{arm}_t", unique_label=True)
-                    tf.render_pose(curr_pose.copy(), self.viewer, label=f"{arm}", unique_label=True)
-
-            grasp_center_pos /= 2.0
+            target_q = self.sim_env.mocap_ik(target_poses - curr_poses, 'both')
+            u[arm_ctrl_idx] = self._controller(curr_q - target_q, prev_err, k).ravel()
+            self._render_arm_poses(target_pos, target_poses, curr_poses)
 
             u[7] = left_grp_config
             u[15] = right_grp_config
@@ -408,9 +408,9 @@ class YumiConstrainedEnv(gym.GoalEnv):
             self.sim.step()
             self.sim_env._step_callback()
 
+            if self.render_poses:
+                self.markers.pose(grasp_center_pos, key="grasp_center", label="grasp_center")
             if self.viewer is not None:
-                if self.render_poses:
-                    tf.render_pose(grasp_center_pos, self.viewer, label="grasp_center", unique_id=5554)
                 self.render(keep_markers=True)
 
             if max_pos_err < pos_threshold and max_rot_err < rot_threshold:
@@ -436,48 +436,33 @@ class YumiConstrainedEnv(gym.GoalEnv):
                          pos_threshold=0.02, rot_threshold=0.1, k=1.0, max_steps=1,
                          left_grp_config=-1.0, right_grp_config=-1.0):
 
-        targets = {'l': left_target, 'r': right_target}
-        yaws = {'l': left_yaw, 'r': right_yaw}
+        target_pos = np.array([left_target, right_target])
+        yaw_quats = tf.rotations.euler2quat(np.array([[0., 0., left_yaw], [0., 0., right_yaw]]))
         self.sim.model.eq_active[:] = 1
 
+        # set config of grippers
+        u = np.zeros(self.sim_env.action_space.shape)
+        u[7] = left_grp_config
+        u[15] = right_grp_config
+
+        mocap_a = np.zeros((self.sim.model.nmocap, 7))
+
         for i in range(max_steps):
 
-            grasp_center_pos = np.zeros(3)
             max_rot_err = -np.inf
             max_pos_err = -np.inf
 
-            d_above_table = self.get_object_pos()[2] - self.sim_env._object_z_offset
-            grp_xrot = 0.9 + d_above_table * 2.0
+            curr_poses = self.get_gripper_poses()
+            target_poses = self._arm_target_poses(target_pos, yaw_quats)
 
-            mocap_a = np.zeros((self.sim.model.nmocap, 7))
-
-            for arm_i, arm in enumerate(('l', 'r')):
-
-                curr_pose = self.get_gripper_pose(arm)
-                pitch = np.pi - grp_xrot
-
-                target_pos = targets[arm]
-                target_pose = np.r_[target_pos, tf.rotations.euler2quat(np.r_[0., 0., yaws[arm]])]
-                target_pose = tf.apply_tf(np.r_[0., 0., 0., tf.rotations.euler2quat(np.r_[pitch, 0., 0.])], target_pose)
+            grasp_center_pos = curr_poses[:, :3].mean(axis=0)
+            if max_steps > 1:
+                max_pos_err = np.abs(curr_poses[:, :3] - target_poses[:, :3]).max()
+                max_rot_err = tf.quat_angle_diff(curr_poses[:, 3:], target_poses[:, 3:]).max()
 
-                grasp_center_pos += curr_pose[:3]
-                if max_steps > 1:
-                    max_pos_err = max(max_pos_err, np.abs(curr_pose[:3] - target_pose[:3]).max())
-                    max_rot_err = max(max_rot_err, tf.quat_angle_diff(curr_pose[3:], target_pose[3:]))
+            mocap_a[:2] = target_poses - curr_poses
+            self._render_arm_poses(target_pos, target_poses, curr_poses)
 
-                mocap_a[arm_i] = target_pose - curr_pose
-
-                if self.viewer is not None and self.render_poses:
-                    tf.render_pose(target_pos.copy(), self.viewer, label=f"{arm}_p", unique_label=True)
-                    tf.render_pose(target_pose.copy(), self.viewer, label=f"{arm}_t", unique_label=True)
-                    tf.render_pose(curr_pose.copy(), self.viewer, label=f"{arm}", unique_label=True)
-
-            grasp_center_pos /= 2.0
-
-            # set config of grippers
-            u = np.zeros(self.sim_env.action_space.shape)
-            u[7] = left_grp_config
-            u[15] = right_grp_config
             self.sim_env._set_action(u)
 
             # set pose of grippers
@@ -487,10 +472,124 @@ class YumiConstrainedEnv(gym.GoalEnv):
             self.sim.step()
             self.sim_env._step_callback()
 
+            if self.render_poses:
+                self.markers.pose(grasp_center_pos, key="grasp_center", label="grasp_center")
             if self.viewer is not None:
-                if self.render_poses:
-                    tf.render_pose(grasp_center_pos, self.viewer, label="grasp_center", unique_id=5554)
                 self.render(keep_markers=True)
 
             if max_pos_err < pos_threshold and max_rot_err < rot_threshold:
                 break
+
+
+def _move_arms_per_arm(self, *, left_target: np.ndarray, right_target: np.ndarray, left_yaw=0.0, right_yaw=0.0,
+                       pos_threshold=0.02, rot_threshold=0.1, k=2.0, max_steps=100, count_stable_steps=False,
+                       targets_relative_to=None, left_grp_config=-1.0, right_grp_config=-1.0):
+    """YumiConstrainedEnv._move_arms as it was before the arms were stacked, with an IK solve per arm.
+    Only used by _benchmark, as a baseline."""
+
+    targets = {'l': left_target, 'r': right_target}
+    yaws = {'l': left_yaw, 'r': right_yaw}
+    stable_steps = 0
+    prev_rel_pos = np.zeros(3)
+    u = np.zeros(self.sim_env.action_space.shape)
+    prev_errs = {'l': np.zeros(7), 'r': np.zeros(7)}
+    max_pos_err = -np.inf
+
+    for i in range(max_steps):
+
+        grasp_center_pos = np.zeros(3)
+        max_rot_err = -np.inf
+        max_pos_err = -np.inf
+
+        d_above_table = self.get_object_pos()[2] - self.sim_env._object_z_offset
+        pitch = np.pi - (0.9 + d_above_table * 2.0)
+
+        for arm, u_masked in (('l', u[:7]), ('r', u[8:15])):
+
+            curr_pose = self.get_gripper_pose(arm)
+            curr_q = self.get_arm_config(arm)
+
+            if callable(targets_relative_to):
+                target_pos = tf.apply_tf(targets[arm], targets_relative_to())[:3]
+            else:
+                target_pos = targets[arm]
+
+            target_pose = np.r_[target_pos, tf.rotations.euler2quat(np.r_[0., 0., yaws[arm]])]
+            target_pose = tf.apply_tf(np.r_[0., 0., 0., tf.rotations.euler2quat(np.r_[pitch, 0., 0.])], target_pose)
+
+            grasp_center_pos += curr_pose[:3]
+            max_pos_err = max(max_pos_err, np.abs(curr_pose[:3] - target_pose[:3]).max())
+            max_rot_err = max(max_rot_err, tf.quat_angle_diff(curr_pose[3:], target_pose[3:]))
+
+            target_q = self.sim_env.mocap_ik(target_pose - curr_pose, arm)
+            u_masked[:] = self._controller(curr_q - target_q, prev_errs[arm], k)
+
+            if self.render_poses:
+                self.markers.pose(target_pos, key=f"{arm}_p", label=f"{arm}_p")
+                self.markers.pose(target_pose, key=f"{arm}_t", label=f"{arm}_t")
+                self.markers.pose(curr_pose, key=f"{arm}", label=f"{arm}")
+
+        grasp_center_pos /= 2.0
+
+        u[7] = left_grp_config
+        u[15] = right_grp_config
+        u = np.clip(u, self.sim_env.action_space.low, self.sim_env.action_space.high)
+
+        self.sim_env._set_action(u)
+        self.sim.step()
+        self.sim_env._step_callback()
+
+        if self.render_poses:
+            self.markers.pose(grasp_center_pos, key="grasp_center", label="grasp_center")
+        if self.viewer is not None:
+            self.render(keep_markers=True)
+
+        if max_pos_err < pos_threshold and max_rot_err < rot_threshold:
+            break
+
+        if count_stable_steps:
+            obj_pos = self.get_object_pos()
+            rel_pos = obj_pos - grasp_center_pos
+            still = prev_rel_pos is not None and np.all(np.abs(rel_pos - prev_rel_pos) < 0.002)
+            obj_above_table = len(self.sim_env.get_object_contact_points(other_body='table')) == 0
+            if still and obj_above_table:
+                stable_steps += 1
+            elif i > 10:
+                break
+            prev_rel_pos = rel_pos
+
+    if count_stable_steps:
+        return stable_steps
+
+    return max_pos_err
+
+
+def _benchmark(env_id='YumiConstrained-v1', n_episodes=5):
+    """Compares the step throughput of _move_arms, which controls both arms stacked with a single IK
+    solve, against the per-arm loop it replaced. Only YumiConstrained-v1 moves the arms with _move_arms,
+    YumiConstrained-v2 uses _move_arms_mocap."""
+    import time
+    import types
+
+    for controller in ('per-arm', 'stacked'):
+        env = gym.make(env_id, headless=True)
+        assert not env.unwrapped.mocap_ctrl
+        if controller == 'per-arm':
+            env.unwrapped._move_arms = types.MethodType(_move_arms_per_arm, env.unwrapped)
+        env.seed(0)
+        env.action_space.seed(0)
+        n_steps = 0
+        tic = time.time()
+        for _ in range(n_episodes):
+            env.reset()
+            done = False
+            while not done:
+                _, _, done, _ = env.step(env.action_space.sample())
+                n_steps += 1
+        elapsed_s = time.time() - tic
+        print(f'{env_id} {controller}: {n_steps / elapsed_s:.1f} steps/s ({1e3 * elapsed_s / n_steps:.2f} ms/step)')
+        env.close()
+
+
+if __name__ == '__main__':
+    _benchmark()
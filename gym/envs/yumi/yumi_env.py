@@ -106,6 +106,7 @@ class YumiEnv(RobotEnv):
         self._arm_r_joint_idx = None
         self._arm_l_joint_idx = None
         self._object_z_offset = 0.0
+        self._forward_pending = False
 
         self._gripper_joint_max = 0.02
         n_actions = 7
@@ -215,24 +216,33 @@ class YumiEnv(RobotEnv):
         self.sim.model.eq_active[:] = 0
 
     def mocap_ik(self, pose_delta, arm):
-        prev_s = copy.deepcopy(self.sim.get_state())
+        """Returns the arm joint positions reached by moving the gripper by `pose_delta` with
+        mocap control. With arm='both', `pose_delta` holds the (2, 7) deltas of the left and right
+        grippers, both arms are solved in the same simulation step and the result is (2, n_joints)."""
+        prev_s = self.sim.get_state()  # get_state returns copies
         mocap_a = np.zeros((self.sim.model.nmocap, 7))
         if arm == 'l' or (arm == 'r' and not self.has_two_arms):
             mocap_a[0] = pose_delta
         elif arm == 'r':
             mocap_a[1] = pose_delta
+        elif arm == 'both' and self.has_two_arms:
+            mocap_a[:2] = pose_delta
         else:
             raise NotImplementedError
         self.mocap_control(mocap_a)
-        target_qpos = self.sim.data.qpos.copy()
+        if arm == 'both':
+            arm_target_qpos = np.stack([self.sim.data.qpos[self._arm_l_joint_idx],
+                                        self.sim.data.qpos[self._arm_r_joint_idx]])
+        else:
+            arm_target_qpos = self.sim.data.qpos[getattr(self, f'_arm_{arm}_joint_idx')].copy()
         self.sim.set_state(prev_s)
-        arm_target_qpos = target_qpos[getattr(self, f'_arm_{arm}_joint_idx')]
         return arm_target_qpos
 
     def is_pressing_button(self):
         if not self.has_button:
             return False
 
+        self._complete_forward()
         sim = self.sim
         for i in range(sim.data.ncon):
 
@@ -279,6 +289,7 @@ class YumiEnv(RobotEnv):
         if not self.has_object:
             raise NotImplementedError("Cannot get object contact points in an environment without objects!")
 
+        self._complete_forward()
         sim = self.sim
         object_name = 'object0'
         object_pos = self.sim.data.get_body_xpos(object_name)
@@ -618,20 +629,43 @@ class YumiEnv(RobotEnv):
         self.viewer.cam.azimuth = 180
 
     def _step_callback(self):
+        if self._defer_visuals:
+            # the observations only read positions and velocities; the rest of the forward pass
+            # (dynamics and contacts) runs when the contacts are read or a frame is rendered
+            functions = mujoco_py.functions
+            functions.mj_kinematics(self.sim.model, self.sim.data)
+            functions.mj_comPos(self.sim.model, self.sim.data)
+            functions.mj_comVel(self.sim.model, self.sim.data)
+            self._forward_pending = True
+        else:
+            self._update_target_marker()
+            self.sim.forward()
+
+    def _render_callback(self):
+        if self._defer_visuals:
+            self._update_target_marker()
+            # place the moved target for the frame
+            self._forward_pending = True
+        self._complete_forward()
+
+    def _complete_forward(self):
+        if self._forward_pending:
+            self._forward_pending = False
+            self.sim.forward()
+
+    def _update_target_marker(self):
         # Visualize target.
+        data, model = self.sim.data, self.sim.model
         if self.task == YumiTask.PICK_AND_PLACE_BAR or self.task == YumiTask.PICK_AND_PLACE_OBJECT:
-            bodies_offset = (self.sim.data.body_xpos - self.sim.model.body_pos).copy()
-            body_id = self.sim.model.body_name2id('target0')
-            self.sim.model.body_pos[body_id, :] = self.goal[:3] - bodies_offset[body_id]
+            body_id = model.body_name2id('target0')
+            model.body_pos[body_id, :] = self.goal[:3] - (data.body_xpos[body_id] - model.body_pos[body_id])
         elif self.task == YumiTask.REACH:
-            sites_offset = (self.sim.data.site_xpos - self.sim.model.site_pos).copy()
             if self.has_left_arm:
-                site_id = self.sim.model.site_name2id('target_l')
-                self.sim.model.site_pos[site_id] = self.goal[:3] - sites_offset[site_id]
+                site_id = model.site_name2id('target_l')
+                model.site_pos[site_id] = self.goal[:3] - (data.site_xpos[site_id] - model.site_pos[site_id])
             if self.has_right_arm:
-                site_id = self.sim.model.site_name2id('target_r')
-                self.sim.model.site_pos[site_id] = self.goal[3:] - sites_offset[site_id]
-        self.sim.forward()
+                site_id = model.site_name2id('target_r')
+                model.site_pos[site_id] = self.goal[3:] - (data.site_xpos[site_id] - model.site_pos[site_id])
 
     # Utilities
     # ----------------------------
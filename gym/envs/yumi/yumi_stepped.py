@@ -1,17 +1,17 @@
-import copy
-
 import numpy as np
 import gym
 from gym import spaces
 from gym.envs.yumi import YumiLiftEnv
-from gym.envs.robotics.utils import reset_mocap2body_xpos
+from gym.envs.robotics.utils import reset_mocap2body_xpos, SitePoseReader
 from gym.utils import transformations as tf
+from gym.utils.phase_profiler import clock
 
 
 class YumiSteppedEnv(gym.Env):
 
-    def __init__(self, *, render_substeps=False):
+    def __init__(self, *, render_substeps=False, profiler=None, scheduler=None):
         super(YumiSteppedEnv, self).__init__()
+        self._gripper_poses = SitePoseReader(('gripper_l_center', 'gripper_r_center'))
 
         self.metadata = {
             'render.modes': ['human'],
@@ -19,6 +19,11 @@ class YumiSteppedEnv(gym.Env):
 
         self._qp_solver = None
         self.render_substeps = render_substeps
+        # optional gym.utils.phase_profiler.PhaseProfiler recording the phases of each step
+        self.profiler = profiler
+        # optional gym.utils.substep_scheduler.SubstepScheduler stopping phases early
+        self.scheduler = scheduler
+        self._saved_substeps = 0
         self.sim_env = YumiLiftEnv()
         obs = self._get_obs()
 
@@ -33,6 +38,18 @@ class YumiSteppedEnv(gym.Env):
     def viewer(self):
         return self.sim_env.viewer
 
+    @property
+    def markers(self):
+        return self.sim_env.markers
+
+    @property
+    def headless(self):
+        return self.sim_env.headless
+
+    @headless.setter
+    def headless(self, headless):
+        self.sim_env.headless = headless
+
     @property
     def sim(self):
         return self.sim_env.sim
@@ -52,10 +69,11 @@ class YumiSteppedEnv(gym.Env):
 
     def get_gripper_pose(self, arm):
         assert arm in ('l', 'r')
-        return np.r_[
-            self.sim.data.get_site_xpos(f'gripper_{arm}_center'),
-            tf.rotations.mat2quat(self.sim.data.get_site_xmat(f'gripper_{arm}_center')),
-        ]
+        return self._gripper_poses.get_pose(self.sim, f'gripper_{arm}_center')
+
+    def get_gripper_poses(self):
+        """Returns the (2, 7) poses of the left and right grippers."""
+        return self._gripper_poses(self.sim).copy()
 
     def get_gripper_pos(self, arm):
         assert arm in ('l', 'r')
@@ -97,7 +115,12 @@ class YumiSteppedEnv(gym.Env):
     def step(self, action: np.ndarray):
 
         def failure():
-            return self._get_obs(), 0.0, True, dict()
+            return self._get_obs(), 0.0, True, self._step_info(dict())
+
+        if self.profiler is not None:
+            self.profiler.start_step()
+        if self.scheduler is not None:
+            self._saved_substeps = self.scheduler.saved_substeps
 
         action = np.clip(action, self.action_space.low, self.action_space.high)
         action = action.reshape(-1, 4)
@@ -105,31 +128,25 @@ class YumiSteppedEnv(gym.Env):
         grippers_conf = action[:, 3]
 
         obj_pose = self.get_object_pose()
-        grippers_pos_targets = np.array([
-            tf.apply_tf(np.r_[transf, 1., 0., 0., 0.], obj_pose)[:3] for transf in grippers_pos_wrt_obj
-        ])
+        grippers_pos_targets = tf.apply_tf(grippers_pos_wrt_obj, obj_pose)[:, :3]
 
         vec = grippers_pos_targets[0, :2] - grippers_pos_targets[1, :2]
         grasp_radius = np.linalg.norm(vec, ord=2) / 2.0
         right_yaw = np.arctan2(vec[1], vec[0]) + np.pi/2
         left_yaw = np.arctan2(-vec[1], -vec[0]) + np.pi/2
 
-        left_target_pose = np.r_[
-            grippers_pos_targets[0],
-            tf.rotations.euler2quat(np.r_[0, 0, left_yaw])
-        ]
-
-        right_target_pose = np.r_[
-            grippers_pos_targets[1],
-            tf.rotations.euler2quat(np.r_[0, 0, right_yaw])
-        ]
+        # left and right target poses, and the pregrasp1, pregrasp2 and grasp offsets wrt them
+        target_poses = np.c_[grippers_pos_targets, tf.rotations.euler2quat(np.c_[np.zeros((2, 2)), [left_yaw, right_yaw]])]
+        offsets = np.array([[0., 0.05, 0.1], [0., 0.05, 0.01], [0., 0., 0.01]])
+        phase_targets = tf.apply_tf(offsets[:, None], target_poses)[..., :3]
 
         # - move arms to pregrasp1 pose
         # targets are farther and higher wrt object center
         max_pos_err = self._move_arms(
-            left_target=tf.apply_tf(np.r_[0., 0.05, 0.1], left_target_pose)[:3], left_yaw=left_yaw,
-            right_target=tf.apply_tf(np.r_[0., 0.05, 0.1], right_target_pose)[:3], right_yaw=right_yaw,
+            left_target=phase_targets[0, 0], left_yaw=left_yaw,
+            right_target=phase_targets[0, 1], right_yaw=right_yaw,
             left_grp_config=grippers_conf[0], right_grp_config=grippers_conf[1], max_steps=120,
+            phase='pregrasp1',
         )
 
         if max_pos_err > 0.05 or self.is_object_unreachable():
@@ -138,9 +155,10 @@ class YumiSteppedEnv(gym.Env):
         # - move arms to pregrasp2 pose
         # targets are farther and but aligned to object center
         max_pos_err = self._move_arms(
-            left_target=tf.apply_tf(np.r_[0., 0.05, 0.01], left_target_pose)[:3], left_yaw=left_yaw,
-            right_target=tf.apply_tf(np.r_[0., 0.05, 0.01], right_target_pose)[:3], right_yaw=right_yaw,
+            left_target=phase_targets[1, 0], left_yaw=left_yaw,
+            right_target=phase_targets[1, 1], right_yaw=right_yaw,
             left_grp_config=grippers_conf[0], right_grp_config=grippers_conf[1], max_steps=50,
+            phase='pregrasp2',
         )
 
         if max_pos_err > 0.05 or self.is_object_unreachable():
@@ -149,9 +167,10 @@ class YumiSteppedEnv(gym.Env):
         # - move arms to grasp pose
         # targets are as specified by the agent
         self._move_arms(
-            left_target=tf.apply_tf(np.r_[0., 0., 0.01], left_target_pose)[:3], left_yaw=left_yaw,
-            right_target=tf.apply_tf(np.r_[0., 0., 0.01], right_target_pose)[:3], right_yaw=right_yaw,
+            left_target=phase_targets[2, 0], left_yaw=left_yaw,
+            right_target=phase_targets[2, 1], right_yaw=right_yaw,
             left_grp_config=grippers_conf[0], right_grp_config=grippers_conf[1], max_steps=40,
+            phase='grasp',
         )
 
         if self.is_object_unreachable():
@@ -164,21 +183,24 @@ class YumiSteppedEnv(gym.Env):
             right_target=np.r_[0., -grasp_radius * 0.9, 0.05], right_yaw=right_yaw,
             count_stable_steps=True, targets_relative_to=self.get_object_pos,
             left_grp_config=grippers_conf[0], right_grp_config=grippers_conf[1], max_steps=200,
+            phase='lift',
         )
 
         obs = self._get_obs()
         reward = float(stable_steps)
         done = self.is_object_unreachable()
-        info = dict()
+        info = self._step_info(dict())
         return obs, reward, done, info
 
-    def render(self, mode='human', keep_markers=False):
-        markers = []
-        if keep_markers:
-            markers = copy.deepcopy(self.viewer._markers)
-        self.sim_env.render()
-        for m in markers:
-            self.viewer.add_marker(**m)
+    def _step_info(self, info):
+        if self.scheduler is not None:
+            info['saved_substeps'] = self.scheduler.saved_substeps - self._saved_substeps
+        if self.profiler is not None:
+            self.profiler.end_step(info)
+        return info
+
+    def render(self, mode='human', keep_markers=False, rgb_options=None):
+        return self.sim_env.render(mode=mode, rgb_options=rgb_options, keep_markers=keep_markers)
 
     def reset(self):
         self.sim.model.eq_active[:] = 0
@@ -207,7 +229,17 @@ class YumiSteppedEnv(gym.Env):
 
     def _move_arms(self, *, left_target: np.ndarray, right_target: np.ndarray, left_yaw=0.0, right_yaw=0.0,
                    pos_threshold=0.02, rot_threshold=0.1, k=2.0, max_steps=100, count_stable_steps=False,
-                   targets_relative_to=None, left_grp_config=-1.0, right_grp_config=-1.0):
+                   targets_relative_to=None, left_grp_config=-1.0, right_grp_config=-1.0, phase='move_arms'):
+
+        profiler = self.profiler
+        if profiler is not None:
+            tic = clock()
+            ik_s = 0.0
+        scheduler = self.scheduler
+        if scheduler is not None:
+            scheduler.start_phase()
+        exit_reason = 'max_steps'
+        n_substeps = 0
 
         targets = {'l': left_target, 'r': right_target}
         yaws = {'l': left_yaw, 'r': right_yaw}
@@ -251,13 +283,18 @@ class YumiSteppedEnv(gym.Env):
                 max_pos_err = max(max_pos_err, np.abs(curr_pose[:3] - target_pose[:3]).max())
                 max_rot_err = max(max_rot_err, tf.quat_angle_diff(curr_pose[3:], target_pose[3:]))
 
-                target_q = self.sim_env.mocap_ik(target_pose - curr_pose, arm)
+                if profiler is not None:
+                    ik_tic = clock()
+                    target_q = self.sim_env.mocap_ik(target_pose - curr_pose, arm)
+                    ik_s += clock() - ik_tic
+                else:
+                    target_q = self.sim_env.mocap_ik(target_pose - curr_pose, arm)
                 u_masked[:] = self._controller(curr_q - target_q, prev_err, k)
 
                 if self.render_substeps:
-                    tf.render_pose(target_pos.copy(), self.viewer, label=f"{arm}_p", unique_label=True)
-                    tf.render_pose(target_pose.copy(), self.viewer, label=f"{arm}_t", unique_label=True)
-                    tf.render_pose(curr_pose.copy(), self.viewer, label=f"{arm}", unique_label=True)
+                    self.markers.pose(target_pos, key=f"{arm}_p", label=f"{arm}_p")
+                    self.markers.pose(target_pose, key=f"{arm}_t", label=f"{arm}_t")
+                    self.markers.pose(curr_pose, key=f"{arm}", label=f"{arm}")
 
             grasp_center_pos /= 2.0
 
@@ -265,14 +302,24 @@ class YumiSteppedEnv(gym.Env):
             u[15] = right_grp_config
             u = np.clip(u, self.sim_env.action_space.low, self.sim_env.action_space.high)
             self.sim_env.step(u)
+            n_substeps += 1
 
             if self.render_substeps:
-                tf.render_pose(grasp_center_pos, self.viewer, label="grasp_center", unique_id=5554)
+                self.markers.pose(grasp_center_pos, key="grasp_center", label="grasp_center")
                 self.render(keep_markers=True)
 
             if max_pos_err < pos_threshold and max_rot_err < rot_threshold:
+                exit_reason = 'converged'
                 break
 
+            if scheduler is not None:
+                if self.is_object_unreachable():
+                    exit_reason = 'failure'
+                    break
+                if not count_stable_steps and scheduler.is_still(self.sim.data.qvel):
+                    exit_reason = 'still'
+                    break
+
             if count_stable_steps:
                 obj_pos = self.get_object_pos()
                 rel_pos = obj_pos - grasp_center_pos
@@ -281,9 +328,16 @@ class YumiSteppedEnv(gym.Env):
                 if still and obj_above_table:
                     stable_steps += 1
                 elif i > 10:
+                    exit_reason = 'unstable'
                     break
                 prev_rel_pos = rel_pos
 
+        if scheduler is not None:
+            scheduler.end_phase(n_substeps, max_steps, exit_reason)
+        if profiler is not None:
+            profiler.record(phase, substeps=n_substeps, wall_s=clock() - tic, ik_s=ik_s, exit_reason=exit_reason,
+                            max_pos_err=max_pos_err)
+
         if count_stable_steps:
             return stable_steps
 
@@ -0,0 +1,32 @@
+import pytest
+
+from gym import bench
+
+
+def test_select_specs():
+    assert bench.select_specs(['CartPole-v*']) == ['CartPole-v0', 'CartPole-v1']
+    classic_control = bench.select_specs(['gym.envs.classic_control:*'])
+    assert 'Pendulum-v0' in classic_control
+    assert 'FrozenLake-v0' not in classic_control
+
+
+def test_bench_and_compare():
+    results = bench.run_suite(['CartPole-v0', 'NotAnEnv-v0'], n_steps=100, n_resets=2)
+    cartpole = results['envs']['CartPole-v0']
+    assert cartpole['random_steps_per_s'] > 0
+    assert cartpole['peak_rss_mb'] > 0
+    assert 'error' in results['envs']['NotAnEnv-v0']
+
+    assert bench.compare(results, results) == []
+    faster = dict(envs={'CartPole-v0': dict(cartpole, random_steps_per_s=2 * cartpole['random_steps_per_s'])})
+    regressions = bench.compare(results, faster)
+    assert [(env_id, metric) for env_id, metric, _, _ in regressions] == [('CartPole-v0', 'random_steps_per_s')]
+
+
+def test_compare_errors():
+    ok = dict(make_s=0.1, reset_ms=1.0, random_steps_per_s=1000.0)
+    baseline = dict(envs={'A-v0': ok, 'B-v0': ok, 'C-v0': dict(error='ImportError'), 'D-v0': ok})
+    results = dict(envs={'A-v0': ok, 'B-v0': dict(error='ImportError: no module'), 'C-v0': dict(error='ImportError')})
+    with pytest.warns(UserWarning, match='D-v0'):
+        regressions = bench.compare(results, baseline)
+    assert regressions == [('B-v0', 'error', None, 'ImportError: no module')]
@@ -0,0 +1,183 @@
+"""Parallel generation of expert demonstrations with the scripted agents in gym.agents.
+
+Episodes are rolled out by a pool of worker processes, each owning one env and one agent,
+and every finished episode is written to `out_dir` as soon as it is done. Episodes are
+identified by the seed of their env, so running the generator again on the same directory
+only generates the missing seeds.
+"""
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from gym import error, logger
+
+
+# Scripted agents of the envs supported out of the box
+DEFAULT_AGENTS = {
+    'YumiConstrained-v2': 'gym.agents.yumi:YumiConstrainedAgent',
+    'FetchPickAndPlace-v1': 'gym.agents.fetch:FetchPickAndPlaceAgent',
+    'HandPickAndPlace-v0': 'gym.agents.shadow_hand:HandPickAndPlaceAgent',
+}
+
+
+class DemoStats(object):
+
+    def __init__(self, *, n_episodes=0, n_skipped=0, n_successes=0, n_steps=0, elapsed_s=0.0):
+        self.n_episodes = n_episodes
+        self.n_skipped = n_skipped
+        self.n_successes = n_successes
+        self.n_steps = n_steps
+        self.elapsed_s = elapsed_s
+
+    @property
+    def episodes_per_sec(self):
+        return self.n_episodes / self.elapsed_s if self.elapsed_s > 0 else 0.0
+
+    @property
+    def success_rate(self):
+        return self.n_successes / self.n_episodes if self.n_episodes > 0 else 0.0
+
+    def __repr__(self):
+        return (f'DemoStats(episodes={self.n_episodes}, skipped={self.n_skipped}, '
+                f'success_rate={self.success_rate:.3f}, episodes/s={self.episodes_per_sec:.2f})')
+
+
+def episode_path(out_dir, seed):
+    return os.path.join(out_dir, f'episode_{seed:08d}.npz')
+
+
+def load_episode(path) -> dict:
+    """Returns the arrays of an episode written by generate_demos. Observation keys of
+    dict observations are prefixed with 'obs/'."""
+    with np.load(path) as f:
+        return {k: f[k] for k in f.files}
+
+
+def _stack(values, prefix):
+    if isinstance(values[0], dict):
+        return {f'{prefix}/{k}': np.array([v[k] for v in values]) for k in values[0].keys()}
+    return {prefix: np.array(values)}
+
+
+def _resolve_agent_cls(agent_cls, env_id):
+    if agent_cls is None:
+        if env_id not in DEFAULT_AGENTS:
+            raise error.Error('No default scripted agent for {}, pass agent_cls'.format(env_id))
+        agent_cls = DEFAULT_AGENTS[env_id]
+    if isinstance(agent_cls, str):
+        from gym.envs.registration import load
+        agent_cls = load(agent_cls)
+    return agent_cls
+
+
+# Worker process
+# ----------------------------
+
+_worker = None
+
+
+def _init_worker(env_id, env_kwargs, agent_cls, agent_kwargs, out_dir, max_episode_steps):
+    import gym
+    global _worker
+    env = gym.make(env_id, **env_kwargs)
+    agent = _resolve_agent_cls(agent_cls, env_id)(env, **agent_kwargs)
+    _worker = (env, agent, out_dir, max_episode_steps)
+
+
+def _run_episode(seed):
+    env, agent, out_dir, max_episode_steps = _worker
+
+    env.seed(seed)
+    agent.reset()
+    obs = env.reset()
+    observations, actions, rewards = [obs], [], []
+    info = dict()
+    done = False
+    while not done and (max_episode_steps is None or len(actions) < max_episode_steps):
+        u = np.asarray(agent.predict(obs))
+        obs, rew, done, info = env.step(u)
+        observations.append(obs)
+        actions.append(u)
+        rewards.append(rew)
+    success = bool(info.get('is_success', False))
+
+    arrays = _stack(observations, 'obs')
+    arrays.update(actions=np.array(actions), rewards=np.array(rewards), seed=np.array(seed),
+                  success=np.array(success))
+
+    # write to a temporary file first, so that partially written episodes are never loaded
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, prefix='.tmp-', suffix='.npz')
+    with os.fdopen(fd, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, episode_path(out_dir, seed))
+    return seed, len(actions), success
+
+
+def generate_demos(env_id, out_dir, seeds, *, agent_cls=None, env_kwargs=None, agent_kwargs=None, n_workers=None,
+                   max_episode_steps=None, log_every=100) -> DemoStats:
+    """Generates one episode for each seed with a scripted agent, using a pool of processes.
+
+    Args:
+        env_id (str): id of the env, passed to gym.make with `env_kwargs`.
+        out_dir (str): directory of the episodes, one .npz file per seed (see `load_episode`).
+        seeds (Iterable[int]): env seeds; seeds whose episode already exists in `out_dir` are skipped.
+        agent_cls (type or str): agent class, or its 'module:Class' entry point. Defaults to the
+            scripted agent of `env_id` in DEFAULT_AGENTS.
+        n_workers (int): number of processes, defaults to the number of CPUs.
+        max_episode_steps (int): optional limit on the episode length, in addition to the env one.
+    """
+    env_kwargs = env_kwargs or dict()
+    agent_kwargs = agent_kwargs or dict()
+    _resolve_agent_cls(agent_cls, env_id)  # fail early
+    os.makedirs(out_dir, exist_ok=True)
+
+    stats = DemoStats()
+    todo = []
+    for seed in dict.fromkeys(int(s) for s in seeds):
+        if os.path.exists(episode_path(out_dir, seed)):
+            stats.n_skipped += 1
+        else:
+            todo.append(seed)
+
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    n_workers = max(1, min(n_workers, len(todo)))
+
+    tic = time.time()
+    if todo:
+        init_args = (env_id, env_kwargs, agent_cls, agent_kwargs, out_dir, max_episode_steps)
+        with multiprocessing.Pool(n_workers, initializer=_init_worker, initargs=init_args) as pool:
+            for _, n_steps, success in pool.imap_unordered(_run_episode, todo):
+                stats.n_episodes += 1
+                stats.n_successes += int(success)
+                stats.n_steps += n_steps
+                stats.elapsed_s = time.time() - tic
+                if log_every and stats.n_episodes % log_every == 0:
+                    logger.info('Generated %d/%d episodes: %.2f episodes/s, success rate %.3f',
+                                stats.n_episodes, len(todo), stats.episodes_per_sec, stats.success_rate)
+    stats.elapsed_s = time.time() - tic
+    logger.info('%s', stats)
+    return stats
+
+
+def _main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate demonstrations with the scripted agents')
+    parser.add_argument('env_id', choices=sorted(DEFAULT_AGENTS.keys()))
+    parser.add_argument('out_dir')
+    parser.add_argument('--episodes', type=int, default=100)
+    parser.add_argument('--first-seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    logger.set_level(logger.INFO)
+    seeds = range(args.first_seed, args.first_seed + args.episodes)
+    print(generate_demos(args.env_id, args.out_dir, seeds, n_workers=args.workers))
+
+
+if __name__ == '__main__':
+    _main()
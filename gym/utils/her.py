@@ -0,0 +1,267 @@
+import numpy as np
+
+from gym import error
+from gym.utils import seeding
+
+
+REPLAY_STRATEGIES = ('future', 'final', 'episode', 'none')
+
+
+class HERReplayBuffer(object):
+    """Episode replay buffer with hindsight goal relabeling for GoalEnvs.
+
+    Episodes are stored in preallocated ring arrays of shape (n_episodes, T(+1), dim).
+    Sampling picks transitions uniformly, relabels a fraction of their desired goals with
+    achieved goals taken from the same episode (according to `replay_strategy`) and
+    recomputes the rewards with a single batched call to `env.compute_reward`.
+
+    Args:
+        env (GoalEnv): environment used for shapes and for `compute_reward`.
+        max_episode_steps (int): maximum number of transitions per episode (T).
+        size_in_transitions (int): capacity of the buffer, rounded down to whole episodes.
+        replay_strategy (str): one of 'future', 'final', 'episode' or 'none'.
+        replay_k (int): ratio between relabeled and original goals, i.e. a fraction
+            1 - 1/(1 + replay_k) of each sampled batch is relabeled.
+        info_keys (Sequence[str]): keys of the step `info` dicts that are stored and passed
+            (batched) to `compute_reward`.
+    """
+
+    def __init__(self, env, *, max_episode_steps, size_in_transitions=1_000_000, replay_strategy='future',
+                 replay_k=4, info_keys=(), dtype=np.float32):
+
+        if replay_strategy not in REPLAY_STRATEGIES:
+            raise error.Error('Invalid replay strategy {}: must be one of {}'.format(replay_strategy, REPLAY_STRATEGIES))
+
+        self.env = env
+        self.T = int(max_episode_steps)
+        self.size = max(1, int(size_in_transitions) // self.T)
+        self.replay_strategy = replay_strategy
+        self.replay_k = replay_k
+        self.info_keys = tuple(info_keys)
+
+        if replay_strategy == 'none':
+            self.future_p = 0.0
+        else:
+            self.future_p = 1.0 - (1.0 / (1.0 + replay_k))
+
+        spaces = env.observation_space.spaces
+        obs_shape = spaces['observation'].shape
+        goal_shape = spaces['desired_goal'].shape
+        action_shape = env.action_space.shape
+
+        self._buffers = dict(
+            observation=np.zeros((self.size, self.T + 1) + obs_shape, dtype=dtype),
+            achieved_goal=np.zeros((self.size, self.T + 1) + goal_shape, dtype=dtype),
+            desired_goal=np.zeros((self.size, self.T) + goal_shape, dtype=dtype),
+            action=np.zeros((self.size, self.T) + action_shape, dtype=dtype),
+        )
+        self._info_buffers = dict()
+        self._ep_lengths = np.zeros(self.size, dtype=np.int64)
+
+        self._next_idx = 0
+        self.n_episodes_stored = 0
+        self.n_transitions_stored = 0
+
+        self.seed()
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+
+    def __len__(self):
+        return int(self._ep_lengths[:self.n_episodes_stored].sum())
+
+    @property
+    def full(self):
+        return self.n_episodes_stored == self.size
+
+    def clear(self):
+        self._next_idx = 0
+        self.n_episodes_stored = 0
+        self.n_transitions_stored = 0
+        self._ep_lengths[:] = 0
+
+    def store_episode(self, episode: dict):
+        """Stores a single episode.
+
+        Args:
+            episode (dict): with keys 'observation' and 'achieved_goal' of length L+1,
+                'desired_goal' and 'action' of length L, and optionally 'info', a dict
+                of arrays of length L with the keys listed in `info_keys`.
+        """
+        ep_len = len(episode['action'])
+        if ep_len < 1 or ep_len > self.T:
+            raise error.Error('Episode length must be in [1, {}], got {}'.format(self.T, ep_len))
+        if len(episode['observation']) != ep_len + 1 or len(episode['achieved_goal']) != ep_len + 1:
+            raise error.Error('Episode must contain one more observation and achieved goal than actions')
+
+        idx = self._next_idx
+        for key, buf in self._buffers.items():
+            values = np.asarray(episode[key])
+            buf[idx, :len(values)] = values
+            # pad with the last entry so that stale data is never relabeled
+            buf[idx, len(values):] = values[-1]
+
+        info = episode.get('info') or dict()
+        for key in self.info_keys:
+            values = np.asarray(info[key])
+            if key not in self._info_buffers:
+                self._info_buffers[key] = np.zeros((self.size, self.T) + values.shape[1:], dtype=values.dtype)
+            self._info_buffers[key][idx, :ep_len] = values
+
+        self._ep_lengths[idx] = ep_len
+        self._next_idx = (idx + 1) % self.size
+        self.n_episodes_stored = min(self.n_episodes_stored + 1, self.size)
+        self.n_transitions_stored += ep_len
+
+    def sample(self, batch_size):
+        """Samples a batch of relabeled transitions.
+
+        Returns:
+            dict: 'observation', 'achieved_goal', 'next_observation', 'next_achieved_goal',
+            'desired_goal', 'action', 'reward' and 'is_relabeled', each with a leading
+            dimension of size `batch_size`.
+        """
+        if self.n_episodes_stored == 0:
+            raise error.Error('Cannot sample from an empty buffer')
+
+        ep_idx, t = self._sample_indices(batch_size)
+        ep_lengths = self._ep_lengths[ep_idx]
+
+        buf = self._buffers
+        batch = dict(
+            observation=buf['observation'][ep_idx, t],
+            achieved_goal=buf['achieved_goal'][ep_idx, t],
+            next_observation=buf['observation'][ep_idx, t + 1],
+            next_achieved_goal=buf['achieved_goal'][ep_idx, t + 1],
+            desired_goal=buf['desired_goal'][ep_idx, t],
+            action=buf['action'][ep_idx, t],
+        )
+
+        relabel = self.np_random.uniform(size=batch_size) < self.future_p
+        goal_t = self._relabel_indices(t, ep_lengths)
+        batch['desired_goal'][relabel] = buf['achieved_goal'][ep_idx[relabel], goal_t[relabel]]
+        batch['is_relabeled'] = relabel
+
+        info = {key: buf_i[ep_idx, t] for key, buf_i in self._info_buffers.items()}
+        batch['reward'] = self.env.compute_reward(batch['next_achieved_goal'], batch['desired_goal'], info)
+        return batch
+
+    def _sample_indices(self, batch_size):
+        # sample flat transition indices so that every stored transition is equally
+        # likely, also when episodes have different lengths
+        ends = np.cumsum(self._ep_lengths[:self.n_episodes_stored])
+        flat = self.np_random.randint(0, ends[-1], size=batch_size)
+        ep_idx = np.searchsorted(ends, flat, side='right')
+        t = flat - (ends[ep_idx] - self._ep_lengths[ep_idx])
+        return ep_idx, t
+
+    def _relabel_indices(self, t, ep_lengths):
+        """Index into achieved_goal (length L+1) of the goal used for relabeling."""
+        if self.replay_strategy == 'future':
+            offset = np.floor(self.np_random.uniform(size=t.shape) * (ep_lengths - t)).astype(np.int64)
+            return t + 1 + offset
+        elif self.replay_strategy == 'final':
+            return ep_lengths.copy()
+        elif self.replay_strategy == 'episode':
+            return 1 + np.floor(self.np_random.uniform(size=t.shape) * ep_lengths).astype(np.int64)
+        return t + 1
+
+
+class EpisodeCollector(object):
+    """Accumulates `(obs, action, info)` tuples of a GoalEnv rollout into the
+    episode dict expected by `HERReplayBuffer.store_episode`."""
+
+    def __init__(self, info_keys=()):
+        self.info_keys = tuple(info_keys)
+        self._reset_lists()
+
+    def _reset_lists(self):
+        self._obs = []
+        self._ag = []
+        self._g = []
+        self._u = []
+        self._info = {k: [] for k in self.info_keys}
+        self._last_g = None
+
+    def reset(self, obs):
+        self._reset_lists()
+        self._obs.append(obs['observation'])
+        self._ag.append(obs['achieved_goal'])
+        self._last_g = obs['desired_goal']
+
+    def add(self, action, next_obs, info=None):
+        # the desired goal of a transition is the one the action was taken for
+        self._g.append(self._last_g)
+        self._u.append(action)
+        self._obs.append(next_obs['observation'])
+        self._ag.append(next_obs['achieved_goal'])
+        self._last_g = next_obs['desired_goal']
+        for k in self.info_keys:
+            self._info[k].append(info[k])
+
+    def __len__(self):
+        return len(self._u)
+
+    def episode(self):
+        return dict(
+            observation=np.array(self._obs),
+            achieved_goal=np.array(self._ag),
+            desired_goal=np.array(self._g),
+            action=np.array(self._u),
+            info={k: np.array(v) for k, v in self._info.items()},
+        )
+
+
+def _relabel_per_transition(env, episodes, batch_size, future_p, np_random):
+    # Reference implementation with per-transition Python relabeling, used for benchmarking.
+    res = []
+    for _ in range(batch_size):
+        ep = episodes[np_random.randint(len(episodes))]
+        ep_len = len(ep['action'])
+        t = np_random.randint(ep_len)
+        g = ep['desired_goal'][t]
+        if np_random.uniform() < future_p:
+            g = ep['achieved_goal'][np_random.randint(t + 1, ep_len + 1)]
+        r = env.compute_reward(ep['achieved_goal'][t + 1], g, dict())
+        res.append((ep['observation'][t], ep['action'][t], g, r))
+    return res
+
+
+def _benchmark(env_id='FetchPickAndPlace-v1', n_episodes=200, batch_size=256, n_batches=100):
+    import time
+    import gym
+
+    env = gym.make(env_id)
+    T = env.spec.max_episode_steps
+    buffer = HERReplayBuffer(env.unwrapped, max_episode_steps=T, size_in_transitions=n_episodes * T)
+    collector = EpisodeCollector()
+    episodes = []
+
+    for _ in range(n_episodes):
+        collector.reset(env.reset())
+        for _ in range(T):
+            u = env.action_space.sample()
+            obs, _, _, info = env.step(u)
+            collector.add(u, obs, info)
+        episodes.append(collector.episode())
+        buffer.store_episode(episodes[-1])
+
+    tic = time.time()
+    for _ in range(n_batches):
+        buffer.sample(batch_size)
+    batched_s = time.time() - tic
+
+    tic = time.time()
+    for _ in range(n_batches):
+        _relabel_per_transition(env.unwrapped, episodes, batch_size, buffer.future_p, buffer.np_random)
+    naive_s = time.time() - tic
+
+    n = n_batches * batch_size
+    print(f'Batched relabeling: {n / batched_s:.0f} transitions/s')
+    print(f'Per-transition relabeling: {n / naive_s:.0f} transitions/s')
+    print(f'Speedup: {naive_s / batched_s:.1f}x')
+
+
+if __name__ == '__main__':
+    _benchmark()
@@ -0,0 +1,90 @@
+"""Per-phase instrumentation of macro-step environments.
+
+Macro-step envs (e.g. YumiSteppedEnv, HandSteppedEnv) run several control phases of many
+simulation substeps in each call to `step`. When a PhaseProfiler is attached to their
+`profiler` attribute, every phase records how many substeps it used, its wall time, the time
+spent in IK solves and why it ended ('converged', 'unstable', 'max_steps', or 'still' and
+'failure' when a gym.utils.substep_scheduler.SubstepScheduler stops it). The records of
+a step are returned in `info['phases']` and passed to an optional sink, e.g. a PhaseStats
+aggregating them over many steps to tune the `max_steps` of each phase.
+
+Envs only look at their profiler once per phase when it is None, so disabled profiling has
+no measurable overhead.
+"""
+import time
+from collections import defaultdict
+
+
+clock = time.perf_counter
+
+
+class PhaseProfiler(object):
+
+    def __init__(self, sink=None, info_key='phases'):
+        """
+        Args:
+            sink (callable): called with the list of phase records at the end of each step.
+            info_key (str): key of the phase records in the info dict, or None to not add them.
+        """
+        self.sink = sink
+        self.info_key = info_key
+        self._phases = []
+
+    def start_step(self):
+        self._phases = []
+
+    def record(self, phase, *, substeps, wall_s, ik_s=0.0, exit_reason='', **extra):
+        self._phases.append(dict(phase=phase, substeps=substeps, wall_s=wall_s, ik_s=ik_s,
+                                 exit_reason=exit_reason, **extra))
+
+    def end_step(self, info) -> dict:
+        """Adds the records of the step to `info` and passes them to the sink."""
+        phases, self._phases = self._phases, []
+        if self.info_key is not None:
+            info[self.info_key] = phases
+        if self.sink is not None:
+            self.sink(phases)
+        return info
+
+
+class PhaseStats(object):
+    """Sink aggregating phase records over many steps."""
+
+    def __init__(self):
+        self.n_steps = 0
+        self._count = defaultdict(int)
+        self._substeps = defaultdict(int)
+        self._wall_s = defaultdict(float)
+        self._ik_s = defaultdict(float)
+        self._exit_reasons = defaultdict(lambda: defaultdict(int))
+
+    def __call__(self, phases):
+        self.n_steps += 1
+        for p in phases:
+            name = p['phase']
+            self._count[name] += 1
+            self._substeps[name] += p['substeps']
+            self._wall_s[name] += p['wall_s']
+            self._ik_s[name] += p['ik_s']
+            self._exit_reasons[name][p['exit_reason']] += 1
+
+    def summary(self) -> dict:
+        """Returns, for each phase, how many times it ran, its mean substeps, wall time and IK
+        time, and the counts of its exit reasons."""
+        return {
+            name: dict(
+                count=n,
+                mean_substeps=self._substeps[name] / n,
+                mean_wall_ms=1e3 * self._wall_s[name] / n,
+                mean_ik_ms=1e3 * self._ik_s[name] / n,
+                exit_reasons=dict(self._exit_reasons[name]),
+            )
+            for name, n in self._count.items()
+        }
+
+    def __repr__(self):
+        lines = [f'PhaseStats(steps={self.n_steps})']
+        for name, s in self.summary().items():
+            lines.append(f'  {name}: n={s["count"]}, substeps={s["mean_substeps"]:.1f}, '
+                         f'wall={s["mean_wall_ms"]:.2f}ms, ik={s["mean_ik_ms"]:.2f}ms, exits={s["exit_reasons"]}')
+        return '\n'.join(lines)
@@ -0,0 +1,127 @@
+"""Fingerprints of seeded random rollouts, to check that envs are deterministic.
+
+A fingerprint holds one SHA-256 hash per stream of a rollout (observations, including the
+ones returned by reset, actions, rewards and dones). Values are hashed incrementally as they are produced, so rollouts are never
+kept in memory, and by their content (dtype, shape and bytes of arrays, sorted keys of
+dicts) instead of their string representation, which hides most of the values of large
+arrays. `fingerprint_specs` rolls out many env specs in a pool of processes.
+"""
+import hashlib
+import multiprocessing
+import time
+
+import numpy as np
+
+from gym import logger
+
+
+STREAMS = ('observations', 'actions', 'rewards', 'dones')
+
+
+def update_hash(h, value):
+    """Updates the hashlib object `h` with the content of `value`."""
+    if isinstance(value, np.ndarray):
+        h.update(b'a' + value.dtype.str.encode() + str(value.shape).encode())
+        h.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (np.generic, bool, int, float)):
+        update_hash(h, np.asarray(value))
+    elif isinstance(value, dict):
+        h.update(b'd%d' % len(value))
+        for k in sorted(value.keys()):
+            h.update(repr(k).encode())
+            update_hash(h, value[k])
+    elif isinstance(value, (tuple, list)):
+        h.update(b't%d' % len(value))
+        for v in value:
+            update_hash(h, v)
+    else:
+        h.update(b'r' + repr(value).encode())
+
+
+class RolloutHasher(object):
+
+    def __init__(self):
+        self._hashes = {name: hashlib.sha256() for name in STREAMS}
+
+    def add_reset(self, observation):
+        update_hash(self._hashes['observations'], observation)
+
+    def add_step(self, observation, action, reward, done):
+        update_hash(self._hashes['observations'], observation)
+        update_hash(self._hashes['actions'], action)
+        update_hash(self._hashes['rewards'], reward)
+        update_hash(self._hashes['dones'], done)
+
+    def hexdigests(self) -> dict:
+        return {name: h.hexdigest() for name, h in self._hashes.items()}
+
+
+def rollout_fingerprint(spec, n_steps=100, seed=0) -> dict:
+    """Rolls out `n_steps` random actions in an env seeded with `seed`, resetting it at the
+    end of each episode, and returns the hashes of its streams and the rollout time."""
+    from gym import envs
+    if isinstance(spec, str):
+        spec = envs.spec(spec)
+
+    tic = time.perf_counter()
+    env = spec.make()
+    env.seed(seed)
+    hasher = RolloutHasher()
+    done = True
+    action_space = None
+    for _ in range(n_steps):
+        if done:
+            hasher.add_reset(env.reset())
+            # some envs (e.g. KellyCoinflipGeneralized) build a new action space on reset
+            if env.action_space is not action_space:
+                action_space = env.action_space
+                action_space.seed(seed)
+        action = env.action_space.sample()
+        observation, reward, done, _ = env.step(action)
+        hasher.add_step(observation, action, reward, done)
+    env.close()
+
+    result = hasher.hexdigests()
+    result['elapsed_s'] = time.perf_counter() - tic
+    return result
+
+
+def _fingerprint_safe(args):
+    spec_id, n_steps, seed = args
+    try:
+        return spec_id, rollout_fingerprint(spec_id, n_steps=n_steps, seed=seed)
+    except Exception as e:
+        return spec_id, dict(error='{}: {}'.format(type(e).__name__, e))
+
+
+def _imap_fingerprints(tasks, n_workers):
+    if n_workers == 1:
+        for task in tasks:
+            yield _fingerprint_safe(task)
+        return
+    # workers are reused across specs, since importing the env modules takes longer than most rollouts
+    with multiprocessing.Pool(n_workers) as pool:
+        for result in pool.imap_unordered(_fingerprint_safe, tasks):
+            yield result
+
+
+def fingerprint_specs(spec_ids, n_steps=100, seed=0, n_workers=None) -> dict:
+    """Returns the rollout fingerprint of each env spec, computed in a pool of `n_workers`
+    processes (the number of CPUs by default), or in this process if `n_workers` is 1. Specs
+    raising an exception get a dict with the 'error' instead."""
+    spec_ids = list(spec_ids)
+    if n_workers is None:
+        n_workers = multiprocessing.cpu_count()
+    n_workers = max(1, min(n_workers, len(spec_ids)))
+
+    tic = time.perf_counter()
+    results = dict()
+    tasks = [(spec_id, n_steps, seed) for spec_id in spec_ids]
+    for spec_id, result in _imap_fingerprints(tasks, n_workers):
+        results[spec_id] = result
+        if 'error' in result:
+            logger.warn('Rollout of %s failed: %s', spec_id, result['error'])
+        else:
+            logger.info('Rollout of %s: %.2fs', spec_id, result['elapsed_s'])
+    logger.info('Fingerprinted %d specs in %.2fs', len(spec_ids), time.perf_counter() - tic)
+    return {spec_id: results[spec_id] for spec_id in spec_ids}
@@ -0,0 +1,66 @@
+"""Adaptive substep budget for the control phases of macro-step environments.
+
+Each control phase of a macro-step env (e.g. YumiSteppedEnv, HandSteppedEnv) runs until its
+position threshold or its fixed `max_steps`. When a SubstepScheduler is attached to the
+`scheduler` attribute of the env, a phase also stops once the simulation has come to rest,
+i.e. the largest absolute joint velocity stayed below `qvel_tol` for `still_steps`
+consecutive substeps, and the whole macro step is aborted as soon as the env detects a
+failure (e.g. the object dropped or left the workspace). Phases counting stable steps of
+the object (whose reward depends on their length) are only stopped on failures.
+"""
+import numpy as np
+
+
+class SubstepScheduler(object):
+
+    def __init__(self, *, qvel_tol=1e-2, still_steps=5, min_steps=5, qvel_idx=None):
+        """
+        Args:
+            qvel_tol (float): joint velocity below which the simulation is considered at rest.
+            still_steps (int): number of consecutive substeps at rest that stop a phase.
+            min_steps (int): number of substeps of a phase before it can be stopped.
+            qvel_idx (array-like): indices of the qvel entries to check, all of them if None.
+        """
+        self.qvel_tol = qvel_tol
+        self.still_steps = still_steps
+        self.min_steps = min_steps
+        self.qvel_idx = None if qvel_idx is None else np.asarray(qvel_idx)
+        self.saved_substeps = 0
+        self.total_substeps = 0
+        self.n_aborted = 0
+        self._n_still = 0
+        self._n_substeps = 0
+
+    def start_phase(self):
+        self._n_still = 0
+        self._n_substeps = 0
+
+    def is_still(self, qvel) -> bool:
+        """Call after each substep of a phase with the qvel of the simulation, returns
+        whether the phase can be stopped because the simulation is at rest."""
+        self._n_substeps += 1
+        if self.qvel_idx is not None:
+            qvel = qvel[self.qvel_idx]
+        if np.abs(qvel).max() < self.qvel_tol:
+            self._n_still += 1
+        else:
+            self._n_still = 0
+        return self._n_substeps >= self.min_steps and self._n_still >= self.still_steps
+
+    def end_phase(self, n_substeps, max_steps, exit_reason):
+        """Records a phase that ran `n_substeps` out of its `max_steps` and stopped for
+        `exit_reason`. Only the substeps cut by the scheduler ('still' and 'failure') are
+        counted as saved, not those of phases that converged or ended on their own."""
+        self.total_substeps += n_substeps
+        if exit_reason in ('still', 'failure'):
+            self.saved_substeps += max_steps - n_substeps
+        self.n_aborted += int(exit_reason == 'failure')
+
+    @property
+    def saved_fraction(self):
+        budget = self.total_substeps + self.saved_substeps
+        return self.saved_substeps / budget if budget > 0 else 0.0
+
+    def __repr__(self):
+        return (f'SubstepScheduler(substeps={self.total_substeps}, saved={self.saved_substeps} '
+                f'({100 * self.saved_fraction:.1f}%), aborted={self.n_aborted})')
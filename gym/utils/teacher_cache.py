@@ -0,0 +1,241 @@
+import collections
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from gym import error
+
+
+_META_FILE = 'meta.json'
+
+
+def make_teacher_key(*, env_id, env_kwargs=None, seed=None, init_flags=None, goal, object_pos, init_obs=None,
+                     decimals=6) -> str:
+    """Returns a content address for a teacher rollout.
+
+    The rollout of a deterministic scripted teacher only depends on the env, its kwargs and seed,
+    the flags randomizing its initial state (`init_flags`, e.g. randomize_initial_arm_pos), the
+    (aligned) goal, the initial object position and the rest of the initial state, e.g. a randomized
+    arm position, given by the initial observation `init_obs`. Arrays are rounded to `decimals`
+    decimals, so that tiny numerical differences in the alignment do not cause misses.
+    """
+    h = hashlib.sha1()
+    h.update(json.dumps(
+        dict(env_id=env_id, env_kwargs=env_kwargs or dict(), seed=seed, init_flags=init_flags or dict()),
+        sort_keys=True, default=repr,
+    ).encode())
+    for arr in (goal, object_pos, init_obs if init_obs is not None else ()):
+        arr = np.round(np.asarray(arr, dtype=np.float64), decimals) + 0.0  # + 0.0 turns -0.0 into 0.0
+        h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+def teacher_key_for(env, obs, *, seed=None, env_kwargs=None) -> str:
+    """Returns the key of a teacher rollout in a GoalEnv starting from `obs`, whose desired and
+    achieved goals are the aligned goal and the initial object position. `env_kwargs` default to
+    the ones of the env spec, so pass them explicitly if the env was made with extra kwargs. The
+    `randomize*` attributes of the env are used as the flags randomizing its initial state."""
+    unwrapped = env.unwrapped
+    spec = unwrapped.spec
+    if env_kwargs is None:
+        env_kwargs = spec._kwargs if spec is not None else None
+    init_flags = {k: v for k, v in vars(unwrapped).items() if k.startswith('randomize')}
+    return make_teacher_key(
+        env_id=spec.id if spec is not None else type(unwrapped).__name__,
+        env_kwargs=env_kwargs,
+        seed=seed,
+        init_flags=init_flags,
+        goal=obs['desired_goal'],
+        object_pos=obs['achieved_goal'],
+        init_obs=obs.get('observation'),
+    )
+
+
+def max_episode_steps(env) -> int:
+    """Returns the episode length of an env, from its spec or its TimeLimit wrapper."""
+    spec = getattr(env, 'spec', None)
+    if spec is not None and spec.max_episode_steps is not None:
+        return spec.max_episode_steps
+    n_steps = getattr(env, '_max_episode_steps', None)
+    if n_steps is None:
+        raise error.Error('The episode length of {} is unknown, pass the number of steps explicitly'.format(env))
+    return n_steps
+
+
+def record_teacher_trajectory(agent, env, obs, n_steps: int) -> list:
+    """Rolls out `agent` in `env` from the current state, whose observation is `obs`.
+    Returns the list of the n_steps + 1 observations, starting with `obs`."""
+    observations = [obs]
+    for _ in range(n_steps):
+        obs, _, _, _ = env.step(agent.predict(obs))
+        observations.append(obs)
+    return observations
+
+
+class TeacherTrajectory(object):
+    """Memory-mapped sequence of teacher observations; trajectory[i] is the
+    observation after i steps (a dict for GoalEnvs)."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, _META_FILE), 'r') as f:
+            meta = json.load(f)
+        self.path = path
+        self._is_dict = meta['is_dict']
+        self._length = meta['length']
+        self._keys = meta['keys']
+        self._arrays = None
+
+    def _open(self) -> dict:
+        if self._arrays is None:
+            self._arrays = {k: np.load(os.path.join(self.path, f'{k}.npy'), mmap_mode='r') for k in self._keys}
+        return self._arrays
+
+    def close(self):
+        """Releases the memory maps, which are opened again on the next access."""
+        self._arrays = None
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, i):
+        arrays = self._open()
+        if self._is_dict:
+            return {k: np.array(arr[i]) for k, arr in arrays.items()}
+        return np.array(arrays['obs'][i])
+
+
+class TeacherTrajectoryCache(object):
+    """Persistent, content-addressed cache of teacher rollouts.
+
+    Each trajectory is stored in `cache_dir/<key>/` as one .npy file per observation key, and is
+    loaded memory-mapped, so that replaying it does not require a second physics simulation.
+    Keys are usually computed with `make_teacher_key`. Entries are written atomically, so the
+    cache can be shared among processes. The `max_loaded` most recently used trajectories are
+    kept open, the memory maps of the others are closed.
+
+    If `max_entries` is given, the least recently used entries (by the modification time of their
+    metadata, updated on each access) are removed from the disk when more are stored. Entries
+    loaded by this cache are kept; with several processes sharing the cache, `max_entries` should
+    leave room for the trajectories all of them replay.
+    """
+
+    def __init__(self, cache_dir, max_loaded=4, max_entries=None):
+        self.cache_dir = cache_dir
+        self.max_loaded = max_loaded
+        self.max_entries = max_entries
+        os.makedirs(cache_dir, exist_ok=True)
+        self._loaded = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self._path(key), _META_FILE))
+
+    def get(self, key):
+        """Returns the TeacherTrajectory stored with `key`, or None."""
+        traj = self._loaded.get(key)
+        if traj is not None:
+            self._loaded.move_to_end(key)
+        elif key in self:
+            traj = self._loaded[key] = TeacherTrajectory(self._path(key))
+            while len(self._loaded) > self.max_loaded:
+                _, evicted = self._loaded.popitem(last=False)
+                evicted.close()
+        if traj is not None and self.max_entries is not None:
+            try:
+                os.utime(os.path.join(self._path(key), _META_FILE))
+            except OSError:
+                pass  # removed by another process, the memory maps stay valid
+        return traj
+
+    def _evict(self):
+        entries = []
+        for key in os.listdir(self.cache_dir):
+            if key.startswith('.tmp-') or key in self._loaded:
+                continue
+            try:
+                entries.append((os.path.getmtime(os.path.join(self._path(key), _META_FILE)), key))
+            except OSError:
+                continue  # removed by another process
+        n_evicted = len(entries) + len(self._loaded) - self.max_entries
+        for _, key in sorted(entries)[:max(0, n_evicted)]:
+            shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def put(self, key, observations) -> TeacherTrajectory:
+        """Stores a sequence of observations (dicts or arrays) with `key`."""
+        if len(observations) == 0:
+            raise error.Error('Cannot cache an empty teacher trajectory')
+        is_dict = isinstance(observations[0], dict)
+        if is_dict:
+            arrays = {k: np.array([o[k] for o in observations]) for k in observations[0].keys()}
+        else:
+            arrays = dict(obs=np.array(observations))
+
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            for k, arr in arrays.items():
+                np.save(os.path.join(tmp_path, f'{k}.npy'), arr)
+            with open(os.path.join(tmp_path, _META_FILE), 'w') as f:
+                json.dump(dict(is_dict=is_dict, length=len(observations), keys=list(arrays.keys())), f)
+            os.rename(tmp_path, self._path(key))
+        except OSError:
+            # another process stored the same trajectory in the meantime
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if key not in self:
+                raise
+        traj = self.get(key)
+        if self.max_entries is not None:
+            self._evict()
+        return traj
+
+    def get_or_record(self, key, *, agent, env, obs, n_steps: int) -> TeacherTrajectory:
+        traj = self.get(key)
+        if traj is None:
+            self.misses += 1
+            traj = self.put(key, record_teacher_trajectory(agent, env, obs, n_steps))
+        else:
+            self.hits += 1
+        return traj
+
+
+class TeacherRollout(object):
+    """Rollout of a teacher agent in its GoalEnv, from the state the env is in when `start` is
+    called. With a `cache`, the rollout of `n_steps` steps (by default the episode length of the
+    env) is looked up with `teacher_key_for` (and recorded on misses) and replayed without
+    stepping the env; otherwise the teacher is simulated."""
+
+    def __init__(self, agent, env, *, cache: TeacherTrajectoryCache=None, env_kwargs=None, seed=None,
+                 n_steps=None):
+        self.agent = agent
+        self.env = env
+        self.cache = cache
+        self.env_kwargs = env_kwargs
+        self.seed = seed
+        if cache is not None and n_steps is None:
+            n_steps = max_episode_steps(env)
+        self.n_steps = n_steps
+        self._traj = None
+        self._t = 0
+
+    def start(self):
+        self._traj = None
+        self._t = 0
+        if self.cache is not None:
+            obs = self.env.unwrapped._get_obs()
+            key = teacher_key_for(self.env, obs, seed=self.seed, env_kwargs=self.env_kwargs)
+            self._traj = self.cache.get_or_record(key, agent=self.agent, env=self.env, obs=obs, n_steps=self.n_steps)
+
+    def step(self):
+        """Returns the next observation of the teacher, the last one at the end of a replay."""
+        if self._traj is not None:
+            self._t = min(self._t + 1, len(self._traj) - 1)
+            return self._traj[self._t]
+        obs, _, _, _ = self.env.step(self.agent.predict(self.env.unwrapped._get_obs()))
+        return obs
@@ -0,0 +1,23 @@
+import os
+
+from gym.utils.demos import generate_demos, episode_path, load_episode
+from gym.wrappers.monitoring.tests import helpers
+
+
+def test_generate_demos():
+    with helpers.tempdir() as temp:
+        stats = generate_demos('CartPole-v0', temp, [0, 1, 2, 2], agent_cls='gym.agents.base:RandomAgent',
+                               n_workers=2, max_episode_steps=20)
+        assert stats.n_episodes == 3
+        assert 0.0 <= stats.success_rate <= 1.0
+
+        episode = load_episode(episode_path(temp, 1))
+        assert len(episode['obs']) == len(episode['actions']) + 1
+        assert len(episode['actions']) <= 20
+        assert episode['seed'] == 1
+
+        # existing seeds are skipped
+        stats = generate_demos('CartPole-v0', temp, range(5), agent_cls='gym.agents.base:RandomAgent', n_workers=2)
+        assert stats.n_skipped == 3
+        assert stats.n_episodes == 2
+        assert len([f for f in os.listdir(temp) if f.endswith('.npz')]) == 5
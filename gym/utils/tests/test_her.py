@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+import gym
+from gym import spaces, error
+from gym.utils.her import HERReplayBuffer, EpisodeCollector
+
+
+class PointGoalEnv(gym.GoalEnv):
+    def __init__(self, max_steps=10):
+        self.max_steps = max_steps
+        self.action_space = spaces.Box(-1., 1., shape=(2,), dtype='float32')
+        self.observation_space = spaces.Dict(dict(
+            desired_goal=spaces.Box(-np.inf, np.inf, shape=(2,), dtype='float32'),
+            achieved_goal=spaces.Box(-np.inf, np.inf, shape=(2,), dtype='float32'),
+            observation=spaces.Box(-np.inf, np.inf, shape=(2,), dtype='float32'),
+        ))
+        self.np_random = np.random.RandomState(0)
+
+    def _obs(self):
+        return dict(observation=self.pos.copy(), achieved_goal=self.pos.copy(), desired_goal=self.goal.copy())
+
+    def reset(self):
+        self.pos = np.zeros(2)
+        self.goal = self.np_random.uniform(-1, 1, size=2)
+        return self._obs()
+
+    def step(self, action):
+        self.pos = self.pos + 0.1 * action
+        obs = self._obs()
+        return obs, self.compute_reward(obs['achieved_goal'], self.goal, None), False, dict()
+
+    def compute_reward(self, achieved_goal, desired_goal, info):
+        d = np.linalg.norm(achieved_goal - desired_goal, axis=-1)
+        return -(d > 0.05).astype(np.float32)
+
+
+def _fill(buffer, env, n_episodes, lengths=None):
+    episodes = []
+    collector = EpisodeCollector()
+    for i in range(n_episodes):
+        collector.reset(env.reset())
+        for _ in range(lengths[i] if lengths else env.max_steps):
+            u = env.np_random.uniform(-1, 1, size=2)
+            obs, _, _, info = env.step(u)
+            collector.add(u, obs, info)
+        episodes.append(collector.episode())
+        buffer.store_episode(episodes[-1])
+    return episodes
+
+
+@pytest.mark.parametrize("strategy", ['future', 'final', 'episode', 'none'])
+def test_sampled_rewards_match_per_transition(strategy):
+    env = PointGoalEnv()
+    buffer = HERReplayBuffer(env, max_episode_steps=env.max_steps, size_in_transitions=100, replay_strategy=strategy)
+    buffer.seed(0)
+    _fill(buffer, env, 5)
+
+    batch = buffer.sample(64)
+    for key in ['observation', 'action', 'desired_goal', 'reward']:
+        assert len(batch[key]) == 64
+    for ag, g, r in zip(batch['next_achieved_goal'], batch['desired_goal'], batch['reward']):
+        assert r == env.compute_reward(ag, g, None)
+    if strategy == 'none':
+        assert not np.any(batch['is_relabeled'])
+
+
+def test_relabeled_goals_come_from_the_future():
+    env = PointGoalEnv()
+    buffer = HERReplayBuffer(env, max_episode_steps=env.max_steps, size_in_transitions=20, replay_k=1000)
+    # a single episode, so that each achieved goal identifies its time step
+    episode = _fill(buffer, env, 1)[0]
+    achieved = episode['achieved_goal'].astype(np.float32)
+
+    batch = buffer.sample(256)
+    assert np.mean(batch['is_relabeled']) > 0.9
+    for obs, g, relabeled in zip(batch['observation'], batch['desired_goal'], batch['is_relabeled']):
+        if not relabeled:
+            continue
+        t = np.where(np.all(achieved == obs, axis=-1))[0][0]
+        goal_t = np.where(np.all(achieved == g, axis=-1))[0]
+        assert np.any(goal_t > t)
+
+
+def test_ring_buffer_and_variable_lengths():
+    env = PointGoalEnv()
+    buffer = HERReplayBuffer(env, max_episode_steps=env.max_steps, size_in_transitions=3 * env.max_steps)
+    _fill(buffer, env, 5, lengths=[10, 3, 7, 2, 5])
+    assert buffer.full
+    assert buffer.n_transitions_stored == 27
+    assert len(buffer) == 7 + 2 + 5
+
+    batch = buffer.sample(128)
+    assert np.all(np.isfinite(batch['reward']))
+
+    with pytest.raises(error.Error):
+        buffer.store_episode(dict(observation=np.zeros((12, 2)), achieved_goal=np.zeros((12, 2)),
+                                  desired_goal=np.zeros((11, 2)), action=np.zeros((11, 2))))
+
+    buffer.clear()
+    assert len(buffer) == 0 and buffer.n_episodes_stored == 0 and buffer.n_transitions_stored == 0
+    with pytest.raises(error.Error):
+        buffer.sample(1)
@@ -0,0 +1,21 @@
+from gym.utils.phase_profiler import PhaseProfiler, PhaseStats
+
+
+def test_phase_records_and_stats():
+    stats = PhaseStats()
+    profiler = PhaseProfiler(sink=stats)
+
+    for substeps in (10, 20):
+        profiler.start_step()
+        profiler.record('grasp', substeps=substeps, wall_s=0.01, ik_s=0.002, exit_reason='converged')
+        profiler.record('lift', substeps=200, wall_s=0.1, exit_reason='max_steps')
+        info = profiler.end_step(dict())
+
+    assert [p['phase'] for p in info['phases']] == ['grasp', 'lift']
+    assert info['phases'][0]['substeps'] == 20
+
+    summary = stats.summary()
+    assert stats.n_steps == 2
+    assert summary['grasp']['count'] == 2
+    assert summary['grasp']['mean_substeps'] == 15
+    assert summary['lift']['exit_reasons'] == {'max_steps': 2}
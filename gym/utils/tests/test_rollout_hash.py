@@ -0,0 +1,38 @@
+import hashlib
+
+import numpy as np
+
+from gym.utils import rollout_hash
+
+
+def _digest(value):
+    h = hashlib.sha256()
+    rollout_hash.update_hash(h, value)
+    return h.hexdigest()
+
+
+def test_update_hash():
+    a = np.zeros(10000)
+    b = a.copy()
+    b[5000] = 1.0
+    # str(a) == str(b), the content differs
+    assert _digest(a) != _digest(b)
+    assert _digest(a) != _digest(a.astype(np.float32))
+    assert _digest(a) != _digest(a.reshape(100, 100))
+    assert _digest(dict(x=1, y=a)) == _digest(dict(y=a, x=1))
+    assert _digest((1, 2)) != _digest(((1,), 2))
+    assert _digest(np.float64(0.5)) == _digest(0.5)
+
+
+def test_fingerprint_specs():
+    spec_ids = ['CartPole-v0', 'FrozenLake-v0', 'NotAnEnv-v0']
+    fingerprints = rollout_hash.fingerprint_specs(spec_ids, n_steps=50, n_workers=2)
+    assert list(fingerprints.keys()) == spec_ids
+    assert 'error' in fingerprints['NotAnEnv-v0']
+    for spec_id in spec_ids[:2]:
+        serial = rollout_hash.rollout_fingerprint(spec_id, n_steps=50)
+        assert fingerprints[spec_id]['elapsed_s'] > 0
+        for stream in rollout_hash.STREAMS:
+            assert fingerprints[spec_id][stream] == serial[stream]
+    assert rollout_hash.rollout_fingerprint('CartPole-v0', n_steps=50, seed=1)['observations'] != \
+        fingerprints['CartPole-v0']['observations']
@@ -0,0 +1,30 @@
+import numpy as np
+
+from gym.utils.substep_scheduler import SubstepScheduler
+
+
+def test_stops_when_still():
+    scheduler = SubstepScheduler(qvel_tol=1e-2, still_steps=3, min_steps=5)
+    scheduler.start_phase()
+    qvels = [np.ones(4)] * 2 + [np.full(4, 1e-3)] * 10
+    n_substeps = 0
+    for qvel in qvels:
+        n_substeps += 1
+        if scheduler.is_still(qvel):
+            break
+    # at rest from substep 3, but not stopped before min_steps
+    assert n_substeps == 5
+
+    scheduler.end_phase(n_substeps, 100, 'still')
+    scheduler.end_phase(10, 40, 'failure')
+    # phases stopping on their own do not save substeps
+    scheduler.end_phase(20, 50, 'converged')
+    scheduler.end_phase(3, 50, 'unstable')
+    assert scheduler.total_substeps == 38
+    assert scheduler.saved_substeps == 95 + 30
+    assert scheduler.n_aborted == 1
+
+    # only the selected velocities are checked
+    scheduler = SubstepScheduler(still_steps=1, min_steps=1, qvel_idx=[0, 1])
+    scheduler.start_phase()
+    assert scheduler.is_still(np.r_[0., 0., 5.])
@@ -0,0 +1,192 @@
+import os
+import time
+
+import numpy as np
+import pytest
+
+from gym import error
+from gym.agents.base import BaseAgent
+from gym.envs.registration import EnvSpec
+from gym.utils.teacher_cache import TeacherRollout, TeacherTrajectoryCache, make_teacher_key, teacher_key_for
+from gym.wrappers.monitoring.tests import helpers
+
+
+class CountingEnv(object):
+    def __init__(self):
+        self.n_steps = 0
+        self.pos = np.zeros(3)
+
+    def _obs(self):
+        return dict(observation=self.pos.copy(), achieved_goal=self.pos.copy(), desired_goal=np.ones(3))
+
+    def step(self, action):
+        self.n_steps += 1
+        self.pos = self.pos + action
+        return self._obs(), 0.0, False, dict()
+
+
+class CountingGoalEnv(CountingEnv):
+    spec = EnvSpec('Counting-v0', max_episode_steps=5)
+
+    def __init__(self):
+        super(CountingGoalEnv, self).__init__()
+        self.goal = np.ones(3)
+
+    def _obs(self):
+        return dict(observation=self.pos.copy(), achieved_goal=self.pos.copy(), desired_goal=self.goal.copy())
+
+    _get_obs = _obs
+
+    @property
+    def unwrapped(self):
+        return self
+
+
+class ConstantAgent(BaseAgent):
+    def predict(self, obs, **kwargs):
+        return np.r_[0.1, 0.0, -0.1]
+
+
+def test_record_and_replay():
+    env = CountingEnv()
+    agent = ConstantAgent(env)
+    key = make_teacher_key(env_id='Counting-v0', goal=np.ones(3), object_pos=np.zeros(3))
+    assert key == make_teacher_key(env_id='Counting-v0', goal=np.ones(3) + 1e-9, object_pos=-np.zeros(3))
+    assert key != make_teacher_key(env_id='Counting-v0', env_kwargs=dict(a=1), goal=np.ones(3), object_pos=np.zeros(3))
+    assert key != make_teacher_key(env_id='Counting-v0', seed=1, goal=np.ones(3), object_pos=np.zeros(3))
+    assert key != make_teacher_key(env_id='Counting-v0', init_flags=dict(randomize_initial_arm_pos=True),
+                                   goal=np.ones(3), object_pos=np.zeros(3))
+    assert key != make_teacher_key(env_id='Counting-v0', goal=np.ones(3), object_pos=np.zeros(3), init_obs=np.ones(2))
+
+    with helpers.tempdir() as temp:
+        cache = TeacherTrajectoryCache(temp)
+        assert cache.get(key) is None
+        traj = cache.get_or_record(key, agent=agent, env=env, obs=env._obs(), n_steps=10)
+        assert env.n_steps == 10
+        assert len(traj) == 11
+
+        # a new cache on the same directory replays the rollout without stepping the env
+        traj = TeacherTrajectoryCache(temp).get_or_record(key, agent=agent, env=env, obs=env._obs(), n_steps=10)
+        assert env.n_steps == 10
+        assert np.allclose(traj[0]['observation'], 0.0)
+        assert np.allclose(traj[10]['observation'], [1.0, 0.0, -1.0])
+        assert np.allclose(traj[3]['desired_goal'], 1.0)
+
+
+def test_loaded_trajectories_lru():
+    with helpers.tempdir() as temp:
+        cache = TeacherTrajectoryCache(temp, max_loaded=2)
+        keys = [make_teacher_key(env_id='Counting-v0', goal=np.ones(3), object_pos=np.full(3, i)) for i in range(3)]
+        trajs = []
+        for i, k in enumerate(keys):
+            trajs.append(cache.put(k, [np.full(2, i), np.full(2, i + 1)]))
+            assert np.allclose(trajs[-1][0], i)
+        # the least recently used trajectory was evicted and its memory maps closed
+        assert list(cache._loaded.keys()) == keys[1:]
+        assert trajs[0]._arrays is None and trajs[1]._arrays is not None
+
+        assert cache.get(keys[1]) is trajs[1]
+        traj = cache.get(keys[0])
+        assert traj is not trajs[0]
+        assert list(cache._loaded.keys()) == [keys[1], keys[0]]
+        assert trajs[2]._arrays is None
+        # closed trajectories are opened again on access
+        assert np.allclose(trajs[2][1], 3)
+        assert np.allclose(traj[1], 1)
+
+
+def test_teacher_rollout_hits_and_misses():
+    env = CountingGoalEnv()
+    agent = ConstantAgent(env)
+    with helpers.tempdir() as temp:
+        cache = TeacherTrajectoryCache(temp)
+        rollout = TeacherRollout(agent, env, cache=cache)
+
+        rollout.start()
+        assert (cache.hits, cache.misses) == (0, 1)
+        assert env.n_steps == 5
+        replayed = [rollout.step()['observation'] for _ in range(7)]
+        assert np.allclose(replayed[0], [0.1, 0.0, -0.1])
+        # the last observation is repeated at the end of the rollout
+        assert np.allclose(replayed[4], [0.5, 0.0, -0.5]) and np.allclose(replayed[6], replayed[4])
+
+        # same goal and object position: replayed without stepping the env
+        env.pos = np.zeros(3)
+        rollout.start()
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert env.n_steps == 5
+        assert np.allclose(rollout.step()['observation'], [0.1, 0.0, -0.1])
+
+        env.pos = np.zeros(3)
+        env.goal = np.full(3, 2.0)
+        rollout.start()
+        assert (cache.hits, cache.misses) == (1, 2)
+        assert env.n_steps == 10
+
+    # without a cache, the teacher is simulated
+    env = CountingGoalEnv()
+    rollout = TeacherRollout(agent, env)
+    rollout.start()
+    assert env.n_steps == 0
+    assert np.allclose(rollout.step()['observation'], [0.1, 0.0, -0.1])
+    assert env.n_steps == 1
+
+
+def test_teacher_key_for():
+    env = CountingGoalEnv()
+    key = teacher_key_for(env, env._obs())
+    assert key == teacher_key_for(env, env._obs(), seed=None)
+    assert key != teacher_key_for(env, env._obs(), seed=0)
+    # flags randomizing the initial state, e.g. given as extra kwargs to gym.make
+    env.randomize_initial_arm_pos = True
+    randomized_key = teacher_key_for(env, env._obs())
+    assert randomized_key != key
+    # e.g. a randomized arm position
+    env.pos = np.r_[0.0, 0.1, 0.0]
+    obs = env._obs()
+    obs['achieved_goal'] = np.zeros(3)
+    assert teacher_key_for(env, obs) != randomized_key
+
+
+def test_teacher_rollout_episode_length():
+    env = CountingGoalEnv()
+    env.spec = None
+    agent = ConstantAgent(env)
+    with helpers.tempdir() as temp:
+        cache = TeacherTrajectoryCache(temp)
+        with pytest.raises(error.Error):
+            TeacherRollout(agent, env, cache=cache)
+
+        env._max_episode_steps = 3
+        TeacherRollout(agent, env, cache=cache).start()
+        assert env.n_steps == 3
+
+        env.pos = np.ones(3)
+        TeacherRollout(agent, env, cache=cache, n_steps=2).start()
+        assert env.n_steps == 5
+
+
+def _set_mtime(cache_dir, key, age):
+    t = time.time() - age
+    os.utime(os.path.join(cache_dir, key, 'meta.json'), (t, t))
+
+
+def test_max_entries():
+    with helpers.tempdir() as temp:
+        cache = TeacherTrajectoryCache(temp, max_loaded=2, max_entries=2)
+        keys = [make_teacher_key(env_id='Counting-v0', goal=np.ones(3), object_pos=np.full(3, i)) for i in range(4)]
+        for i, k in enumerate(keys[:2]):
+            cache.put(k, [np.full(2, i)])
+            _set_mtime(temp, k, 10 - i)
+        # keys[0] becomes more recently used than keys[1]
+        assert cache.get(keys[0]) is not None
+
+        cache.put(keys[2], [np.full(2, 2)])
+        assert keys[0] in cache and keys[1] not in cache and keys[2] in cache
+
+        # the least recently used entry is keys[2], but it is loaded by the cache, so keys[0] is removed
+        _set_mtime(temp, keys[0], 10)
+        _set_mtime(temp, keys[2], 20)
+        cache.put(keys[3], [np.full(2, 3)])
+        assert sorted(os.listdir(temp)) == sorted(keys[2:])
+        assert np.allclose(cache.get(keys[2])[0], 2)
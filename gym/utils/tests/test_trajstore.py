@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pytest
+
+from gym import spaces, error
+from gym.utils.trajstore import TrajectoryWriter, TrajectoryReader
+from gym.wrappers.monitoring.tests import helpers
+
+
+observation_space = spaces.Dict(dict(
+    observation=spaces.Box(-1., 1., shape=(3,), dtype='float32'),
+    desired_goal=spaces.Box(-1., 1., shape=(2,), dtype='float32'),
+))
+action_space = spaces.Tuple((spaces.Discrete(3), spaces.Box(-1., 1., shape=(2,), dtype='float32')))
+
+
+def _episode(n_steps, k):
+    obs = [dict(observation=np.full(3, k + t, dtype='float32'), desired_goal=np.full(2, k, dtype='float32'))
+           for t in range(n_steps + 1)]
+    actions = [(t % 3, np.full(2, t, dtype='float32')) for t in range(n_steps)]
+    return obs, actions, np.arange(n_steps, dtype=float)
+
+
+def test_write_and_read():
+    with helpers.tempdir() as temp:
+        with TrajectoryWriter(temp, observation_space, action_space) as writer:
+            writer.add_episode(*_episode(5, 0), seed=3, env_id='Test-v0', success=True)
+            writer.add_episode(*_episode(2, 100), seed=4, env_id='Test-v0')
+
+        # appending to an existing store
+        with TrajectoryWriter(temp, observation_space, action_space) as writer:
+            assert len(writer) == 2
+            writer.add_episode(*_episode(3, 200), seed=5)
+
+        reader = TrajectoryReader(temp)
+        assert len(reader) == 3
+        assert list(reader.episodes['seed']) == [3, 4, 5]
+        assert list(reader.episodes['success']) == [True, False, False]
+        assert reader.episodes['env_id'][0] == b'Test-v0'
+
+        ep = reader.episode(1)
+        assert isinstance(ep['obs/observation'], np.memmap)
+        assert np.all(ep['obs/observation'][:, 0] == [100, 101, 102])
+        assert np.all(ep['action/0'][:2] == [0, 1])
+        assert np.all(ep['reward'][:2] == [0, 1])
+
+        batch = reader.sample(50, np.random.RandomState(0))
+        # next observations are always from the same episode
+        assert np.all(batch['next_obs/observation'] == batch['obs/observation'] + 1)
+        assert np.all(batch['next_obs/desired_goal'] == batch['obs/desired_goal'])
+
+        with pytest.raises(error.Error):
+            TrajectoryWriter(temp, observation_space, spaces.Discrete(2))
+
+
+def test_interrupted_write_is_discarded():
+    with helpers.tempdir() as temp:
+        with TrajectoryWriter(temp, observation_space, action_space) as writer:
+            writer.add_episode(*_episode(4, 0))
+        # simulate a crash after writing some column data but before the index entry
+        with open(os.path.join(temp, 'obs.observation.bin'), 'ab') as f:
+            f.write(b'\0' * 7)
+
+        with TrajectoryWriter(temp, observation_space, action_space) as writer:
+            writer.add_episode(*_episode(1, 10))
+        reader = TrajectoryReader(temp)
+        assert len(reader) == 2
+        assert np.all(reader.episode(1)['obs/observation'][:, 0] == [10, 11])
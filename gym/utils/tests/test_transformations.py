@@ -0,0 +1,194 @@
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip('mujoco_py')
+
+from gym.envs.robotics import rotations
+from gym.utils import transformations as tf
+
+
+def _random_poses(np_random, shape):
+    quat = np_random.normal(size=shape + (4,))
+    quat /= np.linalg.norm(quat, axis=-1, keepdims=True)
+    return np.concatenate([np_random.uniform(-1, 1, size=shape + (3,)), quat], axis=-1)
+
+
+def _quat_rot_vec(q, v0):
+    # single pose reference implementation
+    q_v0 = np.array([0, v0[0], v0[1], v0[2]])
+    q_v = rotations.quat_mul(q, rotations.quat_mul(q_v0, rotations.quat_conjugate(q)))
+    return q_v[1:]
+
+
+def _apply_tf(a_to_b, world_to_a):
+    if world_to_a.size == 3:
+        world_to_a = np.r_[world_to_a, 1., 0., 0., 0.]
+    if a_to_b.size == 3:
+        a_to_b = np.r_[a_to_b, 1., 0., 0., 0.]
+    pos = world_to_a[:3] + _quat_rot_vec(world_to_a[3:], a_to_b[:3])
+    quat = rotations.quat_mul(world_to_a[3:], a_to_b[3:])
+    return np.r_[pos, quat]
+
+
+def _get_tf(world_to_b, world_to_a):
+    inv_q_a = rotations.quat_conjugate(world_to_a[3:])
+    pos = _quat_rot_vec(inv_q_a, world_to_b[:3] - world_to_a[:3])
+    return np.r_[pos, rotations.quat_mul(world_to_b[3:], inv_q_a)]
+
+
+def _quat_angle_diff(quat_a, quat_b):
+    # single quaternion reference implementation
+    quat_diff = rotations.quat_mul(quat_a, rotations.quat_conjugate(quat_b))
+    angle_diff = 2 * np.arccos(np.clip(quat_diff[..., 0], -1., 1.))
+    return np.abs(rotations.normalize_angles(np.asarray(angle_diff)))
+
+
+def test_batched_ops_match_scalar_ops():
+    np_random = np.random.RandomState(3)
+    a = _random_poses(np_random, (6, 4))
+    b = _random_poses(np_random, (4,))
+    # identical and opposite quaternions, i.e. angles of 0 and w == -1
+    b[1, 3:] = a[0, 1, 3:]
+    b[2, 3:] = -a[0, 2, 3:]
+
+    angles = tf.quat_angle_diff(a[..., 3:], b[..., 3:])
+    world_to_b = tf.apply_tf(a, b)
+    out = np.empty_like(a)
+    tf.apply_tf(a, b, out=out)
+    for i in range(6):
+        for j in range(4):
+            assert np.isclose(angles[i, j], _quat_angle_diff(a[i, j, 3:], b[j, 3:]), atol=1e-6)
+            assert np.isclose(tf.quat_angle_diff(a[i, j, 3:], b[j, 3:]), angles[i, j])
+            # the matrix version returns quaternions up to sign
+            world_to_b_mat = tf.apply_tf_old(a[i, j], b[j])
+            assert np.allclose(world_to_b[i, j, :3], world_to_b_mat[:3])
+            assert np.isclose(_quat_angle_diff(world_to_b[i, j, 3:], world_to_b_mat[3:]), 0., atol=1e-6)
+            assert np.allclose(world_to_b[i, j], _apply_tf(a[i, j], b[j]))
+            assert np.allclose(out[i, j], world_to_b[i, j])
+            assert np.allclose(tf.apply_tf(a[i, j, :3], b[j, :3]), _apply_tf(a[i, j, :3], b[j, :3])[:3])
+    assert np.allclose(angles[0, 1:3], 0., atol=1e-6)
+
+
+def test_batched_poses_match_single_poses():
+    np_random = np.random.RandomState(0)
+    a_to_b = _random_poses(np_random, (5, 3))
+    world_to_a = _random_poses(np_random, (3,))
+
+    res = tf.apply_tf(a_to_b, world_to_a)
+    assert res.shape == (5, 3, 7)
+    for i in range(5):
+        for j in range(3):
+            assert np.allclose(res[i, j], _apply_tf(a_to_b[i, j], world_to_a[j]))
+            assert np.allclose(tf.get_tf(res, world_to_a)[i, j], _get_tf(res[i, j], world_to_a[j]))
+
+    # position only transforms and references
+    assert np.allclose(tf.apply_tf(a_to_b[0, :, :3], world_to_a)[:, :3],
+                       [_apply_tf(p, q)[:3] for p, q in zip(a_to_b[0, :, :3], world_to_a)])
+    assert tf.apply_tf(a_to_b[0], world_to_a[0, :3]).shape == (3, 3)
+
+    # outputs can alias the inputs
+    out = tf.apply_tf(a_to_b, world_to_a)
+    expected = tf.get_tf(out, world_to_a)
+    tf.get_tf(out, world_to_a, out=out)
+    assert np.allclose(out, expected)
+    assert np.allclose(out[..., :3], a_to_b[..., :3])
+
+
+def test_pose_mat_roundtrip():
+    np_random = np.random.RandomState(1)
+    poses = _random_poses(np_random, (4, 2))
+    mats = tf.pose_to_mat(poses)
+    assert mats.shape == (4, 2, 4, 4)
+    assert np.allclose(mats[..., 3, :], [0., 0., 0., 1.])
+    assert np.allclose(mats[1, 1] @ tf.pose_to_mat(poses[0, 0]), tf.pose_to_mat(tf.apply_tf(poses[0, 0], poses[1, 1])))
+
+    res = tf.mat_to_pose(mats)
+    assert np.allclose(res[..., :3], poses[..., :3])
+    assert np.allclose(tf.quat_angle_diff(res[..., 3:], poses[..., 3:]), 0., atol=1e-6)
+
+
+def test_mat2quat_fast_matches_mat2quat():
+    np_random = np.random.RandomState(2)
+    quats = _random_poses(np_random, (50,))[:, 3:]
+    # rotations by pi around each axis
+    quats[:4] = np.eye(4)
+    mats = rotations.quat2mat(quats)
+
+    res = rotations.mat2quat_fast(mats)
+    # sign invariant, since w == 0 for rotations by pi
+    assert np.allclose(np.abs(np.sum(res * rotations.mat2quat(mats), axis=-1)), 1.)
+    assert np.allclose(rotations.mat2quat_fast(mats[10]), res[10])
+    assert np.all(res[:, 0] >= 0)
+
+
+class RecordingViewer(object):
+    def __init__(self):
+        import threading
+        self._gui_lock = threading.Lock()
+        self._markers = []
+
+    def add_marker(self, **kwargs):
+        self._markers.append(kwargs)
+
+
+def test_marker_manager():
+    markers = tf.MarkerManager()
+    markers.pose(np.r_[0., 0., 1., 1., 0., 0., 0.], key='a')
+    assert not markers.enabled
+    markers.viewer = RecordingViewer()
+    markers.flush()
+    assert markers.viewer._markers == []
+
+    pose = _random_poses(np.random.RandomState(0), ())
+    reference = RecordingViewer()
+    tf.render_pose(pose, reference, label='a', size=0.3, unique_label=True)
+
+    markers.pose(np.zeros(7), key='a')
+    markers.pose(pose, key='a', label='a', size=0.3)
+    markers.pose(np.zeros(3))
+    markers.flush()
+    assert len(markers.viewer._markers) == 4
+    for m, ref in zip(markers.viewer._markers, reference._markers):
+        assert m['label'] == ref['label'] and m['dataid'] == ref['dataid']
+        assert np.allclose(m['mat'], ref['mat']) and np.allclose(m['size'], ref['size'])
+
+    # markers without a key are only drawn once
+    markers.viewer._markers = []
+    markers.flush()
+    assert len(markers.viewer._markers) == 3
+
+
+def test_markers_cleared_on_reset():
+    from gym.envs.robotics.robot_env import RobotEnv
+
+    class StubRobotEnv(RobotEnv):
+        def __init__(self):
+            self.markers = tf.MarkerManager()
+            self.markers.viewer = RecordingViewer()
+
+        def _reset_sim(self):
+            return True
+
+        def _sample_goal(self):
+            return np.zeros(3)
+
+        def _get_obs(self):
+            return dict()
+
+    env = StubRobotEnv()
+    env.markers.pose(np.zeros(7), key='grasp_center')
+    env.markers.box(bounds=np.zeros((3, 2)), key='arm_bounds')
+    env.reset()
+    env.markers.flush()
+    assert env.markers.viewer._markers == []
+
+
+@pytest.mark.parametrize('module', ['gym.utils.transformations', 'gym.agents.yumi'])
+def test_import_in_fresh_interpreter(module):
+    # gym.utils.transformations imports gym.envs.robotics, whose envs use MarkerManager
+    result = subprocess.run([sys.executable, '-c', 'import ' + module], stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,186 @@
+"""Columnar, memory-mapped storage of trajectories.
+
+A store is a directory with one append-only binary column file per leaf of the observation
+and action space trees (e.g. 'obs/desired_goal' for a Dict observation space), a reward
+column and an episode index. Each episode of length T takes T + 1 consecutive rows of every
+column: observations o_0 ... o_T, and actions and rewards a_0 ... a_{T-1} followed by a
+padding row. The index holds the start/end rows of each episode, its seed, the id of the
+env spec and whether it was successful.
+
+Readers map the columns with np.memmap, so slicing an episode is zero-copy and sampling
+minibatches only reads the sampled rows, also for stores much larger than the memory.
+"""
+import json
+import os
+
+import numpy as np
+
+from gym import error, spaces
+
+
+_META_FILE = 'meta.json'
+_INDEX_FILE = 'episodes.bin'
+
+INDEX_DTYPE = np.dtype([('start', '<i8'), ('end', '<i8'), ('seed', '<i8'), ('success', '?'), ('env_id', 'S64')])
+
+
+def _space_leaves(space, prefix):
+    """Yields (name, space) for each leaf of a space tree."""
+    if isinstance(space, spaces.Dict):
+        for k, s in space.spaces.items():
+            yield from _space_leaves(s, f'{prefix}/{k}')
+    elif isinstance(space, spaces.Tuple):
+        for i, s in enumerate(space.spaces):
+            yield from _space_leaves(s, f'{prefix}/{i}')
+    else:
+        yield prefix, space
+
+
+def _value_leaves(value, prefix):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            yield from _value_leaves(v, f'{prefix}/{k}')
+    elif isinstance(value, tuple):
+        for i, v in enumerate(value):
+            yield from _value_leaves(v, f'{prefix}/{i}')
+    else:
+        yield prefix, value
+
+
+def _column_path(path, name):
+    return os.path.join(path, name.replace('/', '.') + '.bin')
+
+
+class TrajectoryWriter(object):
+    """Appends episodes to a trajectory store, creating it if needed.
+
+    Column data is written before the index entry of an episode, so readers never see
+    partially written episodes, and leftovers of an interrupted write are truncated
+    when the store is opened again.
+    """
+
+    def __init__(self, path, observation_space, action_space):
+        self.path = path
+        columns = dict()
+        for prefix, space in (('obs', observation_space), ('action', action_space)):
+            for name, leaf in _space_leaves(space, prefix):
+                columns[name] = dict(dtype=np.dtype(leaf.dtype).str, shape=list(leaf.shape))
+        columns['reward'] = dict(dtype=np.dtype(np.float64).str, shape=[])
+        meta = dict(columns=columns)
+
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, _META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                if json.load(f) != meta:
+                    raise error.Error('Trajectory store {} has different spaces'.format(path))
+        else:
+            with open(meta_path, 'w') as f:
+                json.dump(meta, f)
+
+        self._columns = {name: (np.dtype(c['dtype']), tuple(c['shape'])) for name, c in columns.items()}
+        self._index_file = open(os.path.join(path, _INDEX_FILE), 'ab')
+        index_size = self._index_file.tell() - self._index_file.tell() % INDEX_DTYPE.itemsize
+        self._index_file.truncate(index_size)
+        self._n_episodes = index_size // INDEX_DTYPE.itemsize
+        self._n_rows = 0
+        if self._n_episodes > 0:
+            last = np.fromfile(os.path.join(path, _INDEX_FILE), dtype=INDEX_DTYPE, offset=index_size - INDEX_DTYPE.itemsize)
+            self._n_rows = int(last['end'][0])
+
+        self._files = dict()
+        for name, (dtype, shape) in self._columns.items():
+            f = open(_column_path(path, name), 'ab')
+            f.truncate(self._n_rows * dtype.itemsize * int(np.prod(shape)))
+            self._files[name] = f
+
+    def __len__(self):
+        return self._n_episodes
+
+    def add_episode(self, observations, actions, rewards, *, seed=-1, env_id='', success=False):
+        """Appends an episode with T + 1 observations, and T actions and rewards."""
+        n_steps = len(actions)
+        if len(observations) != n_steps + 1 or len(rewards) != n_steps:
+            raise error.Error('An episode must contain one more observation than actions and rewards')
+
+        rows = {name: np.zeros((n_steps + 1,) + shape, dtype=dtype) for name, (dtype, shape) in self._columns.items()}
+        for t, obs in enumerate(observations):
+            for name, value in _value_leaves(obs, 'obs'):
+                rows[name][t] = value
+        for t, action in enumerate(actions):
+            for name, value in _value_leaves(action, 'action'):
+                rows[name][t] = value
+        rows['reward'][:n_steps] = rewards
+
+        for name, f in self._files.items():
+            f.write(rows[name].tobytes())
+            f.flush()
+
+        entry = np.zeros(1, dtype=INDEX_DTYPE)
+        entry['start'] = self._n_rows
+        entry['end'] = self._n_rows + n_steps + 1
+        entry['seed'] = seed
+        entry['success'] = success
+        entry['env_id'] = env_id.encode()
+        self._index_file.write(entry.tobytes())
+        self._index_file.flush()
+
+        self._n_rows += n_steps + 1
+        self._n_episodes += 1
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TrajectoryReader(object):
+    """Memory-mapped view of the episodes of a trajectory store at the time it is opened."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, _META_FILE), 'r') as f:
+            meta = json.load(f)
+
+        index_path = os.path.join(path, _INDEX_FILE)
+        n_episodes = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+        self.episodes = np.fromfile(index_path, dtype=INDEX_DTYPE, count=n_episodes)
+        self.n_rows = int(self.episodes['end'][-1]) if n_episodes > 0 else 0
+
+        self.columns = dict()
+        for name, c in meta['columns'].items():
+            dtype, shape = np.dtype(c['dtype']), tuple(c['shape'])
+            if self.n_rows == 0:
+                self.columns[name] = np.zeros((0,) + shape, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(_column_path(path, name), dtype=dtype, mode='r',
+                                               shape=(self.n_rows,) + shape)
+
+    def __len__(self):
+        return len(self.episodes)
+
+    def episode(self, i) -> dict:
+        """Returns zero-copy slices of all the columns of episode `i`."""
+        start, end = self.episodes['start'][i], self.episodes['end'][i]
+        return {name: col[start:end] for name, col in self.columns.items()}
+
+    def sample(self, batch_size, np_random=np.random) -> dict:
+        """Samples transitions uniformly. Returns the columns at the sampled rows, and the
+        observations at the following rows with a 'next_' prefix."""
+        # all rows except the last one of each episode are transitions
+        lengths = self.episodes['end'] - self.episodes['start'] - 1
+        ends = np.cumsum(lengths)
+        flat = np_random.randint(0, ends[-1], size=batch_size)
+        ep_idx = np.searchsorted(ends, flat, side='right')
+        rows = self.episodes['start'][ep_idx] + flat - (ends[ep_idx] - lengths[ep_idx])
+        batch = {name: col[rows] for name, col in self.columns.items()}
+        for name, col in self.columns.items():
+            if name.startswith('obs'):
+                batch['next_' + name] = col[rows + 1]
+        return batch
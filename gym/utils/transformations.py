@@ -6,35 +6,95 @@ from mujoco_py import const as mj_const
 from gym.envs.robotics import rotations
 
 
-def quat_angle_diff(quat_a, quat_b):
-    quat_diff = rotations.quat_mul(quat_a, rotations.quat_conjugate(quat_b))
-    angle_diff = 2 * np.arccos(np.clip(quat_diff[..., 0], -1., 1.))
-    return np.abs(rotations.normalize_angles(angle_diff))
-
-
-def pose_to_mat(pose: np.ndarray) -> np.ndarray:
-    rot_mat = rotations.quat2mat(pose[..., 3:])
-    mat = np.zeros(pose.shape[:-1] + (4, 4))
-    mat[..., :3, :3] = rot_mat
-    mat[..., :3, 3] = pose[..., :3]
-    mat[..., 3, 3] = 1.0
-    return mat
-
-
-def mat_to_pose(mat: np.ndarray) -> np.ndarray:
-    rot_mat = mat[..., :3, :3]
-    quat = rotations.mat2quat(rot_mat)
-    pos = mat[..., :3, 3]
-    return np.concatenate([pos, quat], axis=-1)
-
-
-def get_tf(world_to_b: np.ndarray, world_to_a: np.ndarray) -> np.ndarray:
-    """Returns a_to_b pose"""
+def _batch_shape(*arrays):
+    return np.broadcast(*[a[..., 0] for a in arrays]).shape
+
+
+def _quat_mul_into(q0, q1, out):
+    # all components are computed before writing, so `out` may alias the inputs
+    w0, x0, y0, z0 = q0[..., 0], q0[..., 1], q0[..., 2], q0[..., 3]
+    w1, x1, y1, z1 = q1[..., 0], q1[..., 1], q1[..., 2], q1[..., 3]
+    w = w0 * w1 - x0 * x1 - y0 * y1 - z0 * z1
+    x = w0 * x1 + x0 * w1 + y0 * z1 - z0 * y1
+    y = w0 * y1 + y0 * w1 + z0 * x1 - x0 * z1
+    z = w0 * z1 + z0 * w1 + x0 * y1 - y0 * x1
+    out[..., 0] = w
+    out[..., 1] = x
+    out[..., 2] = y
+    out[..., 3] = z
+    return out
+
+
+def _quat_rot_vec_into(q, v, out, conjugate=False):
+    # Equivalent to q * (0, v) * q^-1 scaled by |q|^2, i.e. the same as rotations.quat_rot_vec:
+    # v' = |q|^2 v + w t + u x t, with t = 2 u x v
+    w, ux, uy, uz = q[..., 0], q[..., 1], q[..., 2], q[..., 3]
+    if conjugate:
+        ux, uy, uz = -ux, -uy, -uz
+    vx, vy, vz = v[..., 0], v[..., 1], v[..., 2]
+    n = w * w + ux * ux + uy * uy + uz * uz
+    tx = 2.0 * (uy * vz - uz * vy)
+    ty = 2.0 * (uz * vx - ux * vz)
+    tz = 2.0 * (ux * vy - uy * vx)
+    rx = n * vx + w * tx + (uy * tz - uz * ty)
+    ry = n * vy + w * ty + (uz * tx - ux * tz)
+    rz = n * vz + w * tz + (ux * ty - uy * tx)
+    out[..., 0] = rx
+    out[..., 1] = ry
+    out[..., 2] = rz
+    return out
+
+
+def quat_angle_diff(quat_a, quat_b, out=None):
+    """Returns the absolute angle (in [0, pi]) of the rotation between quat_a and quat_b.
+    Both arguments can be batches of quaternions with broadcastable leading axes."""
+    quat_a = np.asarray(quat_a)
+    quat_b = np.asarray(quat_b)
+    # w component of quat_a * conj(quat_b)
+    w = (quat_a[..., 0] * quat_b[..., 0] + quat_a[..., 1] * quat_b[..., 1] +
+         quat_a[..., 2] * quat_b[..., 2] + quat_a[..., 3] * quat_b[..., 3])
+    # 2 * arccos(w) normalized to [-pi, pi] and taken in absolute value equals 2 * arccos(|w|)
+    w = np.abs(w, out=out)
+    w = np.clip(w, 0., 1., out=w if out is not None else None)
+    w = np.arccos(w, out=w if out is not None else None)
+    return np.multiply(w, 2., out=w if out is not None else None)
+
+
+def pose_to_mat(pose: np.ndarray, out: np.ndarray=None) -> np.ndarray:
+    pose = np.asarray(pose)
+    if out is None:
+        out = np.empty(pose.shape[:-1] + (4, 4))
+    out[..., :3, :3] = rotations.quat2mat(pose[..., 3:])
+    out[..., :3, 3] = pose[..., :3]
+    out[..., 3, :3] = 0.0
+    out[..., 3, 3] = 1.0
+    return out
+
+
+def mat_to_pose(mat: np.ndarray, out: np.ndarray=None) -> np.ndarray:
+    mat = np.asarray(mat)
+    if out is None:
+        out = np.empty(mat.shape[:-2] + (7,))
+    quat = rotations.mat2quat(mat[..., :3, :3])
+    out[..., :3] = mat[..., :3, 3]
+    out[..., 3:] = quat
+    return out
+
+
+def get_tf(world_to_b: np.ndarray, world_to_a: np.ndarray, out: np.ndarray=None) -> np.ndarray:
+    """Returns a_to_b pose. Both poses can be batches with broadcastable leading axes."""
+    world_to_b = np.asarray(world_to_b)
+    world_to_a = np.asarray(world_to_a)
+    if out is None:
+        out = np.empty(_batch_shape(world_to_b, world_to_a) + (7,))
+    q_a, q_b = world_to_a[..., 3:], world_to_b[..., 3:]
     pos_tf = world_to_b[..., :3] - world_to_a[..., :3]
-    q = rotations.quat_mul(rotations.quat_identity(), rotations.quat_conjugate(world_to_a[..., 3:]))
-    pos_tf = rotations.quat_rot_vec(q, pos_tf)
-    quat_tf = rotations.quat_mul(world_to_b[..., 3:], rotations.quat_conjugate(world_to_a[..., 3:]))
-    return np.concatenate([pos_tf, quat_tf], axis=-1)
+    # compute the rotation first, since `out` may alias world_to_b or world_to_a
+    quat_tf = np.empty(out.shape[:-1] + (4,))
+    _quat_mul_into(q_b, rotations.quat_conjugate(q_a), quat_tf)
+    _quat_rot_vec_into(q_a, pos_tf, out[..., :3], conjugate=True)
+    out[..., 3:] = quat_tf
+    return out
 
 
 def apply_tf_old(a_to_b: np.ndarray, world_to_a: np.ndarray) -> np.ndarray:
@@ -45,20 +105,33 @@ def apply_tf_old(a_to_b: np.ndarray, world_to_a: np.ndarray) -> np.ndarray:
     return mat_to_pose(world_to_b_mat)
 
 
-def apply_tf(a_to_b: np.ndarray, world_to_a: np.ndarray) -> np.ndarray:
-    """Returns world_to_b pose"""
-    pos_only = False
-    if world_to_a.size == 3:
-        world_to_a = np.r_[world_to_a, 1., 0., 0., 0.]
-        pos_only = True
-    if a_to_b.size == 3:
-        a_to_b = np.r_[a_to_b, 1., 0., 0., 0.]
-    new_pos = world_to_a[:3] + rotations.quat_rot_vec(world_to_a[3:], a_to_b[:3])
-    # new_quat = rotations.quat_mul(a_to_b[3:], world_to_a[3:])
-    new_quat = rotations.quat_mul(world_to_a[3:], a_to_b[3:])
+def apply_tf(a_to_b: np.ndarray, world_to_a: np.ndarray, out: np.ndarray=None) -> np.ndarray:
+    """Returns world_to_b pose.
+
+    Poses are (..., 7) arrays of position and quaternion, or (..., 3) arrays of positions only,
+    in which case the rotation is the identity. Leading axes are broadcast against each other.
+    If world_to_a contains positions only, only the position of world_to_b is returned.
+    """
+    a_to_b = np.asarray(a_to_b)
+    world_to_a = np.asarray(world_to_a)
+    pos_only = world_to_a.shape[-1] == 3
+    if out is None:
+        out = np.empty(_batch_shape(a_to_b, world_to_a) + ((3,) if pos_only else (7,)))
+
     if pos_only:
-        return new_pos
-    return np.concatenate([new_pos, new_quat], axis=-1)
+        np.add(world_to_a, a_to_b[..., :3], out=out[..., :3])
+        return out
+
+    q_a = world_to_a[..., 3:]
+    new_pos = np.empty(out.shape[:-1] + (3,))
+    _quat_rot_vec_into(q_a, a_to_b[..., :3], new_pos)
+    new_pos += world_to_a[..., :3]
+    if a_to_b.shape[-1] == 3:
+        out[..., 3:] = q_a
+    else:
+        _quat_mul_into(q_a, a_to_b[..., 3:], out[..., 3:])
+    out[..., :3] = new_pos
+    return out
 
 
 def render_pose(pose: np.ndarray, viewer, label="", size=0.2, unique_id=None, unique_label=False):
@@ -139,6 +212,128 @@ def render_box(viewer, bounds: np.ndarray=None, pose: np.ndarray=None, size: np.
     )
 
 
+# rotations from the frame of a pose to the frames of its x, y and z arrow markers
+_AXIS_QUATS = rotations.euler2quat(np.array([[0., np.pi/2, 0.], [np.pi/2, np.pi/1, 0.], [0., 0., 0.]]))
+_AXIS_RGBAS = np.array([[1., 0., 0., 1.], [0., 1., 0., 1.], [0., 0., 1., 1.]])
+
+
+class MarkerManager(object):
+    """Debug markers (poses and boxes) of an on-screen viewer.
+
+    Markers with a key replace the previous marker with the same key and are drawn in every
+    frame until they are removed or the env is reset; markers without a key are drawn in the next
+    frame only.
+    Updates are only recorded, and the marker geometry is computed once per frame in `flush`,
+    which the env calls before rendering. While `viewer` is None, i.e. nothing is rendered
+    on-screen, all the methods return immediately, so control loops can call them
+    unconditionally. Callers computing poses only to draw them can check `enabled` first.
+    """
+
+    def __init__(self):
+        self.viewer = None
+        self._markers = dict()
+        self._transient = []
+        self._colors = dict()
+
+    @property
+    def enabled(self):
+        return self.viewer is not None
+
+    def pose(self, pose: np.ndarray, key=None, label="", size=0.2):
+        """Draws a 7D pose, a 6D position + euler angles pose, or a 3D position as a sphere."""
+        if self.viewer is None:
+            return
+        marker = ('pose', np.array(pose, dtype=np.float64), label, size)
+        if key is None:
+            self._transient.append(marker)
+        else:
+            self._markers[key] = marker
+
+    def box(self, bounds: np.ndarray=None, pose: np.ndarray=None, size: np.ndarray=None, key=None, label="",
+            opacity=0.2):
+        """Draws a box given by its (3, 2) bounds, or by its pose and half sizes."""
+        if self.viewer is None:
+            return
+        if bounds is not None:
+            assert size is None
+            assert bounds.shape == (3, 2)
+            pose = bounds.mean(axis=1)
+            size = np.abs(bounds[:, 1] - bounds[:, 0]) / 2.0
+        else:
+            assert pose is not None
+            assert size is not None
+        marker = ('box', np.array(pose, dtype=np.float64), label, (np.array(size, dtype=np.float64), opacity))
+        if key is None:
+            self._transient.append(marker)
+        else:
+            self._markers[key] = marker
+
+    def remove(self, key):
+        self._markers.pop(key, None)
+
+    def clear(self):
+        self._markers.clear()
+        self._transient = []
+
+    def flush(self, keep_transient=False):
+        """Adds the markers to the viewer for the next frame. Markers without a key are
+        dropped afterwards, unless `keep_transient` is True."""
+        if self.viewer is None:
+            return
+        for key, marker in self._markers.items():
+            self._add_marker(marker, key)
+        for marker in self._transient:
+            self._add_marker(marker, None)
+        if not keep_transient:
+            self._transient = []
+
+    def _add_marker(self, marker, key):
+        kind, pose, label, extra = marker
+        pos = pose[:3]
+        extra_kwargs = dict()
+        if key is not None:
+            extra_kwargs['dataid'] = hash(key) % np.iinfo(np.int32).max
+
+        if kind == 'box':
+            size, opacity = extra
+            if pose.size == 6:
+                mat = rotations.euler2mat(pose[3:])
+            elif pose.size == 7:
+                mat = rotations.quat2mat(pose[3:])
+            else:
+                mat = np.eye(3)
+            self.viewer.add_marker(
+                pos=pos, mat=mat.flatten(), label=label, type=mj_const.GEOM_BOX, size=size,
+                rgba=np.r_[1., 0., 0., opacity], specular=0., **extra_kwargs
+            )
+            return
+
+        if pose.size == 6:
+            quat = rotations.euler2quat(pose[3:])
+        elif pose.size == 7:
+            quat = pose[3:]
+        else:
+            rgba = self._colors.get(key) if key is not None else None
+            if rgba is None:
+                rgba = np.r_[np.random.uniform(0.2, 1.0, 3), 1.]
+                if key is not None:
+                    self._colors[key] = rgba
+            self.viewer.add_marker(
+                pos=pos, label=label, type=mj_const.GEOM_SPHERE, size=np.ones(3)*0.01,
+                rgba=rgba, specular=0., **extra_kwargs
+            )
+            return
+
+        axis_quats = np.empty((3, 4))
+        _quat_mul_into(quat, _AXIS_QUATS, axis_quats)
+        axis_mats = rotations.quat2mat(axis_quats).reshape(3, 9)
+        for i in range(3):
+            self.viewer.add_marker(
+                pos=pos, mat=axis_mats[i], label=(label if i == 0 else ""), type=mj_const.GEOM_ARROW,
+                size=np.r_[0.01, 0.01, extra], rgba=_AXIS_RGBAS[i], specular=0., **extra_kwargs
+            )
+
+
 class TFDebugger:
 
     i = 0
@@ -2,3 +2,4 @@ from gym import error
 from gym.wrappers.monitor import Monitor
 from gym.wrappers.time_limit import TimeLimit
 from gym.wrappers.dict import FlattenDictWrapper
+from gym.wrappers.profile import Profile
@@ -0,0 +1,207 @@
+"""Chunked storage of raw video frames, an alternative to encoding videos with ffmpeg.
+
+A frame store is a directory with the uint8 frames of many episodes appended to a single
+data file in chunks of up to `chunk_frames` frames, each optionally compressed with zlib.
+A chunk index holds the byte offset, size and first frame of each chunk, and an episode
+index the first frame, number of frames and id of each episode. Episodes always end with a
+chunk, so a store can be read while it is being written.
+
+Frames are read back as numpy arrays without video decoding: stores of uncompressed
+frames are memory-mapped and episodes are zero-copy slices, compressed chunks are
+decompressed with zlib.
+"""
+import json
+import os
+import zlib
+
+import numpy as np
+
+from gym import error
+
+
+_META_FILE = 'meta.json'
+_FRAMES_FILE = 'frames.bin'
+_CHUNKS_FILE = 'chunks.bin'
+_EPISODES_FILE = 'episodes.bin'
+
+CHUNK_DTYPE = np.dtype([('offset', '<i8'), ('nbytes', '<i8'), ('first_frame', '<i8'), ('n_frames', '<i8')])
+EPISODE_DTYPE = np.dtype([('first_frame', '<i8'), ('n_frames', '<i8'), ('episode_id', '<i8')])
+
+
+def _read_index(path, dtype):
+    n = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+    return np.fromfile(path, dtype=dtype, count=n) if n > 0 else np.zeros(0, dtype=dtype)
+
+
+class FrameWriter(object):
+    """Appends the frames of episodes to a frame store, creating it if needed.
+
+    The frame shape is taken from the first frame. Frame data is written before the index
+    entries referring to it, and leftovers of an interrupted write are truncated when the
+    store is opened again.
+    """
+
+    def __init__(self, path, chunk_frames=64, compress=False, level=1):
+        """
+        Args:
+            path (str): directory of the store.
+            chunk_frames (int): maximum number of frames of a chunk.
+            compress (bool): whether to compress the chunks with zlib, at the given `level`.
+        """
+        if chunk_frames < 1:
+            raise error.Error('chunk_frames must be positive, got {}'.format(chunk_frames))
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.compress = compress
+        self.level = level
+        self.frame_shape = None
+        os.makedirs(path, exist_ok=True)
+
+        meta_path = os.path.join(path, _META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            self.frame_shape = tuple(meta['frame_shape'])
+            self.compress = meta['compress']
+
+        chunks, self._chunks_file = self._open_index(_CHUNKS_FILE, CHUNK_DTYPE)
+        episodes, self._episodes_file = self._open_index(_EPISODES_FILE, EPISODE_DTYPE)
+        self._n_episodes = len(episodes)
+        # frames of chunks after the last episode belong to an interrupted episode
+        self._n_frames = int(episodes['first_frame'][-1] + episodes['n_frames'][-1]) if len(episodes) > 0 else 0
+        chunks = chunks[chunks['first_frame'] < self._n_frames]
+        self._chunks_file.truncate(len(chunks) * CHUNK_DTYPE.itemsize)
+        self._frames_file = open(os.path.join(path, _FRAMES_FILE), 'ab')
+        self._frames_file.truncate(int(chunks['offset'][-1] + chunks['nbytes'][-1]) if len(chunks) > 0 else 0)
+        # the position is not moved by truncate, and is used as the offset of the next chunk
+        self._frames_file.seek(0, os.SEEK_END)
+
+        self._buffer = None
+        self._n_buffered = 0
+        self._episode_start = self._n_frames
+
+    def _open_index(self, name, dtype):
+        path = os.path.join(self.path, name)
+        index = _read_index(path, dtype)
+        f = open(path, 'ab')
+        f.truncate(len(index) * dtype.itemsize)
+        return index, f
+
+    def __len__(self):
+        return self._n_episodes
+
+    def add_frame(self, frame):
+        if self.frame_shape is None:
+            self.frame_shape = tuple(frame.shape)
+            with open(os.path.join(self.path, _META_FILE), 'w') as f:
+                json.dump(dict(frame_shape=list(self.frame_shape), compress=self.compress), f)
+        elif tuple(frame.shape) != self.frame_shape:
+            raise error.InvalidFrame('Your frame has shape {}, but the frame store {} has shape {}'.format(
+                frame.shape, self.path, self.frame_shape))
+        if self._buffer is None:
+            self._buffer = np.empty((self.chunk_frames,) + self.frame_shape, dtype=np.uint8)
+
+        self._buffer[self._n_buffered] = frame
+        self._n_buffered += 1
+        if self._n_buffered == self.chunk_frames:
+            self._write_chunk()
+
+    def _write_chunk(self):
+        if self._n_buffered == 0:
+            return
+        data = self._buffer[:self._n_buffered]
+        data = zlib.compress(data, self.level) if self.compress else data.data.cast('B')
+        entry = np.zeros(1, dtype=CHUNK_DTYPE)
+        entry['offset'] = self._frames_file.tell()
+        entry['nbytes'] = len(data)
+        entry['first_frame'] = self._n_frames
+        entry['n_frames'] = self._n_buffered
+        self._frames_file.write(data)
+        self._chunks_file.write(entry.tobytes())
+        self._n_frames += self._n_buffered
+        self._n_buffered = 0
+
+    def end_episode(self, episode_id=-1) -> int:
+        """Writes the remaining frames of the current episode and its index entry, and returns
+        the index of the episode in the store."""
+        self._write_chunk()
+        self._frames_file.flush()
+        self._chunks_file.flush()
+
+        entry = np.zeros(1, dtype=EPISODE_DTYPE)
+        entry['first_frame'] = self._episode_start
+        entry['n_frames'] = self._n_frames - self._episode_start
+        entry['episode_id'] = episode_id
+        self._episodes_file.write(entry.tobytes())
+        self._episodes_file.flush()
+
+        self._episode_start = self._n_frames
+        self._n_episodes += 1
+        return self._n_episodes - 1
+
+    def close(self):
+        """Closes the store, dropping the frames of an unfinished episode."""
+        self._frames_file.close()
+        self._chunks_file.close()
+        self._episodes_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FrameReader(object):
+    """View of the episodes of a frame store at the time it is opened."""
+
+    def __init__(self, path):
+        self.path = path
+        self.episodes = _read_index(os.path.join(path, _EPISODES_FILE), EPISODE_DTYPE)
+        self.chunks = _read_index(os.path.join(path, _CHUNKS_FILE), CHUNK_DTYPE)
+        self.frame_shape = None
+        self.compress = False
+        self._frames = None
+
+        n_frames = int(self.episodes['first_frame'][-1] + self.episodes['n_frames'][-1]) if len(self.episodes) > 0 else 0
+        if n_frames == 0:
+            return
+        with open(os.path.join(path, _META_FILE), 'r') as f:
+            meta = json.load(f)
+        self.frame_shape = tuple(meta['frame_shape'])
+        self.compress = meta['compress']
+        if not self.compress:
+            # uncompressed chunks are contiguous, so the data file is an array of frames
+            self._frames = np.memmap(os.path.join(path, _FRAMES_FILE), dtype=np.uint8, mode='r',
+                                     shape=(n_frames,) + self.frame_shape)
+
+    def __len__(self):
+        return len(self.episodes)
+
+    @property
+    def episode_ids(self) -> np.ndarray:
+        return self.episodes['episode_id']
+
+    def frames(self, start, stop) -> np.ndarray:
+        """Returns frames [start, stop) of the store, a zero-copy view if it is not compressed."""
+        if self._frames is not None:
+            return self._frames[start:stop]
+        if start >= stop:
+            return np.zeros((0,) + (self.frame_shape or ()), dtype=np.uint8)
+
+        first = np.searchsorted(self.chunks['first_frame'], start, side='right') - 1
+        last = np.searchsorted(self.chunks['first_frame'], stop, side='left')
+        out = np.empty((stop - start,) + self.frame_shape, dtype=np.uint8)
+        with open(os.path.join(self.path, _FRAMES_FILE), 'rb') as f:
+            for c in self.chunks[first:last]:
+                f.seek(c['offset'])
+                data = np.frombuffer(zlib.decompress(f.read(c['nbytes'])), dtype=np.uint8)
+                data = data.reshape((c['n_frames'],) + self.frame_shape)
+                lo, hi = max(start, c['first_frame']), min(stop, c['first_frame'] + c['n_frames'])
+                out[lo - start:hi - start] = data[lo - c['first_frame']:hi - c['first_frame']]
+        return out
+
+    def episode(self, i) -> np.ndarray:
+        """Returns the frames of episode `i`, as an array of shape (n_frames, h, w, channels)."""
+        start = int(self.episodes['first_frame'][i])
+        return self.frames(start, start + int(self.episodes['n_frames'][i]))
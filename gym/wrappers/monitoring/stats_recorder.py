@@ -2,23 +2,118 @@ import json
 import os
 import time
 
+import numpy as np
+
 from gym import error
 from gym.utils import atomic_write
 from gym.utils.json_utils import json_encode_np
 
+
+def _log_path(path):
+    return path + 'l'
+
+
+def load_stats(path):
+    """Returns the contents of a stats file written by StatsRecorder: the JSON snapshot at
+    `path` (if any) followed by the episodes appended to its log since the snapshot."""
+    content = {
+        'initial_reset_timestamp': None,
+        'timestamps': [],
+        'episode_lengths': [],
+        'episode_rewards': [],
+        'episode_types': [],
+    }
+    log_offset = 0
+    if os.path.exists(path):
+        with open(path) as f:
+            content.update(json.load(f))
+        log_offset = content.pop('log_offset', 0)
+
+    log_path = _log_path(path)
+    if os.path.exists(log_path):
+        with open(log_path, 'rb') as f:
+            f.seek(log_offset)
+            for line in f:
+                record = _parse_line(line)
+                if record is None:
+                    break
+                if 'initial_reset_timestamp' in record:
+                    content['initial_reset_timestamp'] = record['initial_reset_timestamp']
+                    continue
+                content['timestamps'].append(record['timestamp'])
+                content['episode_lengths'].append(record['episode_length'])
+                content['episode_rewards'].append(record['episode_reward'])
+                content['episode_types'].append(record['episode_type'])
+    return content
+
+
+def open_stats(path):
+    """Returns the initial reset timestamp of a stats file and an iterator over its episodes,
+    as (timestamp, episode_length, episode_reward, episode_type) in the order they were recorded.
+
+    The log of a StatsRecorder holds all its episodes, so it is read lazily line by line and
+    memory does not grow with the number of episodes; files without a log (e.g. written by
+    older versions) are loaded with `load_stats`.
+    """
+    log_path = _log_path(path)
+    if not os.path.exists(log_path):
+        content = load_stats(path)
+        types = content.get('episode_types') or [None] * len(content['timestamps'])
+        records = zip(content['timestamps'], content['episode_lengths'], content['episode_rewards'], types)
+        return content['initial_reset_timestamp'], iter(records)
+
+    f = open(log_path, 'rb')
+    header = _parse_line(f.readline())
+    if header is None or 'initial_reset_timestamp' not in header:
+        f.close()
+        return None, iter(())
+    return header['initial_reset_timestamp'], _iter_log(f)
+
+
+def _parse_line(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None  # partially written last line
+
+
+def _iter_log(f):
+    with f:
+        for line in f:
+            record = _parse_line(line)
+            if record is None:
+                break
+            if 'initial_reset_timestamp' in record:
+                continue
+            yield record['timestamp'], record['episode_length'], record['episode_reward'], record['episode_type']
+
+
 class StatsRecorder(object):
-    def __init__(self, directory, file_prefix, autoreset=False, env_id=None):
+    """Records the stats of the episodes of a monitored env.
+
+    Completed episodes are appended to a JSON lines log (`path` + 'l') on each flush, so that
+    flushing costs O(1) per new episode. The log is periodically compacted into the JSON
+    document at `path`, which holds all the episodes up to a byte offset of the log: whenever
+    the log holds at least as many new episodes as the snapshot (and at least
+    `compact_min_episodes`), and on close. Use `load_stats` to read both.
+
+    The log is never truncated, so each episode is stored twice on disk (about 100 bytes in
+    the log and 35 in the snapshot). The snapshot keeps the stats readable as a JSON document,
+    as written by older versions, while `open_stats` (and so the merge of the stats files of a
+    Monitor) streams the episodes from the beginning of the log instead: a JSON document can
+    only be loaded whole, with memory growing with the number of episodes.
+    """
+
+    def __init__(self, directory, file_prefix, autoreset=False, env_id=None, compact_min_episodes=1000):
         self.autoreset = autoreset
         self.env_id = env_id
 
         self.initial_reset_timestamp = None
         self.directory = directory
         self.file_prefix = file_prefix
-        self.episode_lengths = []
-        self.episode_rewards = []
+        self._init_episode_stats()
         self.episode_types = [] # experimental addition
         self._type = 't'
-        self.timestamps = []
         self.steps = None
         self.total_steps = 0
         self.rewards = None
@@ -29,6 +124,17 @@ class StatsRecorder(object):
         filename = '{}.stats.json'.format(self.file_prefix)
         self.path = os.path.join(self.directory, filename)
 
+        self.compact_min_episodes = compact_min_episodes
+        self._log = None
+        self._n_logged = 0  # episodes in the log
+        self._n_compacted = 0  # episodes in the snapshot
+        self._logged_initial_reset = False
+
+    def _init_episode_stats(self):
+        self.episode_lengths = []
+        self.episode_rewards = []
+        self.timestamps = []
+
     @property
     def type(self):
         return self._type
@@ -87,17 +193,96 @@ class StatsRecorder(object):
 
     def close(self):
         self.flush()
+        self.compact()
+        if self._log is not None:
+            self._log.close()
+            self._log = None
         self.closed = True
 
     def flush(self):
         if self.closed:
             return
 
+        lines = []
+        if not self._logged_initial_reset and self.initial_reset_timestamp is not None:
+            lines.append(json.dumps({'initial_reset_timestamp': self.initial_reset_timestamp}))
+            self._logged_initial_reset = True
+        for i in range(self._n_logged, len(self.timestamps)):
+            lines.append(json.dumps({
+                'timestamp': self.timestamps[i],
+                'episode_length': self.episode_lengths[i],
+                'episode_reward': self.episode_rewards[i],
+                'episode_type': self.episode_types[i],
+            }, default=json_encode_np))
+        self._n_logged = len(self.timestamps)
+
+        if lines:
+            if self._log is None:
+                self._log = open(_log_path(self.path), 'a')
+            self._log.write('\n'.join(lines) + '\n')
+            self._log.flush()
+
+        n_new = self._n_logged - self._n_compacted
+        if not os.path.exists(self.path) or n_new >= max(self.compact_min_episodes, self._n_compacted):
+            self.compact()
+
+    def compact(self):
+        """Writes all the logged episodes to the JSON snapshot. The log is kept whole, since
+        `open_stats` streams it from its beginning."""
+        if self.closed:
+            return
+        log_path = _log_path(self.path)
+        log_offset = os.path.getsize(log_path) if os.path.exists(log_path) else 0
         with atomic_write.atomic_write(self.path) as f:
             json.dump({
                 'initial_reset_timestamp': self.initial_reset_timestamp,
-                'timestamps': self.timestamps,
-                'episode_lengths': self.episode_lengths,
-                'episode_rewards': self.episode_rewards,
-                'episode_types': self.episode_types,
+                'timestamps': self.timestamps[:self._n_logged],
+                'episode_lengths': self.episode_lengths[:self._n_logged],
+                'episode_rewards': self.episode_rewards[:self._n_logged],
+                'episode_types': self.episode_types[:self._n_logged],
+                'log_offset': log_offset,
             }, f, default=json_encode_np)
+        self._n_compacted = self._n_logged
+
+
+class ArrayStatsRecorder(StatsRecorder):
+    """StatsRecorder keeping the lengths, rewards and timestamps of the episodes in preallocated
+    numpy arrays, doubled in size when full, instead of lists of Python objects.
+
+    `episode_lengths`, `episode_rewards` and `timestamps` are views of the recorded episodes.
+    """
+
+    def __init__(self, directory, file_prefix, capacity=1024, **kwargs):
+        self.capacity = capacity
+        super(ArrayStatsRecorder, self).__init__(directory, file_prefix, **kwargs)
+
+    def _init_episode_stats(self):
+        self._n_episodes = 0
+        self._lengths = np.zeros(max(1, self.capacity), dtype=np.int64)
+        self._rewards = np.zeros(max(1, self.capacity), dtype=np.float64)
+        self._timestamps = np.zeros(max(1, self.capacity), dtype=np.float64)
+
+    @property
+    def episode_lengths(self) -> np.ndarray:
+        return self._lengths[:self._n_episodes]
+
+    @property
+    def episode_rewards(self) -> np.ndarray:
+        return self._rewards[:self._n_episodes]
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self._timestamps[:self._n_episodes]
+
+    def save_complete(self):
+        if self.steps is None:
+            return
+        n = self._n_episodes
+        if n == len(self._lengths):
+            self._lengths = np.concatenate([self._lengths, np.zeros_like(self._lengths)])
+            self._rewards = np.concatenate([self._rewards, np.zeros_like(self._rewards)])
+            self._timestamps = np.concatenate([self._timestamps, np.zeros_like(self._timestamps)])
+        self._lengths[n] = self.steps
+        self._rewards[n] = self.rewards
+        self._timestamps[n] = time.time()
+        self._n_episodes = n + 1
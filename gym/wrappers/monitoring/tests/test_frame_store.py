@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import pytest
+
+import gym
+from gym import spaces
+from gym.wrappers import Monitor
+from gym.wrappers.monitoring import frame_store
+from gym.wrappers.monitoring.tests import helpers
+
+
+class RgbArrayEnv(gym.Env):
+    metadata = {'render.modes': ['rgb_array']}
+    observation_space = spaces.Discrete(1)
+    action_space = spaces.Discrete(1)
+
+    def __init__(self):
+        self.t = 0
+
+    def reset(self):
+        self.t = 0
+        return 0
+
+    def step(self, action):
+        self.t += 1
+        return 0, 1.0, self.t == 5, {}
+
+    def render(self, mode='rgb_array'):
+        return np.full((8, 12, 3), self.t, dtype=np.uint8)
+
+
+def _frames(n, start=0):
+    return [np.full((4, 6, 3), start + i, dtype=np.uint8) for i in range(n)]
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_frame_store(compress):
+    with helpers.tempdir() as temp:
+        path = os.path.join(temp, 'frames')
+        with frame_store.FrameWriter(path, chunk_frames=4, compress=compress) as writer:
+            for f in _frames(10):
+                writer.add_frame(f)
+            assert writer.end_episode(7) == 0
+            # frames readable before the writer is closed
+            assert len(frame_store.FrameReader(path)) == 1
+            for f in _frames(3, start=10):
+                writer.add_frame(f)
+            assert writer.end_episode(8) == 1
+            # unfinished episodes are dropped, also their chunks already written
+            for f in _frames(5):
+                writer.add_frame(f)
+
+        with frame_store.FrameWriter(path, chunk_frames=4) as writer:
+            assert len(writer) == 2
+            for f in _frames(2, start=13):
+                writer.add_frame(f)
+            writer.end_episode(9)
+
+        reader = frame_store.FrameReader(path)
+        assert reader.episode_ids.tolist() == [7, 8, 9]
+        assert reader.compress == compress
+        assert np.array_equal(reader.episode(0), np.array(_frames(10)))
+        assert np.array_equal(reader.episode(1), np.array(_frames(3, start=10)))
+        assert np.array_equal(reader.episode(2), np.array(_frames(2, start=13)))
+        assert np.array_equal(reader.frames(3, 13), np.array(_frames(10, start=3)))
+
+
+def test_monitor_raw_video():
+    with helpers.tempdir() as temp:
+        env = Monitor(RgbArrayEnv(), temp, video_callable=lambda episode_id: episode_id != 1,
+                      raw_video=dict(compress=True))
+        for _ in range(3):
+            env.reset()
+            done = False
+            while not done:
+                _, _, done, _ = env.step(0)
+        env.close()
+
+        assert len(env.videos) == 2
+        reader = frame_store.FrameReader(env.videos[0][0])
+        assert reader.episode_ids.tolist() == [0, 2]
+        assert reader.episode(1)[:, 0, 0, 0].tolist() == [0, 1, 2, 3, 4, 5]
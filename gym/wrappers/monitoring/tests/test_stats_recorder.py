@@ -0,0 +1,108 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import gym
+from gym import error
+from gym.wrappers import Monitor, monitor
+from gym.wrappers.monitor import load_results
+from gym.wrappers.monitoring import stats_recorder
+from gym.wrappers.monitoring.tests import helpers
+
+
+def _run_episodes(env, n_episodes):
+    for _ in range(n_episodes):
+        env.reset()
+        done = False
+        while not done:
+            _, _, done, _ = env.step(env.action_space.sample())
+
+
+def test_append_only_stats():
+    with helpers.tempdir() as temp:
+        env = Monitor(gym.make('CartPole-v0'), temp, video_callable=False, write_upon_reset=True)
+        env.stats_recorder.compact_min_episodes = 4
+        env.seed(0)
+        _run_episodes(env, 10)
+
+        # episodes are readable while running, from the snapshot and the log
+        results = load_results(temp)
+        assert results['episode_lengths'] == env.get_episode_lengths()[:9]
+        with open(env.stats_recorder.path) as f:
+            assert len(json.load(f)['timestamps']) < 9
+
+        env.close()
+        results = load_results(temp)
+        assert results['episode_lengths'] == env.get_episode_lengths()
+        assert results['episode_rewards'] == env.get_episode_rewards()
+        assert results['episode_types'] == ['t'] * 10
+        # the log still holds the compacted episodes, for open_stats to stream them
+        _, records = stats_recorder.open_stats(env.stats_recorder.path)
+        assert [length for _, length, _, _ in records] == env.get_episode_lengths()
+
+
+def test_load_partial_and_legacy_stats():
+    with helpers.tempdir() as temp:
+        path = os.path.join(temp, 'openaigym.episode_batch.0.1.stats.json')
+        with open(path, 'w') as f:
+            json.dump(dict(initial_reset_timestamp=1.0, timestamps=[2.0], episode_lengths=[10],
+                           episode_rewards=[10.0], episode_types=['t']), f)
+        assert stats_recorder.load_stats(path)['episode_lengths'] == [10]
+
+        with open(path + 'l', 'w') as f:
+            f.write(json.dumps(dict(timestamp=3.0, episode_length=5, episode_reward=5.0, episode_type='e')) + '\n')
+            f.write('{"timestamp": 4.0, "episo')
+        content = stats_recorder.load_stats(path)
+        assert content['episode_lengths'] == [10, 5]
+        assert content['episode_types'] == ['t', 'e']
+
+
+def test_merge_stats_files():
+    with helpers.tempdir() as temp:
+        paths = []
+        for i, timestamps in enumerate([[1.0, 4.0, 5.0], [], [2.0, 3.0, 6.0]]):
+            path = os.path.join(temp, f'openaigym.episode_batch.{i}.1.stats.json')
+            with open(path, 'w') as f:
+                json.dump(dict(initial_reset_timestamp=0.5 + i if timestamps else None, timestamps=timestamps,
+                               episode_lengths=[int(t) for t in timestamps],
+                               episode_rewards=[-t for t in timestamps], episode_types=['t'] * len(timestamps)), f)
+            paths.append(path)
+
+        data_sources, initial_reset_timestamps, timestamps, lengths, rewards, types, initial_reset_timestamp = \
+            monitor.merge_stats_files(paths)
+        assert timestamps == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+        assert data_sources == [0, 2, 2, 0, 0, 2]
+        assert lengths == [1, 2, 3, 4, 5, 6]
+        assert types == ['t'] * 6
+        assert initial_reset_timestamps == [0.5, 2.5]
+        assert initial_reset_timestamp == 0.5
+
+        columnar = monitor.merge_stats_files(paths, columnar=True)
+        assert columnar[2].dtype == np.float64
+        assert columnar[2].tolist() == timestamps
+        assert columnar[0].tolist() == data_sources
+        assert columnar[4].tolist() == rewards
+
+
+def test_fast_monitor():
+    results = []
+    for fast in (False, True):
+        with helpers.tempdir() as temp:
+            env = Monitor(gym.make('CartPole-v0'), temp, video_callable=False, fast=fast)
+            with pytest.raises(error.ResetNeeded):
+                env.step(0)
+            env.seed(0)
+            env.action_space.seed(0)
+            _run_episodes(env, 5)
+            with pytest.raises(error.ResetNeeded):
+                env.step(0)
+            env.reset()
+            env.step(0)
+            env.close()
+            results.append((list(env.get_episode_lengths()), list(env.get_episode_rewards()),
+                            env.get_total_steps(), load_results(temp)['episode_lengths']))
+
+    assert isinstance(env.stats_recorder, stats_recorder.ArrayStatsRecorder)
+    assert results[0] == results[1]
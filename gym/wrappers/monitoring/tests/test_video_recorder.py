@@ -3,6 +3,7 @@ import os
 import shutil
 import tempfile
 import numpy as np
+import pytest
 
 import gym
 from gym.wrappers.monitoring.video_recorder import VideoRecorder
@@ -13,6 +14,17 @@ class BrokenRecordableEnv(object):
     def render(self, mode=None):
         pass
 
+class RgbArrayEnv(object):
+    metadata = {'render.modes': ['rgb_array']}
+
+    def __init__(self):
+        self.frame = np.zeros((32, 48, 3), dtype=np.uint8)
+
+    def render(self, mode=None):
+        # the same buffer is returned for every frame
+        self.frame += 1
+        return self.frame
+
 class UnrecordableEnv(object):
     metadata = {'render.modes': [None]}
 
@@ -63,3 +75,18 @@ def test_text_envs():
         video.close()
     finally:
         os.remove(video.path)
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None and shutil.which('avconv') is None,
+                    reason='needs ffmpeg or avconv')
+def test_record_async():
+    env = RgbArrayEnv()
+    rec = VideoRecorder(env, queue_size=4)
+    for _ in range(20):
+        rec.capture_frame()
+    rec.close()
+    assert not rec.empty
+    assert not rec.broken
+    assert 'dropped_frames' not in rec.metadata
+    assert os.path.getsize(rec.path) > 100
+    os.remove(rec.path)
+    os.remove(rec.metadata_path)
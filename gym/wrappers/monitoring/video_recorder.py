@@ -2,9 +2,11 @@ import json
 import os
 import subprocess
 import tempfile
+import threading
 import os.path
-import distutils.spawn, distutils.version
+import distutils.spawn
 import numpy as np
+from six.moves import queue
 from six import StringIO
 import six
 from gym import error, logger
@@ -27,12 +29,23 @@ class VideoRecorder(object):
         base_path (Optional[str]): Alternatively, path to the video file without extension, which will be added.
         metadata (Optional[dict]): Contents to save to the metadata file.
         enabled (bool): Whether to actually record video, or just no-op (for convenience)
+        queue_size (int): If positive, frames are copied to a queue of this size and written to
+            the encoder by a background thread (see AsyncImageEncoder), instead of blocking
+            `capture_frame` while the encoder is busy.
+        drop_frames (bool): With a queue, drop the frames captured while it is full instead of
+            waiting for the encoder.
+        frame_writer (Optional[FrameWriter]): Frame store to append the raw frames to as an
+            episode, instead of encoding a video with ffmpeg (see frame_store). Only
+            `base_path` can be given, for the metadata file. Text-only envs ignore it.
     """
 
-    def __init__(self, env, path=None, metadata=None, enabled=True, base_path=None):
+    def __init__(self, env, path=None, metadata=None, enabled=True, base_path=None, queue_size=0, drop_frames=False,
+                 frame_writer=None):
         modes = env.metadata.get('render.modes', [])
         self._async = env.metadata.get('semantics.async')
         self.enabled = enabled
+        self.queue_size = queue_size
+        self.drop_frames = drop_frames
 
         # Don't bother setting anything else if not enabled
         if not self.enabled:
@@ -53,27 +66,37 @@ class VideoRecorder(object):
 
         self.last_frame = None
         self.env = env
-
-        required_ext = '.json' if self.ansi_mode else '.mp4'
-        if path is None:
-            if base_path is not None:
-                # Base path given, append ext
-                path = base_path + required_ext
-            else:
-                # Otherwise, just generate a unique filename
-                with tempfile.NamedTemporaryFile(suffix=required_ext, delete=False) as f:
-                    path = f.name
-        self.path = path
-
-        path_base, actual_ext = os.path.splitext(self.path)
-
-        if actual_ext != required_ext:
-            hint = " HINT: The environment is text-only, therefore we're recording its text output in a structured JSON format." if self.ansi_mode else ''
-            raise error.Error("Invalid path given: {} -- must have file extension {}.{}".format(self.path, required_ext, hint))
-        # Touch the file in any case, so we know it's present. (This
-        # corrects for platform platform differences. Using ffmpeg on
-        # OS X, the file is precreated, but not on Linux.
-        touch(path)
+        self.frame_writer = None if self.ansi_mode else frame_writer
+
+        if self.frame_writer is not None:
+            if path is not None:
+                raise error.Error("Frames are recorded to the path of the frame_writer, pass `base_path` for the metadata.")
+            if base_path is None:
+                with tempfile.NamedTemporaryFile(suffix='.meta.json', delete=False) as f:
+                    base_path = f.name[:-len('.meta.json')]
+            self.path = self.frame_writer.path
+            path_base = base_path
+        else:
+            required_ext = '.json' if self.ansi_mode else '.mp4'
+            if path is None:
+                if base_path is not None:
+                    # Base path given, append ext
+                    path = base_path + required_ext
+                else:
+                    # Otherwise, just generate a unique filename
+                    with tempfile.NamedTemporaryFile(suffix=required_ext, delete=False) as f:
+                        path = f.name
+            self.path = path
+
+            path_base, actual_ext = os.path.splitext(self.path)
+
+            if actual_ext != required_ext:
+                hint = " HINT: The environment is text-only, therefore we're recording its text output in a structured JSON format." if self.ansi_mode else ''
+                raise error.Error("Invalid path given: {} -- must have file extension {}.{}".format(self.path, required_ext, hint))
+            # Touch the file in any case, so we know it's present. (This
+            # corrects for platform platform differences. Using ffmpeg on
+            # OS X, the file is precreated, but not on Linux.
+            touch(path)
 
         self.frames_per_sec = env.metadata.get('video.frames_per_second', 30)
         self.encoder = None # lazily start the process
@@ -81,7 +104,10 @@ class VideoRecorder(object):
 
         # Dump metadata
         self.metadata = metadata or {}
-        self.metadata['content_type'] = 'video/vnd.openai.ansivid' if self.ansi_mode else 'video/mp4'
+        if self.frame_writer is not None:
+            self.metadata['content_type'] = RawFrameEncoder.content_type
+        else:
+            self.metadata['content_type'] = 'video/vnd.openai.ansivid' if self.ansi_mode else 'video/mp4'
         self.metadata_path = '{}.meta.json'.format(path_base)
         self.write_metadata()
 
@@ -123,10 +149,15 @@ class VideoRecorder(object):
         if self.encoder:
             logger.debug('Closing video encoder: path=%s', self.path)
             self.encoder.close()
+            if getattr(self.encoder, 'dropped_frames', 0) > 0:
+                self.metadata['dropped_frames'] = self.encoder.dropped_frames
+            if self.frame_writer is not None:
+                self.metadata['frame_store_episode'] = self.encoder.episode
             self.encoder = None
         else:
             # No frames captured. Set metadata, and remove the empty output file.
-            os.remove(self.path)
+            if self.frame_writer is None:
+                os.remove(self.path)
 
             if self.metadata is None:
                 self.metadata = {}
@@ -137,7 +168,7 @@ class VideoRecorder(object):
             logger.info('Cleaning up paths for broken video recorder: path=%s metadata_path=%s', self.path, self.metadata_path)
 
             # Might have crashed before even starting the output file, don't try to remove in that case.
-            if os.path.exists(self.path):
+            if self.frame_writer is None and os.path.exists(self.path):
                 os.remove(self.path)
 
             if self.metadata is None:
@@ -159,7 +190,13 @@ class VideoRecorder(object):
 
     def _encode_image_frame(self, frame):
         if not self.encoder:
-            self.encoder = ImageEncoder(self.path, frame.shape, self.frames_per_sec)
+            if self.frame_writer is not None:
+                self.encoder = RawFrameEncoder(self.frame_writer, self.metadata.get('episode_id', -1))
+            elif self.queue_size > 0:
+                self.encoder = AsyncImageEncoder(self.path, frame.shape, self.frames_per_sec,
+                                                 queue_size=self.queue_size, drop_frames=self.drop_frames)
+            else:
+                self.encoder = ImageEncoder(self.path, frame.shape, self.frames_per_sec)
             self.metadata['encoder_version'] = self.encoder.version_info
 
         try:
@@ -233,6 +270,22 @@ class TextEncoder(object):
     def version_info(self):
         return {'backend':'TextEncoder','version':1}
 
+def _check_image_frame(frame, frame_shape):
+    if not isinstance(frame, (np.ndarray, np.generic)):
+        raise error.InvalidFrame('Wrong type {} for {} (must be np.ndarray or np.generic)'.format(type(frame), frame))
+    if frame.shape != frame_shape:
+        raise error.InvalidFrame("Your frame has shape {}, but the VideoRecorder is configured for shape {}.".format(frame.shape, frame_shape))
+    if frame.dtype != np.uint8:
+        raise error.InvalidFrame("Your frame has data type {}, but we require uint8 (i.e. RGB values from 0-255).".format(frame.dtype))
+
+# Output of `<backend> -version`, which does not change while the process runs
+_backend_versions = {}
+
+def _backend_version(backend):
+    if backend not in _backend_versions:
+        _backend_versions[backend] = str(subprocess.check_output([backend, '-version'], stderr=subprocess.STDOUT))
+    return _backend_versions[backend]
+
 class ImageEncoder(object):
     def __init__(self, output_path, frame_shape, frames_per_sec):
         self.proc = None
@@ -259,8 +312,7 @@ class ImageEncoder(object):
     def version_info(self):
         return {
             'backend':self.backend,
-            'version':str(subprocess.check_output([self.backend, '-version'],
-                                                  stderr=subprocess.STDOUT)),
+            'version':_backend_version(self.backend),
             'cmdline':self.cmdline
         }
 
@@ -290,20 +342,96 @@ class ImageEncoder(object):
             self.proc = subprocess.Popen(self.cmdline, stdin=subprocess.PIPE)
 
     def capture_frame(self, frame):
-        if not isinstance(frame, (np.ndarray, np.generic)):
-            raise error.InvalidFrame('Wrong type {} for {} (must be np.ndarray or np.generic)'.format(type(frame), frame))
-        if frame.shape != self.frame_shape:
-            raise error.InvalidFrame("Your frame has shape {}, but the VideoRecorder is configured for shape {}.".format(frame.shape, self.frame_shape))
-        if frame.dtype != np.uint8:
-            raise error.InvalidFrame("Your frame has data type {}, but we require uint8 (i.e. RGB values from 0-255).".format(frame.dtype))
-
-        if distutils.version.LooseVersion(np.__version__) >= distutils.version.LooseVersion('1.9.0'):
-            self.proc.stdin.write(frame.tobytes())
-        else:
-            self.proc.stdin.write(frame.tostring())
+        _check_image_frame(frame, self.frame_shape)
+        self.proc.stdin.write(frame.tobytes())
 
     def close(self):
         self.proc.stdin.close()
         ret = self.proc.wait()
         if ret != 0:
             logger.error("VideoRecorder encoder exited with status {}".format(ret))
+
+
+class AsyncImageEncoder(ImageEncoder):
+    """ImageEncoder writing the frames to the encoder process from a background thread.
+
+    `capture_frame` copies each frame into one of `queue_size` preallocated buffers and
+    returns, so the env is only slowed down by the copy unless the encoder falls behind by
+    more than `queue_size` frames. Then `capture_frame` waits for a free buffer, or with
+    `drop_frames` skips the frame and counts it in `dropped_frames`. Since frames are copied,
+    envs may return the same render buffer on every call.
+    """
+
+    def __init__(self, output_path, frame_shape, frames_per_sec, queue_size=32, drop_frames=False):
+        if queue_size < 1:
+            raise error.Error('queue_size must be positive, got {}'.format(queue_size))
+        self.drop_frames = drop_frames
+        self.dropped_frames = 0
+        self._error = None
+        self._free = queue.Queue()
+        self._pending = queue.Queue()
+        super(AsyncImageEncoder, self).__init__(output_path, frame_shape, frames_per_sec)
+
+        for _ in range(queue_size):
+            self._free.put(np.empty(self.frame_shape, dtype=np.uint8))
+        self._thread = threading.Thread(target=self._write_frames, name='AsyncImageEncoder', daemon=True)
+        self._thread.start()
+
+    def capture_frame(self, frame):
+        _check_image_frame(frame, self.frame_shape)
+        if self._error is not None:
+            raise self._error
+        if self.drop_frames:
+            try:
+                buf = self._free.get_nowait()
+            except queue.Empty:
+                self.dropped_frames += 1
+                return
+        else:
+            buf = self._free.get()
+        np.copyto(buf, frame)
+        self._pending.put(buf)
+
+    def _write_frames(self):
+        while True:
+            buf = self._pending.get()
+            if buf is None:
+                return
+            if self._error is None:
+                try:
+                    self.proc.stdin.write(buf.data)
+                except Exception as e:
+                    # raised by the next capture_frame, the buffers are still recycled so it never blocks
+                    self._error = e
+            self._free.put(buf)
+
+    def close(self):
+        self._pending.put(None)
+        self._thread.join()
+        if self._error is not None:
+            logger.error('VideoRecorder encoder failed: %s', self._error)
+        super(AsyncImageEncoder, self).close()
+
+
+class RawFrameEncoder(object):
+    """Appends the frames of a video as an episode of a frame store, without encoding them."""
+
+    content_type = 'application/vnd.openai.gym-frames'
+
+    def __init__(self, frame_writer, episode_id=-1):
+        self.frame_writer = frame_writer
+        self.episode_id = episode_id
+        self.episode = None
+        self.frame_shape = None
+
+    def capture_frame(self, frame):
+        _check_image_frame(frame, self.frame_shape or getattr(frame, 'shape', None))
+        self.frame_shape = frame.shape
+        self.frame_writer.add_frame(frame)
+
+    def close(self):
+        self.episode = self.frame_writer.end_episode(self.episode_id)
+
+    @property
+    def version_info(self):
+        return {'backend': 'RawFrameEncoder', 'version': 1}
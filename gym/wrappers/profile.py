@@ -0,0 +1,149 @@
+import json
+import math
+
+from gym import Wrapper, error
+from gym.utils import atomic_write
+from gym.utils.phase_profiler import clock
+
+
+class LatencyHistogram(object):
+    """Histogram of latencies in fixed, logarithmically spaced buckets.
+
+    The buckets span `min_s` to `max_s` seconds with `buckets_per_decade` buckets per factor
+    of 10, plus an underflow and an overflow bucket. Adding a latency only increments a
+    bucket count, and quantiles are estimated by the upper edge of their bucket (so they
+    are at most a factor 10 ** (1 / buckets_per_decade) too large).
+    """
+
+    def __init__(self, min_s=1e-7, max_s=100.0, buckets_per_decade=20):
+        self.min_s = min_s
+        self.max_s = max_s
+        self.buckets_per_decade = buckets_per_decade
+        self._log_min = math.log(min_s)
+        self._scale = buckets_per_decade / math.log(10)
+        n_buckets = int(math.ceil(math.log10(max_s / min_s) * buckets_per_decade))
+        self.counts = [0] * (n_buckets + 2)
+        self.count = 0
+        self.total_s = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        if seconds < self.min_s:
+            i = 0
+        else:
+            i = min(int((math.log(seconds) - self._log_min) * self._scale) + 1, len(self.counts) - 1)
+        self.counts[i] += 1
+        self.count += 1
+        self.total_s += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def upper_edge(self, i) -> float:
+        """Returns the upper edge of bucket `i`, in seconds."""
+        if i == len(self.counts) - 1:
+            return self.max
+        return self.min_s * 10 ** (i / self.buckets_per_decade)
+
+    def quantile(self, q) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c > 0:
+                return min(self.upper_edge(i), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total_s / self.count if self.count > 0 else 0.0
+
+    def summary(self) -> dict:
+        return dict(count=self.count, mean_ms=1e3 * self.mean, p50_ms=1e3 * self.quantile(0.5),
+                    p99_ms=1e3 * self.quantile(0.99), max_ms=1e3 * self.max)
+
+    def to_dict(self) -> dict:
+        """Returns the summary and the non-empty buckets, as [upper edge (ms), count] pairs."""
+        d = self.summary()
+        d['buckets'] = [[1e3 * self.upper_edge(i), c] for i, c in enumerate(self.counts) if c > 0]
+        return d
+
+
+class Profile(Wrapper):
+    """Records the latencies of the `reset`, `step` and `render` calls of an env.
+
+    Latencies are measured with a monotonic clock and added to a LatencyHistogram per call.
+    With `breakdown=True`, the step of a RobotEnv is also split into its stages
+    ('_set_action', 'sim.step', '_step_callback', '_get_obs' and 'compute_reward').
+    `summary` returns the count, mean, p50, p99 and max latency of each call in ms,
+    `export_json` writes them with the histogram buckets, and `sink` is called with the
+    summary every `report_every` steps (if set) and on close.
+    """
+
+    def __init__(self, env, breakdown=False, sink=None, report_every=None, **histogram_kwargs):
+        super(Profile, self).__init__(env)
+        self.sink = sink
+        self.report_every = report_every
+        self._histogram_kwargs = histogram_kwargs
+        self.histograms = dict()
+        self._reset_hist = self._histogram('reset')
+        self._step_hist = self._histogram('step')
+        self._render_hist = self._histogram('render')
+        self._n_steps = 0
+
+        self.breakdown = breakdown
+        if breakdown:
+            if not hasattr(self.unwrapped, 'step_timer'):
+                raise error.Error('Step breakdown needs a RobotEnv, not {}'.format(self.unwrapped))
+            # the stages are timed by RobotEnv.step, found by the class defining _timed_step so
+            # that RobotEnv (and mujoco_py) need not be imported here
+            env_cls = type(self.unwrapped)
+            timed_cls = next((c for c in env_cls.__mro__ if '_timed_step' in vars(c)), None)
+            if timed_cls is None or env_cls.step is not timed_cls.step:
+                raise error.Error('Step breakdown needs the step of RobotEnv, but {} overrides it'.format(
+                    env_cls.__name__))
+            self.unwrapped.step_timer = self._record_stage
+
+    def _histogram(self, name) -> LatencyHistogram:
+        if name not in self.histograms:
+            self.histograms[name] = LatencyHistogram(**self._histogram_kwargs)
+        return self.histograms[name]
+
+    def _record_stage(self, stage, seconds):
+        self._histogram('step/' + stage).add(seconds)
+
+    def step(self, action):
+        t = clock()
+        result = self.env.step(action)
+        self._step_hist.add(clock() - t)
+        self._n_steps += 1
+        if self.report_every and self.sink is not None and self._n_steps % self.report_every == 0:
+            self.sink(self.summary())
+        return result
+
+    def reset(self, **kwargs):
+        t = clock()
+        observation = self.env.reset(**kwargs)
+        self._reset_hist.add(clock() - t)
+        return observation
+
+    def render(self, mode='human', **kwargs):
+        t = clock()
+        result = self.env.render(mode, **kwargs)
+        self._render_hist.add(clock() - t)
+        return result
+
+    def close(self):
+        if self.breakdown and self.unwrapped.step_timer == self._record_stage:
+            self.unwrapped.step_timer = None
+        if self.sink is not None:
+            self.sink(self.summary())
+        return self.env.close()
+
+    def summary(self) -> dict:
+        return {name: h.summary() for name, h in self.histograms.items() if h.count > 0}
+
+    def export_json(self, path):
+        with atomic_write.atomic_write(path) as f:
+            json.dump({name: h.to_dict() for name, h in self.histograms.items() if h.count > 0}, f)
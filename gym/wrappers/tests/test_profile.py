@@ -0,0 +1,86 @@
+import json
+import os
+
+import pytest
+
+import gym
+from gym import error
+from gym.wrappers import Profile
+from gym.wrappers.monitoring.tests import helpers
+from gym.wrappers.profile import LatencyHistogram
+
+
+def test_latency_histogram():
+    h = LatencyHistogram(min_s=1e-6, max_s=1.0, buckets_per_decade=10)
+    for _ in range(98):
+        h.add(1e-4)
+    h.add(1e-2)
+    h.add(10.0)
+    assert h.count == 100
+    assert 1e-4 <= h.quantile(0.5) <= 1e-4 * 10 ** 0.1
+    assert 1e-2 <= h.quantile(0.99) <= 1e-2 * 10 ** 0.1
+    assert h.quantile(1.0) == h.max == 10.0
+    h.add(0.0)
+    assert h.counts[0] == 1
+
+
+def test_profile():
+    reports = []
+    env = Profile(gym.make('CartPole-v0'), sink=reports.append, report_every=10)
+    env.seed(0)
+    env.reset()
+    for _ in range(20):
+        _, _, done, _ = env.step(0)
+        if done:
+            env.reset()
+    summary = env.summary()
+    assert summary['step']['count'] == 20
+    assert summary['reset']['count'] >= 1
+    assert 0 < summary['step']['p50_ms'] <= summary['step']['max_ms']
+    assert 'render' not in summary
+    assert len(reports) == 2
+
+    with helpers.tempdir() as temp:
+        path = os.path.join(temp, 'profile.json')
+        env.export_json(path)
+        with open(path) as f:
+            exported = json.load(f)
+        assert sum(c for _, c in exported['step']['buckets']) == 20
+
+    env.close()
+    assert len(reports) == 3
+
+    with pytest.raises(error.Error):
+        Profile(gym.make('CartPole-v0'), breakdown=True)
+
+
+class TimedEnv(gym.Env):
+    # the step timing protocol of RobotEnv
+    def __init__(self):
+        self.step_timer = None
+
+    def step(self, action):
+        if self.step_timer is not None:
+            return self._timed_step(action)
+        return 0, 0.0, False, dict()
+
+    def _timed_step(self, action):
+        self.step_timer('sim.step', 1e-3)
+        return 0, 0.0, False, dict()
+
+
+class SteppedEnv(TimedEnv):
+    def step(self, action):
+        return super(SteppedEnv, self).step(action)
+
+
+def test_profile_breakdown():
+    env = Profile(TimedEnv(), breakdown=True)
+    env.step(0)
+    assert env.summary()['step/sim.step']['count'] == 1
+    env.close()
+    assert env.unwrapped.step_timer is None
+
+    # the stages of an overridden step would not be timed
+    with pytest.raises(error.Error):
+        Profile(SteppedEnv(), breakdown=True)
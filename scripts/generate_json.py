@@ -6,7 +6,7 @@ import sys
 import argparse
 
 from gym.envs.tests.spec_list import should_skip_env_spec_for_tests
-from gym.envs.tests.test_envs_semantics import generate_rollout_hash, hash_object
+from gym.utils.rollout_hash import STREAMS, fingerprint_specs
 
 DATA_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'gym', 'envs', 'tests')
 ROLLOUT_STEPS = 100
@@ -20,12 +20,7 @@ if not os.path.isfile(ROLLOUT_FILE):
     with open(ROLLOUT_FILE, "w") as outfile:
         json.dump({}, outfile, indent=2)
 
-def update_rollout_dict(spec, rollout_dict):
-    """
-    Takes as input the environment spec for which the rollout is to be generated,
-    and the existing dictionary of rollouts. Returns True iff the dictionary was
-    modified.
-    """
+def should_generate_rollout(spec):
     # Skip platform-dependent
     if should_skip_env_spec_for_tests(spec):
         logger.info("Skipping tests for {}".format(spec.id))
@@ -35,49 +30,55 @@ def update_rollout_dict(spec, rollout_dict):
     if spec.nondeterministic:
         logger.info("Skipping tests for nondeterministic env {}".format(spec.id))
         return False
+    return True
 
-    logger.info("Generating rollout for {}".format(spec.id))
-
-    try:
-        observations_hash, actions_hash, rewards_hash, dones_hash = generate_rollout_hash(spec)
-    except:
+def update_rollout_dict(spec_id, fingerprint, rollout_dict):
+    """
+    Takes as input the id of the environment spec, the fingerprint of its rollout
+    and the existing dictionary of rollouts. Returns True iff the dictionary was
+    modified.
+    """
+    if 'error' in fingerprint:
         # If running the env generates an exception, don't write to the rollout file
-        logger.warn("Exception {} thrown while generating rollout for {}. Rollout not added.".format(sys.exc_info()[0], spec.id))
+        logger.warn("Exception {} thrown while generating rollout for {}. Rollout not added.".format(fingerprint['error'], spec_id))
         return False
 
-    rollout = {}
-    rollout['observations'] = observations_hash
-    rollout['actions'] = actions_hash
-    rollout['rewards'] = rewards_hash
-    rollout['dones'] = dones_hash
+    rollout = {key: fingerprint[key] for key in STREAMS}
 
-    existing = rollout_dict.get(spec.id)
+    existing = rollout_dict.get(spec_id)
     if existing:
         differs = False
         for key, new_hash in rollout.items():
             differs = differs or existing[key] != new_hash
         if not differs:
-            logger.debug("Hashes match with existing for {}".format(spec.id))
+            logger.debug("Hashes match with existing for {}".format(spec_id))
             return False
         else:
-            logger.warn("Got new hash for {}. Overwriting.".format(spec.id))
+            logger.warn("Got new hash for {}. Overwriting.".format(spec_id))
 
-    rollout_dict[spec.id] = rollout
+    rollout_dict[spec_id] = rollout
     return True
 
-def add_new_rollouts(spec_ids, overwrite):
+def add_new_rollouts(spec_ids, overwrite, n_workers=None):
     environments = [spec for spec in envs.registry.all() if spec._entry_point is not None]
     if spec_ids:
         environments = [spec for spec in environments if spec.id in spec_ids]
         assert len(environments) == len(spec_ids), "Some specs not found"
     with open(ROLLOUT_FILE) as data_file:
         rollout_dict = json.load(data_file)
-    modified = False
+
+    todo = []
     for spec in environments:
         if not overwrite and spec.id in rollout_dict:
             logger.debug("Rollout already exists for {}. Skipping.".format(spec.id))
-        else:
-            modified = update_rollout_dict(spec, rollout_dict) or modified
+        elif should_generate_rollout(spec):
+            todo.append(spec.id)
+
+    logger.info("Generating rollouts for {} envs".format(len(todo)))
+    fingerprints = fingerprint_specs(todo, n_steps=ROLLOUT_STEPS, n_workers=n_workers)
+    modified = False
+    for spec_id, fingerprint in fingerprints.items():
+        modified = update_rollout_dict(spec_id, fingerprint, rollout_dict) or modified
 
     if modified:
         logger.info("Writing new rollout file to {}".format(ROLLOUT_FILE))
@@ -91,8 +92,9 @@ if __name__ == '__main__':
     parser.add_argument('-f', '--force', action='store_true', help='Overwrite '+
         'existing rollouts if hashes differ.')
     parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='number of processes (default: number of CPUs)')
     parser.add_argument('specs', nargs='*', help='ids of env specs to check (default: all)')
     args = parser.parse_args()
     if args.verbose:
         logger.set_level(logger.INFO)
-    add_new_rollouts(args.specs, args.force)
+    add_new_rollouts(args.specs, args.force, n_workers=args.workers)